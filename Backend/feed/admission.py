@@ -0,0 +1,132 @@
+"""
+Admission control for API requests.
+
+``AdmissionControlMiddleware`` asks an ``AdmissionController`` before every
+request reaches a view. Requests that would only queue up behind the database
+are turned away at once with ``429`` or ``503`` and a ``Retry-After`` header,
+instead of making every other request slower:
+
+* writes are refused while write latency is over ``ADMISSION_WRITE_LATENCY_MS``,
+  judged by the oldest write still in flight and a decaying average of
+  finished ones
+* reads and writes each have a cap on requests in flight
+* writes spend a token from the client's bucket (``429`` when empty) and
+  from a global one (``503``)
+
+State is per process, like the connection pool it protects.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import count
+
+
+class Rejected(Exception):
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBuckets:
+    """
+    ``rate`` tokens a second per key, at most ``burst`` saved up. Only the
+    ``max_keys`` most recently used keys are remembered; a forgotten key
+    starts over with a full bucket.
+    """
+
+    def __init__(self, rate, burst, max_keys=10_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key=None, now=None):
+        """Spend a token. Returns 0, or the seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class AdmissionController:
+
+    def __init__(self, user_rate=10, user_burst=20, global_rate=500, global_burst=1000,
+                 max_reads=64, max_writes=4, write_latency_target=0.25, half_life=1.0):
+        self.user_buckets = TokenBuckets(user_rate, user_burst)
+        self.global_bucket = TokenBuckets(global_rate, global_burst, max_keys=1)
+        self.limits = {False: max_reads, True: max_writes}
+        self.write_latency_target = write_latency_target
+        self.half_life = half_life
+
+        self._in_flight = {False: 0, True: 0}
+        # id -> start time of every write being served
+        self._writes = {}
+        self._ids = count()
+        self._latency = 0.0
+        self._latency_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def write_latency(self, now=None):
+        """The larger of the oldest in-flight write's age and the recent average."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            decayed = self._latency * 0.5 ** ((now - self._latency_at) / self.half_life)
+            oldest = now - min(self._writes.values()) if self._writes else 0.0
+        return max(decayed, oldest)
+
+    @contextmanager
+    def admit(self, write, key=None):
+        """
+        Hold a slot for one request; ``write`` says whether it mutates.
+        Raises ``Rejected`` when it should be turned away.
+        """
+        if write and self.write_latency() > self.write_latency_target:
+            raise Rejected(503, "write latency over target", self.half_life)
+
+        with self._lock:
+            if self._in_flight[write] >= self.limits[write]:
+                raise Rejected(503, "too many requests in flight", 1)
+            self._in_flight[write] += 1
+
+        request_id = None
+        try:
+            if write:
+                wait = self.user_buckets.take(key)
+                if wait:
+                    raise Rejected(429, "rate limit exceeded", wait)
+                wait = self.global_bucket.take()
+                if wait:
+                    raise Rejected(503, "server busy", wait)
+
+                with self._lock:
+                    request_id = next(self._ids)
+                    self._writes[request_id] = time.monotonic()
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[write] -= 1
+                if request_id is not None:
+                    self._record(time.monotonic() - self._writes.pop(request_id))
+
+    def _record(self, latency):
+        # Exponentially decaying average; called with the lock held
+        now = time.monotonic()
+        decayed = self._latency * 0.5 ** ((now - self._latency_at) / self.half_life)
+        self._latency = 0.8 * decayed + 0.2 * latency
+        self._latency_at = now
@@ -1,30 +1,107 @@
-from rest_framework.authentication import BaseAuthentication
-from rest_framework.exceptions import AuthenticationFailed
+from functools import lru_cache
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core import signing
+from django.db.models.signals import post_save, post_delete
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
 import logging
 
 logger = logging.getLogger(__name__)
 
+TOKEN_SALT = "feed.auth.token"
+
+
+def issue_token(user):
+    """Signed, timestamped token carrying the user's id and username."""
+    return signing.dumps({"uid": user.id, "un": user.username}, salt=TOKEN_SALT)
+
+
+def read_token(token):
+    """
+    Return the token's ``(user_id, username)``.
+    Raises ``signing.BadSignature`` (or its ``SignatureExpired`` subclass).
+    """
+    payload = signing.loads(token, salt=TOKEN_SALT, max_age=settings.AUTH_TOKEN_MAX_AGE)
+    return payload["uid"], payload["un"]
+
+
+@lru_cache(maxsize=1024)
+def load_user(user_id):
+    """Per-process cache of full ``User`` rows. Raises ``User.DoesNotExist``."""
+    return User.objects.get(id=user_id)
+
+
+def _clear_user_cache(sender, **kwargs):
+    load_user.cache_clear()
+
+
+post_save.connect(_clear_user_cache, sender=User, dispatch_uid="feed.auth.clear_user_cache")
+post_delete.connect(_clear_user_cache, sender=User, dispatch_uid="feed.auth.clear_user_cache_delete")
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticate with ``Authorization: Bearer <token>`` as issued by the
+    login and signup views. The user must still exist and be active; rows
+    come from ``load_user()``, so that's one query per user and process.
+    """
+
+    keyword = b"bearer"
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+
+        if not auth or auth[0].lower() != self.keyword:
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed("Invalid token header")
+
+        try:
+            user_id, username = read_token(auth[1].decode())
+        except (signing.BadSignature, UnicodeError):
+            raise AuthenticationFailed("Invalid or expired token")
+
+        try:
+            user = load_user(user_id)
+        except User.DoesNotExist:
+            raise AuthenticationFailed("User not found")
+        if not user.is_active:
+            raise AuthenticationFailed("User inactive or deleted")
+
+        return (user, None)
+
+    def authenticate_header(self, request):
+        return "Bearer"
+
 
 class QueryParamAuthentication(BaseAuthentication):
     """
     Authenticate using user_id from query parameter or request body.
+    Dev mode only, enabled by ``MOCK_AUTH_ENABLED``.
     """
     
     def authenticate(self, request):
+        if not settings.MOCK_AUTH_ENABLED:
+            return None
+
         # Get user_id from query parameter or POST data
         user_id = request.GET.get('user_id') or request.POST.get('user_id')
         
-        logger.info(f"QueryParamAuthentication: user_id = {user_id}")
+        logger.debug("QueryParamAuthentication: user_id = %s", user_id)
         
         if not user_id:
-            logger.warning("QueryParamAuthentication: No user_id provided")
             return None
+
+        # MockAuthMiddleware has usually resolved the same user already
+        user = getattr(request._request, "user", None)
+        if user is not None and user.is_authenticated and str(user.id) == user_id:
+            return (user, None)
         
         try:
-            user = User.objects.get(id=int(user_id))
-            logger.info(f"QueryParamAuthentication: ✓ Authenticated as {user.username}")
+            user = load_user(int(user_id))
             return (user, None)
         except (User.DoesNotExist, ValueError) as e:
-            logger.error(f"QueryParamAuthentication: ✗ Failed: {e}")
+            logger.warning("QueryParamAuthentication: failed for %s: %s", user_id, e)
             raise AuthenticationFailed(f'Invalid user_id: {user_id}')
@@ -0,0 +1,263 @@
+"""
+Batched likes, unlikes and comments.
+
+``run_batch()`` replays an ordered list of operations against an in-memory
+copy of the rows they touch, so each one gets the same status and body its
+single-op endpoint would return. The net effect is then written in one
+transaction with bulk inserts, deletes and counter updates.
+
+Likes that cancel out within a batch are never written: an existing like
+that is removed and re-added keeps its original row, and a new like that is
+removed again never reaches the database.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from .karma import POST_LIKE_POINTS, COMMENT_LIKE_POINTS, bucket_start, forget_likes, record_karma, subtree_likes
+from .likes import adjust_like_counts
+from .models import Post, Comment, Like, path_segment
+
+OPS = ("like_post", "unlike_post", "like_comment", "unlike_comment", "add_comment", "delete_comment")
+
+# Marks a like created by this batch, as opposed to an existing Like row
+NEW = object()
+
+
+class InvalidOperation(ValueError):
+    pass
+
+
+def _id(op, field):
+    value = op.get(field)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise InvalidOperation(f"{field} required")
+    return value
+
+
+def _ok(data):
+    return {"status": 200, "data": data}
+
+
+def _error(status, message):
+    return {"status": status, "data": {"error": message}}
+
+
+class _Batch:
+    """Replays operations in order and collects their net effect."""
+
+    def __init__(self, user, operations):
+        self.user = user
+        self.operations = operations
+
+        post_ids, comment_ids = set(), set()
+        for op in operations:
+            if isinstance(op.get("post_id"), int):
+                post_ids.add(op["post_id"])
+            for field in ("comment_id", "parent"):
+                if isinstance(op.get(field), int):
+                    comment_ids.add(op[field])
+
+        self.post_authors = dict(
+            Post.objects.filter(id__in=post_ids).values_list("id", "author_id")
+        )
+        self.comments = {
+            c[0]: c for c in
+            Comment.objects.filter(id__in=comment_ids).values_list("id", "post_id", "author_id", "path")
+        }
+
+        # target -> existing (like_id, created_at) or NEW, for what ``user`` likes right now
+        self.liked = {"post": {}, "comment": {}}
+        # target -> (like_id, created_at) of existing likes removed by this batch
+        self.removed = {"post": {}, "comment": {}}
+        existing = Like.objects.filter(user=user).filter(
+            Q(post_id__in=post_ids) | Q(comment_id__in=self.comments)
+        )
+        for like_id, post_id, comment_id, created_at in existing.values_list(
+            "id", "post_id", "comment_id", "created_at"
+        ):
+            kind, target = ("post", post_id) if post_id is not None else ("comment", comment_id)
+            self.liked[kind][target] = (like_id, created_at)
+
+        self.new_comments = []
+        self.deleted_comments = set()
+
+    def run(self):
+        results = []
+        for op in self.operations:
+            try:
+                results.append(getattr(self, op["op"])(op))
+            except InvalidOperation as e:
+                results.append(_error(400, str(e)))
+        return results
+
+    def _like(self, kind, target):
+        if target in self.liked[kind]:
+            return False
+        # Re-liking what this batch unliked just keeps the original row
+        self.liked[kind][target] = self.removed[kind].pop(target, NEW)
+        return True
+
+    def _unlike(self, kind, target):
+        if target not in self.liked[kind]:
+            return False
+        like = self.liked[kind].pop(target)
+        if like is not NEW:
+            self.removed[kind][target] = like
+        return True
+
+    def _comment_exists(self, comment_id):
+        return comment_id in self.comments and comment_id not in self.deleted_comments
+
+    def like_post(self, op):
+        post_id = _id(op, "post_id")
+        if post_id not in self.post_authors:
+            return _error(404, "post not found")
+        if not self._like("post", post_id):
+            return _error(400, "already liked")
+        return _ok({"status": "liked"})
+
+    def unlike_post(self, op):
+        if not self._unlike("post", _id(op, "post_id")):
+            return _error(404, "like not found")
+        return _ok({"status": "unliked"})
+
+    def like_comment(self, op):
+        comment_id = _id(op, "comment_id")
+        if not self._comment_exists(comment_id):
+            return _error(404, "comment not found")
+        if not self._like("comment", comment_id):
+            return _error(400, "already liked")
+        return _ok({"ok": True})
+
+    def unlike_comment(self, op):
+        if not self._unlike("comment", _id(op, "comment_id")):
+            return _error(404, "like not found")
+        return _ok({"ok": True})
+
+    def add_comment(self, op):
+        post_id = _id(op, "post_id")
+        content = op.get("content")
+        parent_id = op.get("parent")
+
+        if not content:
+            return _error(400, "content required")
+        if post_id not in self.post_authors:
+            return _error(404, "post not found")
+        if parent_id is not None:
+            if not isinstance(parent_id, int) or not self._comment_exists(parent_id):
+                return _error(404, "parent not found")
+            if self.comments[parent_id][1] != post_id:
+                return _error(400, "parent is on another post")
+
+        comment = Comment(post_id=post_id, author=self.user, content=content, parent_id=parent_id)
+        if parent_id is not None:
+            # bulk_create does not call save(), which fills this in
+            comment.path = self.comments[parent_id][3] + path_segment(parent_id)
+        result = _ok({"status": "comment added"})
+        self.new_comments.append((comment, result))
+        return result
+
+    def delete_comment(self, op):
+        comment_id = _id(op, "comment_id")
+        if not self._comment_exists(comment_id):
+            return _error(404, "not found")
+
+        _, post_id, author_id, _ = self.comments[comment_id]
+        if author_id != self.user.id:
+            return _error(403, "not authorized")
+
+        self.deleted_comments.add(comment_id)
+        return _ok({"status": "deleted", "post_id": post_id})
+
+    def _author(self, kind, target):
+        if kind == "post":
+            return self.post_authors[target], POST_LIKE_POINTS
+        return self.comments[target][2], COMMENT_LIKE_POINTS
+
+    def apply(self):
+        """
+        Write the net effect and return ``(like_targets, comments_added,
+        comments_deleted)`` for the socket events.
+        """
+        deltas = {"post": defaultdict(int), "comment": defaultdict(int)}
+        karma = defaultdict(int)
+        karma_at = {}
+
+        def add_karma(kind, target, sign, at):
+            author_id, points = self._author(kind, target)
+            key = (author_id, bucket_start(at))
+            karma[key] += sign * points
+            karma_at[key] = at
+
+        with transaction.atomic():
+            comments = [comment for comment, _ in self.new_comments]
+            Comment.objects.bulk_create(comments)
+
+            removed = [(kind, target, like) for kind in self.removed
+                       for target, like in self.removed[kind].items()]
+            Like.objects.filter(id__in=[like_id for _, _, (like_id, _) in removed]).delete()
+            for kind, target, (_, created_at) in removed:
+                deltas[kind][target] -= 1
+                add_karma(kind, target, -1, created_at)
+
+            # Likes on comments deleted later in the batch would only be cascaded away
+            created = [
+                Like(user=self.user, post_id=target) if kind == "post" else Like(user=self.user, comment_id=target)
+                for kind in self.liked for target, like in self.liked[kind].items()
+                if like is NEW and not (kind == "comment" and target in self.deleted_comments)
+            ]
+            Like.objects.bulk_create(created)
+            for like in created:
+                kind, target = ("post", like.post_id) if like.post_id is not None else ("comment", like.comment_id)
+                deltas[kind][target] += 1
+                add_karma(kind, target, 1, like.created_at)
+
+            adjust_like_counts(Post, deltas["post"])
+            adjust_like_counts(Comment, deltas["comment"])
+
+            for key, points in karma.items():
+                if points:
+                    record_karma(key[0], points, karma_at[key])
+
+            if self.deleted_comments:
+                forget_likes(subtree_likes(
+                    (comment_id, post_id, path) for comment_id, post_id, _, path in
+                    (self.comments[comment_id] for comment_id in self.deleted_comments)
+                ))
+            Comment.objects.filter(id__in=self.deleted_comments).delete()
+
+        for comment, result in self.new_comments:
+            result["data"]["comment"] = {
+                "id": comment.id,
+                "author": self.user.username,
+                "content": comment.content,
+                "children": [],
+            }
+
+        like_targets = [(target, None) for target in deltas["post"]] + [
+            (self.comments[target][1], target) for target in deltas["comment"]
+            if target not in self.deleted_comments
+        ]
+        comments_deleted = [(comment_id, self.comments[comment_id][1]) for comment_id in self.deleted_comments]
+        return like_targets, comments, comments_deleted
+
+
+def run_batch(user, operations):
+    """
+    Run ``operations`` (dicts with an ``op`` from ``OPS`` and its arguments)
+    for ``user``. Returns ``(results, changes)``: one ``{"status", "data"}``
+    per operation, and ``None`` or the ``(like_targets, comments_added,
+    comments_deleted)`` written. Raises ``InvalidOperation`` for a malformed
+    list, before anything is written.
+    """
+    for op in operations:
+        if not isinstance(op, dict) or op.get("op") not in OPS:
+            raise InvalidOperation(f"unknown op: {op!r}"[:200])
+
+    batch = _Batch(user, operations)
+    results = batch.run()
+    if not any(result["status"] == 200 for result in results):
+        return results, None
+    return results, batch.apply()
@@ -0,0 +1,46 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks run against a throwaway test database so they never touch
+``db.sqlite3``.
+"""
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def scratch_database(name=None):
+    """
+    ``name`` puts it in a file rather than SQLite's shared-cache memory
+    database, for benchmarks whose threads need their own connections.
+    """
+    old_name = connection.settings_dict["NAME"]
+    test_settings = connection.settings_dict["TEST"]
+    old_test_name = test_settings.get("NAME")
+    if name:
+        test_settings["NAME"] = name
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings["NAME"] = old_test_name
+
+
+def timeit(fn, repeat=5):
+    """Run ``fn`` ``repeat`` times and summarize the wall-clock timings in ms."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "max_ms": round(max(samples), 3),
+    }
+
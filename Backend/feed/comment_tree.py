@@ -0,0 +1,112 @@
+"""
+Depth-limited comment subtrees, for expanding long threads on demand.
+
+Replies are found with range scans on ``Comment.path`` instead of following
+``parent`` links, so a subtree costs the same three queries (root, nodes,
+child counts) however large the thread is. Nodes are picked breadth first,
+oldest first within a level, up to ``limit``, which means every returned
+reply comes with its parent. Each node carries ``child_count``, and
+``has_more`` when some of its replies were left out; the client fetches those
+with ``root=<its id>``.
+"""
+from django.conf import settings
+from django.db.models import Count, Q
+from django.db.models.functions import Length
+
+from .fast_feed import COMMENT_FIELDS, format_datetime
+from .models import Comment, PATH_STEP, path_segment
+
+
+def parse_bound(value, default, maximum):
+    """Clamp a positive integer query param to ``1..maximum``."""
+    if value in (None, ""):
+        return default
+    try:
+        return max(1, min(int(value), maximum))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_comment_id(value):
+    """An optional id param; ``ValueError`` unless it is an id paths can hold."""
+    if value in (None, ""):
+        return None
+    if not value.isdigit() or int(value) >= 36 ** PATH_STEP:
+        raise ValueError(f"invalid comment id: {value}")
+    return int(value)
+
+
+def parse_depth(value):
+    return parse_bound(value, settings.COMMENT_TREE_DEPTH, settings.COMMENT_TREE_MAX_DEPTH)
+
+
+def parse_limit(value):
+    return parse_bound(value, settings.COMMENT_TREE_LIMIT, settings.COMMENT_TREE_MAX_LIMIT)
+
+
+def comment_subtree(post_id, root_id=None, depth=1, limit=50, after=None):
+    """
+    Replies to comment ``root_id``, or the top-level comments of ``post_id``,
+    nested ``depth`` levels deep and at most ``limit`` comments in total.
+    ``after`` skips the replies up to that id, with everything below them,
+    to page through a long list of replies.
+
+    Returns ``{"comments": [...], "has_more": bool}``, where ``has_more``
+    says whether replies after the last one returned exist. Raises
+    ``Comment.DoesNotExist`` when ``root_id`` is not a comment on the post.
+    """
+    prefix = ""
+    if root_id is not None:
+        root_path = Comment.objects.values_list("path", flat=True).get(id=root_id, post_id=post_id)
+        prefix = root_path + path_segment(root_id)
+
+    rows = Comment.objects.filter(post_id=post_id)
+    if prefix:
+        # "~" sorts after every path character
+        rows = rows.filter(path__gte=prefix, path__lt=prefix + "~")
+    if after is not None:
+        # Descendants of the skipped replies have paths below the next id's
+        rows = rows.filter(Q(path=prefix, id__gt=after) | Q(path__gte=prefix + path_segment(after + 1)))
+
+    # One extra row tells whether more replies follow at the top level
+    rows = list(
+        rows.annotate(path_length=Length("path"))
+        .filter(path_length__lte=len(prefix) + (depth - 1) * PATH_STEP)
+        .order_by("path_length", "id")
+        .values_list(*COMMENT_FIELDS, "path")[:limit + 1]
+    )
+    has_more = len(rows) > limit and rows[limit][-1] == prefix
+    rows = rows[:limit]
+
+    child_paths = {row[-1] + path_segment(row[0]): row[0] for row in rows}
+    child_counts = dict(
+        Comment.objects.filter(post_id=post_id, path__in=list(child_paths))
+        .values("path").annotate(count=Count("id")).values_list("path", "count")
+    ) if child_paths else {}
+
+    lookup = {}
+    comments = []
+    for pk, username, author_id, content, parent_id, post, created_at, like_count, path in rows:
+        node = {
+            "id": pk,
+            "author_id": author_id,
+            "content": content,
+            "parent_id": parent_id,
+            "post_id": post,
+            "created_at": format_datetime(created_at),
+            "like_count": like_count,
+            "author": username,
+            "children": [],
+        }
+        lookup[pk] = node
+        if path == prefix:
+            comments.append(node)
+        else:
+            lookup[parent_id]["children"].append(node)
+
+    for child_path, pk in child_paths.items():
+        node = lookup[pk]
+        node["child_count"] = child_counts.get(child_path, 0)
+        node["has_more"] = node["child_count"] > len(node["children"])
+
+    return {"comments": comments, "has_more": has_more}
@@ -0,0 +1,237 @@
+"""
+Bounded background dispatcher for socket events.
+
+Replaces one-thread-per-event with a fixed pool of worker threads draining a
+bounded queue. Tasks submitted with a ``key`` are held for a short coalescing
+window, queued apart from the others so they don't hold them up; submitting
+the same key again while the first is still queued just swaps in the newer
+task, so a burst of likes on one post produces one emit.
+A task's ``on_drop`` callback runs if overflow drops it instead, e.g. to
+release a lock the task would have.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+
+class _Task:
+    __slots__ = ("key", "func", "queued_at", "ready_at", "on_drop")
+
+    def __init__(self, key, func, on_drop=None):
+        self.key = key
+        self.func = func
+        self.on_drop = on_drop
+
+
+class EventDispatcher:
+
+    def __init__(self, workers=2, maxsize=1000, overflow=DROP_OLDEST,
+                 coalesce_window=0.05, block_timeout=1.0):
+        if overflow not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+
+        self.workers = workers
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.coalesce_window = coalesce_window
+        self.block_timeout = block_timeout
+
+        # Unkeyed tasks, ready at once, and keyed ones waiting out the
+        # coalescing window; each is in ready_at order as the window is fixed
+        self._ready = deque()
+        self._delayed = deque()
+        self._pending = {}
+        self._in_flight = 0
+        self._threads = []
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+
+        self._counters = dict.fromkeys(
+            ("submitted", "coalesced", "dropped", "processed", "failed"), 0
+        )
+
+    def submit(self, func, key=None, on_drop=None):
+        """
+        Queue ``func``; returns False if it was dropped on overflow. Either
+        way ``on_drop`` is called if overflow drops it, now or later.
+        """
+        task = _Task(key, func, on_drop)
+        dropped = []
+        with self._lock:
+            accepted = self._submit(task, dropped)
+        for task in dropped:
+            if task.on_drop is not None:
+                try:
+                    task.on_drop()
+                except Exception:
+                    logger.exception("Event drop callback failed")
+        return accepted
+
+    def _submit(self, task, dropped):
+        self._counters["submitted"] += 1
+
+        if self._coalesce(task):
+            return True
+
+        if not self._make_room(dropped):
+            self._counters["dropped"] += 1
+            dropped.append(task)
+            return False
+
+        # Waiting for room let go of the lock, so the key may be queued now
+        if self._coalesce(task):
+            return True
+
+        task.queued_at = time.monotonic()
+        if task.key is None:
+            task.ready_at = task.queued_at
+            self._ready.append(task)
+        else:
+            task.ready_at = task.queued_at + self.coalesce_window
+            self._delayed.append(task)
+            self._pending[task.key] = task
+
+        self._ensure_workers()
+        self._not_empty.notify()
+        return True
+
+    def _coalesce(self, task):
+        pending = self._pending.get(task.key) if task.key is not None else None
+        if pending is None:
+            return False
+        pending.func, pending.on_drop = task.func, task.on_drop
+        self._counters["coalesced"] += 1
+        return True
+
+    def _queued(self):
+        return len(self._ready) + len(self._delayed)
+
+    def _make_room(self, dropped):
+        if self.overflow == BLOCK:
+            return self._not_full.wait_for(
+                lambda: self._queued() < self.maxsize, timeout=self.block_timeout
+            )
+
+        while self._queued() >= self.maxsize:
+            task = self._pop(self._first(lambda task: task.queued_at))
+            self._counters["dropped"] += 1
+            dropped.append(task)
+        return True
+
+    def _first(self, by):
+        """The queue whose head comes first ``by`` the given key, if any."""
+        heads = [queue for queue in (self._ready, self._delayed) if queue]
+        return min(heads, key=lambda queue: by(queue[0]), default=None)
+
+    def _pop(self, queue):
+        task = queue.popleft()
+        if task.key is not None:
+            self._pending.pop(task.key, None)
+        return task
+
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work,
+                name=f"event-dispatch-{len(self._threads)}",
+                daemon=True,
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def _next_task(self):
+        with self._lock:
+            while True:
+                queue = self._first(lambda task: task.ready_at)
+                if queue is None:
+                    self._not_empty.wait()
+                    continue
+
+                delay = queue[0].ready_at - time.monotonic()
+                if delay > 0:
+                    self._not_empty.wait(delay)
+                    continue
+
+                task = self._pop(queue)
+                self._in_flight += 1
+                self._not_full.notify()
+                return task
+
+    def _work(self):
+        while True:
+            task = self._next_task()
+            ok = True
+            try:
+                task.func()
+            except Exception:
+                ok = False
+                logger.exception("Event dispatch failed")
+            finally:
+                close_old_connections()
+
+            with self._lock:
+                self._in_flight -= 1
+                self._counters["processed" if ok else "failed"] += 1
+                if not self._queued() and not self._in_flight:
+                    self._idle.notify_all()
+
+    def drain(self, timeout=None):
+        """Wait until every queued task has run. Returns False on timeout."""
+        with self._lock:
+            return self._idle.wait_for(
+                lambda: not self._queued() and not self._in_flight, timeout=timeout
+            )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queued(),
+                "in_flight": self._in_flight,
+                "workers": len(self._threads),
+                **self._counters,
+            }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = EventDispatcher(
+                    workers=settings.EVENT_DISPATCH_WORKERS,
+                    maxsize=settings.EVENT_DISPATCH_QUEUE_SIZE,
+                    overflow=settings.EVENT_DISPATCH_OVERFLOW,
+                    coalesce_window=settings.EVENT_DISPATCH_COALESCE_MS / 1000,
+                )
+                atexit.register(_dispatcher.drain, timeout=2)
+    return _dispatcher
+
+
+def _dispatch_stats():
+    if _dispatcher is None:
+        return {}
+    return {(stat,): value for stat, value in _dispatcher.stats().items()}
+
+
+REGISTRY.gauge_func(
+    "event_dispatch", "Socket event dispatcher queue depth and counters", _dispatch_stats, ("stat",)
+)
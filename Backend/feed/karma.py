@@ -0,0 +1,120 @@
+"""
+Time-bucketed karma rollups.
+
+Each like adds its points to a ``KarmaBucket`` row keyed by the liked
+content's author and the start of the ``KARMA_BUCKET_SECONDS`` bucket the like
+was created in. The rolling leaderboard then sums a bounded number of buckets
+instead of scanning every recent ``Like``.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Like, KarmaBucket, path_segment
+
+POST_LIKE_POINTS = 5
+COMMENT_LIKE_POINTS = 1
+
+KARMA_WINDOW = timedelta(hours=24)
+
+
+def bucket_start(ts):
+    """Floor ``ts`` to the start of its karma bucket (always UTC)."""
+    seconds = settings.KARMA_BUCKET_SECONDS
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=dt_timezone.utc)
+
+
+def window_start(now=None):
+    """First bucket inside the rolling window ending at ``now``."""
+    return bucket_start((now or timezone.now()) - KARMA_WINDOW)
+
+
+def record_karma(user_id, points, at):
+    """
+    Add ``points`` (negative on unlike) to ``user_id``'s bucket for ``at``.
+
+    Decrements never create a bucket: if the like's bucket has already been
+    pruned it no longer counts towards the leaderboard anyway.
+    """
+    start = bucket_start(at)
+    bucket = KarmaBucket.objects.filter(user_id=user_id, bucket_start=start)
+
+    if bucket.update(points=F("points") + points) or points < 0:
+        return
+
+    try:
+        with transaction.atomic():
+            KarmaBucket.objects.create(user_id=user_id, bucket_start=start, points=points)
+    except IntegrityError:
+        # Lost the race to create the bucket; it exists now.
+        bucket.update(points=F("points") + points)
+
+
+def subtree_likes(comments):
+    """
+    Likes on ``comments``, given as ``(id, post_id, path)``, and on their
+    replies: the rows deleting those comments cascades to.
+    """
+    query = Q(pk__in=[])
+    for comment_id, post_id, path in comments:
+        query |= Q(comment_id=comment_id) | Q(
+            comment__post_id=post_id, comment__path__startswith=path + path_segment(comment_id)
+        )
+    return Like.objects.filter(query)
+
+
+def forget_likes(likes):
+    """
+    Take the points of ``likes``, which are about to be cascaded away with
+    the content they like, out of their buckets. Call it in the transaction
+    that deletes them.
+    """
+    totals = defaultdict(int)
+    rows = likes.filter(created_at__gte=window_start()).values_list(
+        "created_at", "post__author_id", "comment__author_id"
+    )
+    for created_at, post_author_id, comment_author_id in rows:
+        if post_author_id is not None:
+            totals[(post_author_id, bucket_start(created_at))] += POST_LIKE_POINTS
+        elif comment_author_id is not None:
+            totals[(comment_author_id, bucket_start(created_at))] += COMMENT_LIKE_POINTS
+
+    for (user_id, start), points in totals.items():
+        record_karma(user_id, -points, start)
+
+
+def prune_buckets(now=None):
+    """Delete buckets that have slid out of the window. Returns the row count."""
+    deleted, _ = KarmaBucket.objects.filter(bucket_start__lt=window_start(now)).delete()
+    return deleted
+
+
+def rebuild_buckets(now=None):
+    """Recompute every bucket inside the window from the ``Like`` table."""
+    since = window_start(now)
+    likes = Like.objects.filter(created_at__gte=since).values_list(
+        "created_at", "post__author_id", "comment__author_id"
+    )
+
+    totals = defaultdict(int)
+    for created_at, post_author_id, comment_author_id in likes.iterator():
+        if post_author_id is not None:
+            totals[(post_author_id, bucket_start(created_at))] += POST_LIKE_POINTS
+        elif comment_author_id is not None:
+            totals[(comment_author_id, bucket_start(created_at))] += COMMENT_LIKE_POINTS
+
+    with transaction.atomic():
+        KarmaBucket.objects.filter(bucket_start__gte=since).delete()
+        KarmaBucket.objects.bulk_create(
+            [
+                KarmaBucket(user_id=user_id, bucket_start=start, points=points)
+                for (user_id, start), points in totals.items()
+            ],
+            batch_size=1000,
+        )
+    return len(totals)
@@ -0,0 +1,180 @@
+"""
+Rolling 24h karma leaderboard.
+
+Two interchangeable engines, selected with ``LEADERBOARD_ENGINE``:
+
+* ``likes``   aggregates every ``Like`` in the window (exact, O(likes))
+* ``buckets`` sums pre-aggregated ``KarmaBucket`` rows (O(buckets)); the window
+  edge is rounded down to a whole bucket
+
+Reads go through ``get_leaderboard()``, which serves a cached snapshot for
+``LEADERBOARD_CACHE_TTL`` seconds. An expired snapshot is still served while a
+single background refresh recomputes it, and a ``leaderboard_update`` event is
+pushed to clients whenever the top entries actually change. Without any
+snapshot, one request computes it while the others wait for it.
+
+``leaderboard_etag()`` derives the ETag from the content version and the
+current window bucket, so with the ``likes`` engine likes leaving the window
+can take up to ``KARMA_BUCKET_SECONDS`` to show up for a revalidating client.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum, Case, When, IntegerField, F, Value
+from django.utils import timezone
+
+from .karma import POST_LIKE_POINTS, COMMENT_LIKE_POINTS, KARMA_WINDOW, window_start
+from .models import Like, KarmaBucket
+from .socket_events import broadcast_leaderboard_update, emit_sync
+from .versioning import current_version
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_SIZE = 5
+
+SNAPSHOT_KEY = "leaderboard:snapshot"
+REFRESH_LOCK_KEY = "leaderboard:refreshing"
+# Upper bound on how long a crashed refresh can block the next one
+REFRESH_LOCK_TIMEOUT = 30
+# How long requests wait for another one computing the first snapshot
+# before serving an empty leaderboard, and how often they check
+COLD_WAIT_TIMEOUT = 5
+COLD_WAIT_INTERVAL = 0.05
+
+
+def leaderboard_from_likes(limit=LEADERBOARD_SIZE):
+    since = timezone.now() - KARMA_WINDOW
+
+    scores = (
+        Like.objects.filter(created_at__gte=since)
+        .annotate(
+            owner=Case(
+                When(post__isnull=False, then=F("post__author__username")),
+                When(comment__isnull=False, then=F("comment__author__username")),
+            ),
+            points=Case(
+                When(post__isnull=False, then=Value(POST_LIKE_POINTS)),
+                default=Value(COMMENT_LIKE_POINTS),
+                output_field=IntegerField(),
+            ),
+        )
+        .values("owner")
+        .annotate(total=Sum("points"))
+        .order_by("-total")[:limit]
+    )
+
+    return [{"username": s["owner"], "total": s["total"]} for s in scores]
+
+
+def leaderboard_from_buckets(limit=LEADERBOARD_SIZE):
+    scores = (
+        KarmaBucket.objects.filter(bucket_start__gte=window_start())
+        .values("user__username")
+        .annotate(total=Sum("points"))
+        .filter(total__gt=0)
+        .order_by("-total")[:limit]
+    )
+
+    return [{"username": s["user__username"], "total": s["total"]} for s in scores]
+
+
+ENGINES = {
+    "likes": leaderboard_from_likes,
+    "buckets": leaderboard_from_buckets,
+}
+
+
+def compute_leaderboard(engine=None, limit=LEADERBOARD_SIZE):
+    return ENGINES[engine or settings.LEADERBOARD_ENGINE](limit)
+
+
+def get_leaderboard():
+    ttl = settings.LEADERBOARD_CACHE_TTL
+    if not ttl:
+        return compute_leaderboard()
+
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is None:
+        return _first_snapshot()
+
+    stale = time.time() - snapshot["computed_at"] >= ttl
+    # cache.add is atomic, so only one request per cache wins the refresh
+    if stale and cache.add(REFRESH_LOCK_KEY, True, timeout=REFRESH_LOCK_TIMEOUT):
+        emit_sync(_refresh_in_background, key="leaderboard_refresh", on_drop=_release_refresh_lock)
+
+    return snapshot["data"]
+
+
+def _first_snapshot():
+    """Compute the missing snapshot under the refresh lock, or wait for it."""
+    deadline = time.monotonic() + COLD_WAIT_TIMEOUT
+    while not cache.add(REFRESH_LOCK_KEY, True, timeout=REFRESH_LOCK_TIMEOUT):
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is not None:
+            return snapshot["data"]
+        if time.monotonic() >= deadline:
+            logger.warning("No leaderboard snapshot after %ss, serving an empty one", COLD_WAIT_TIMEOUT)
+            return []
+        time.sleep(COLD_WAIT_INTERVAL)
+
+    try:
+        # The previous holder may have just written it
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is not None:
+            return snapshot["data"]
+        return refresh_snapshot()
+    finally:
+        _release_refresh_lock()
+
+
+def refresh_snapshot():
+    """Recompute the snapshot and broadcast it if the ranking changed."""
+    # Read before computing: a write landing mid-query makes the snapshot look
+    # older than it is, which only costs one extra refresh.
+    version = _snapshot_version()
+    data = compute_leaderboard()
+    previous = cache.get(SNAPSHOT_KEY)
+
+    cache.set(
+        SNAPSHOT_KEY,
+        {"data": data, "computed_at": time.time(), "version": version},
+        timeout=None,
+    )
+
+    if previous is not None and previous["data"] != data:
+        emit_sync(lambda: broadcast_leaderboard_update(data), key="leaderboard_update")
+
+    return data
+
+
+def _snapshot_version():
+    return (current_version(), int(window_start().timestamp()))
+
+
+def leaderboard_etag(request):
+    """
+    ETag for the leaderboard view. ``None`` (no ETag, full response) while the
+    cached snapshot predates the latest write, so a client never pins data the
+    background refresh is about to replace.
+    """
+    version = _snapshot_version()
+    if settings.LEADERBOARD_CACHE_TTL:
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is None or snapshot.get("version") != version:
+            return None
+    return "leaderboard-%d-%d" % version
+
+
+def _refresh_in_background():
+    try:
+        refresh_snapshot()
+    except Exception:
+        logger.exception("Leaderboard refresh failed")
+    finally:
+        _release_refresh_lock()
+
+
+def _release_refresh_lock():
+    cache.delete(REFRESH_LOCK_KEY)
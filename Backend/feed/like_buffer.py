@@ -0,0 +1,277 @@
+"""
+Write-behind buffer for likes and unlikes (``LIKE_WRITE_BEHIND``).
+
+The like views record the wanted state of each ``(user, target)`` pair here
+and answer at once. Toggles of the same pair collapse into the latest one, so
+like-unlike-like within a flush is a single write, or none if it ends where it
+started. A background thread flushes every ``LIKE_FLUSH_INTERVAL_MS``, or
+early once ``LIKE_FLUSH_MAX_ITEMS`` pairs are pending, applying the net
+change in one transaction: one ``bulk_create(ignore_conflicts=True)``, one
+delete, and grouped counter and karma updates. A batch that fails is split
+in halves until the failing pairs are isolated, so the rest still gets
+written; those are put back and retried, and dropped after ``max_retries``
+failures. If the database itself is unavailable the whole batch is put back.
+The buffer is flushed at interpreter exit.
+
+The buffer is per process, so a like is only visible to reads, including
+the liker's own, once its flush has committed.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.db.models import Q
+
+from .karma import POST_LIKE_POINTS, COMMENT_LIKE_POINTS, bucket_start, record_karma
+from .likes import adjust_like_counts
+from .metrics import REGISTRY
+from .models import Post, Comment, Like
+from .socket_events import publish_batch
+from .versioning import bump_version
+
+logger = logging.getLogger(__name__)
+
+POST = "post"
+COMMENT = "comment"
+
+
+def write_likes(items):
+    """
+    Bring ``{(user_id, kind, target_id): liked}`` about in one transaction,
+    which also publishes the ``like_count`` events. Pairs already in the
+    wanted state and unknown targets are skipped. Returns the
+    ``(post_id, comment_id)`` pairs whose like count changed.
+    """
+    user_ids = {user_id for user_id, _, _ in items}
+    post_ids = {target for _, kind, target in items if kind == POST}
+    comment_ids = {target for _, kind, target in items if kind == COMMENT}
+
+    deltas = {POST: defaultdict(int), COMMENT: defaultdict(int)}
+    karma = defaultdict(int)
+    karma_at = {}
+
+    def add(kind, target, sign, at):
+        deltas[kind][target] += sign
+        if kind == POST:
+            author_id, points = post_authors[target], POST_LIKE_POINTS
+        else:
+            author_id, points = comments[target][1], COMMENT_LIKE_POINTS
+        key = (author_id, bucket_start(at))
+        karma[key] += sign * points
+        karma_at[key] = at
+
+    with transaction.atomic():
+        post_authors = dict(Post.objects.filter(id__in=post_ids).values_list("id", "author_id"))
+        comments = {
+            pk: (post_id, author_id) for pk, post_id, author_id in
+            Comment.objects.filter(id__in=comment_ids).values_list("id", "post_id", "author_id")
+        }
+        known = {POST: post_authors, COMMENT: comments}
+
+        # Locked, so a concurrent unlike can't delete them from under us
+        likes = Like.objects.select_for_update().filter(user_id__in=user_ids).filter(
+            Q(post_id__in=post_authors) | Q(comment_id__in=comments)
+        )
+        existing = {}
+        for like_id, user_id, post_id, comment_id, created_at in likes.values_list(
+            "id", "user_id", "post_id", "comment_id", "created_at"
+        ):
+            key = (user_id, POST, post_id) if post_id is not None else (user_id, COMMENT, comment_id)
+            existing[key] = (like_id, created_at)
+
+        removed = [
+            (key, existing[key]) for key, liked in items.items()
+            if not liked and key in existing
+        ]
+        Like.objects.filter(id__in=[like_id for _, (like_id, _) in removed]).delete()
+        for (_, kind, target), (_, created_at) in removed:
+            add(kind, target, -1, created_at)
+
+        created = [
+            Like(user_id=user_id, post_id=target) if kind == POST else Like(user_id=user_id, comment_id=target)
+            for (user_id, kind, target), liked in items.items()
+            if liked and (user_id, kind, target) not in existing and target in known[kind]
+        ]
+        Like.objects.bulk_create(created, ignore_conflicts=True)
+        if created:
+            # ignore_conflicts silently skips likes another writer inserted
+            # since we looked; only count rows carrying our timestamps
+            stamps = {(like.user_id, like.post_id, like.comment_id): like.created_at for like in created}
+            rows = Like.objects.filter(user_id__in=user_ids).filter(
+                Q(post_id__in=[like.post_id for like in created if like.post_id is not None])
+                | Q(comment_id__in=[like.comment_id for like in created if like.comment_id is not None])
+            ).values_list("user_id", "post_id", "comment_id", "created_at")
+            for user_id, post_id, comment_id, created_at in rows:
+                if stamps.get((user_id, post_id, comment_id)) == created_at:
+                    if post_id is not None:
+                        add(POST, post_id, 1, created_at)
+                    else:
+                        add(COMMENT, comment_id, 1, created_at)
+
+        adjust_like_counts(Post, deltas[POST])
+        adjust_like_counts(Comment, deltas[COMMENT])
+        for key, points in karma.items():
+            if points:
+                record_karma(key[0], points, karma_at[key])
+
+        like_targets = [(target, None) for target, delta in deltas[POST].items() if delta] + [
+            (comments[target][0], target) for target, delta in deltas[COMMENT].items() if delta
+        ]
+        if like_targets:
+            publish_batch(like_targets)
+
+    return like_targets
+
+
+class LikeBuffer:
+    # Failed writes of a pair before it is dropped
+    max_retries = 5
+
+    def __init__(self, flush_interval=0.2, max_items=500):
+        self.flush_interval = flush_interval
+        self.max_items = max_items
+
+        # (user_id, kind, target_id) -> whether the user should like it
+        self._pending = {}
+        # (user_id, kind, target_id) -> failed writes of its current state
+        self._retries = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        # Held for the whole of a flush, so flushes never overlap
+        self._flush_lock = threading.Lock()
+
+        self._counters = dict.fromkeys(
+            ("recorded", "coalesced", "flushes", "written", "failed", "dropped"), 0
+        )
+
+    def record(self, user_id, kind, target_id, liked):
+        """Queue a like (``liked=True``) or unlike of a post or comment."""
+        key = (user_id, kind, target_id)
+        with self._lock:
+            self._counters["recorded"] += 1
+            if key in self._pending:
+                self._counters["coalesced"] += 1
+            self._pending[key] = liked
+            self._retries.pop(key, None)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="like-flush", daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.max_items:
+                self._wake.notify()
+
+    def flush(self):
+        """Write everything pending now. Returns False if any of it failed."""
+        with self._flush_lock:
+            with self._lock:
+                items, self._pending = self._pending, {}
+            if not items:
+                return True
+
+            written, failed, like_targets = self._write(items)
+
+            with self._lock:
+                for key in written:
+                    self._retries.pop(key, None)
+                if written:
+                    self._counters["flushes"] += 1
+                    self._counters["written"] += len(written)
+                if failed:
+                    self._counters["failed"] += 1
+                for key, liked in failed.items():
+                    # Anything recorded since is newer and wins
+                    if key in self._pending:
+                        continue
+                    retries = self._retries.get(key, 0) + 1
+                    if retries > self.max_retries:
+                        logger.error("Dropping like %s=%s after %d failed writes", key, liked, retries)
+                        self._retries.pop(key, None)
+                        self._counters["dropped"] += 1
+                        continue
+                    self._retries[key] = retries
+                    self._pending[key] = liked
+
+        if like_targets:
+            bump_version()
+        return not failed
+
+    def _write(self, items, top=True):
+        """
+        ``write_likes(items)``, halving the batch around failures. Returns the
+        written and the failed items, and the changed like targets.
+        """
+        try:
+            return items, {}, write_likes(items)
+        except OperationalError:
+            # Locked or unavailable: every half would fail the same way
+            if top:
+                logger.exception("Like flush failed, will retry")
+            return {}, items, []
+        except Exception:
+            if len(items) == 1:
+                logger.exception("Like write failed for %s, will retry", next(iter(items)))
+                return {}, items, []
+            if top:
+                logger.warning("Like flush failed, writing it in parts")
+
+        keys = list(items)
+        half = len(keys) // 2
+        written, failed, like_targets = {}, {}, []
+        for part in (keys[:half], keys[half:]):
+            part_written, part_failed, part_targets = self._write({key: items[key] for key in part}, top=False)
+            written.update(part_written)
+            failed.update(part_failed)
+            like_targets += part_targets
+        return written, failed, like_targets
+
+    def _work(self):
+        while True:
+            with self._lock:
+                deadline = time.monotonic() + self.flush_interval
+                self._wake.wait_for(
+                    lambda: len(self._pending) >= self.max_items or time.monotonic() >= deadline,
+                    timeout=self.flush_interval,
+                )
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Like flush failed")
+            finally:
+                close_old_connections()
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._pending), **self._counters}
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_like_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = LikeBuffer(
+                    flush_interval=settings.LIKE_FLUSH_INTERVAL_MS / 1000,
+                    max_items=settings.LIKE_FLUSH_MAX_ITEMS,
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def _buffer_stats():
+    if _buffer is None:
+        return {}
+    return {(stat,): value for stat, value in _buffer.stats().items()}
+
+
+REGISTRY.gauge_func(
+    "like_buffer", "Write-behind like buffer size and counters", _buffer_stats, ("stat",)
+)
@@ -0,0 +1,71 @@
+"""
+Like writes.
+
+Every insert or delete of a ``Like`` row also adjusts the denormalized
+``like_count`` on its post or comment with an ``F()`` expression, and the
+author's karma bucket, inside the same transaction, so reads never have to
+count the ``Like`` table.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from .karma import POST_LIKE_POINTS, COMMENT_LIKE_POINTS, record_karma
+from .models import Post, Comment, Like
+
+
+def add_post_like(user, post_id):
+    """
+    Raises ``Post.DoesNotExist`` for an unknown post and ``IntegrityError`` if
+    ``user`` already likes it.
+    """
+    with transaction.atomic():
+        author_id = Post.objects.values_list("author_id", flat=True).get(id=post_id)
+        like = Like.objects.create(user=user, post_id=post_id)
+        Post.objects.filter(id=post_id).update(like_count=F("like_count") + 1)
+        record_karma(author_id, POST_LIKE_POINTS, like.created_at)
+    return like
+
+
+def remove_post_like(user, post_id):
+    """Raises ``Like.DoesNotExist`` if there is nothing to remove."""
+    with transaction.atomic():
+        like = Like.objects.select_related("post").get(user=user, post_id=post_id)
+        like.delete()
+        Post.objects.filter(id=post_id).update(like_count=F("like_count") - 1)
+        record_karma(like.post.author_id, -POST_LIKE_POINTS, like.created_at)
+    return like
+
+
+def add_comment_like(user, comment):
+    """Raises ``IntegrityError`` if ``user`` already likes the comment."""
+    with transaction.atomic():
+        like = Like.objects.create(user=user, comment=comment)
+        Comment.objects.filter(id=comment.id).update(like_count=F("like_count") + 1)
+        record_karma(comment.author_id, COMMENT_LIKE_POINTS, like.created_at)
+    return like
+
+
+def remove_comment_like(user, comment_id):
+    """
+    Returns the removed like's post id.
+    Raises ``Like.DoesNotExist`` if there is nothing to remove.
+    """
+    with transaction.atomic():
+        like = Like.objects.select_related("comment").get(user=user, comment_id=comment_id)
+        post_id = like.comment.post_id
+        like.delete()
+        Comment.objects.filter(id=comment_id).update(like_count=F("like_count") - 1)
+        record_karma(like.comment.author_id, -COMMENT_LIKE_POINTS, like.created_at)
+    return post_id
+
+
+def adjust_like_counts(model, deltas):
+    """Apply ``{id: delta}`` to ``like_count`` with one UPDATE per distinct delta."""
+    by_delta = defaultdict(list)
+    for target, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(target)
+    for delta, targets in by_delta.items():
+        model.objects.filter(id__in=targets).update(like_count=F("like_count") + delta)
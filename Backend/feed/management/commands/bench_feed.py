@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from feed.bench import scratch_database, timeit
+from feed.seeding import seed_dataset
+
+
+class Command(BaseCommand):
+    help = 'Compare PostSerializer against the streaming fast path for the feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=20_000)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--depth', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            dataset = seed_dataset(
+                users=options['users'],
+                posts=options['posts'],
+                comments=options['comments'],
+                likes=0,
+                depth=options['depth'],
+                seed=options['seed'],
+            )
+            self.stdout.write(f'Seeded {dataset}')
+
+            client = Client()
+            for label, url in (('all posts', '/api/feed/?all=1'), ('first page', '/api/feed/')):
+                results = {}
+                for fast in (False, True):
+                    with override_settings(FEED_FAST_PATH=fast):
+                        # getvalue() drains the stream, so encoding is timed too
+                        results[fast] = timeit(lambda: client.get(url).getvalue(), repeat=options['repeat'])
+
+                self.stdout.write(f'{label}: serializer {results[False]}')
+                self.stdout.write(f'{label}: fast path  {results[True]}')
+                speedup = results[False]['median_ms'] / max(results[True]['median_ms'], 0.001)
+                self.stdout.write(self.style.SUCCESS(f'{label}: fast path is {speedup:.1f}x faster (median)'))
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from feed.bench import scratch_database, timeit
+from feed.seeding import seed_dataset
+from feed.leaderboard import ENGINES
+
+
+class Command(BaseCommand):
+    help = 'Compare the "likes" and "buckets" leaderboard engines on a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--likes', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--comments', type=int, default=8000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--bucket-seconds',
+            type=int,
+            default=settings.KARMA_BUCKET_SECONDS,
+            help='Karma bucket granularity to benchmark',
+        )
+
+    def handle(self, *args, **options):
+        with scratch_database(), override_settings(KARMA_BUCKET_SECONDS=options['bucket_seconds']):
+            dataset = seed_dataset(
+                users=options['users'],
+                posts=options['posts'],
+                comments=options['comments'],
+                likes=options['likes'],
+                seed=options['seed'],
+            )
+            self.stdout.write(f'Seeded {dataset}')
+
+            results = {}
+            for name, engine in ENGINES.items():
+                results[name] = timeit(engine, repeat=options['repeat'])
+                self.stdout.write(f'{name:>8}: {results[name]}')
+
+            if ENGINES['likes']() != ENGINES['buckets']():
+                self.stdout.write(self.style.WARNING(
+                    'Engines disagree (expected only at the bucket-rounded window edge)'
+                ))
+
+            speedup = results['likes']['median_ms'] / max(results['buckets']['median_ms'], 0.001)
+            self.stdout.write(self.style.SUCCESS(f'buckets is {speedup:.1f}x faster (median)'))
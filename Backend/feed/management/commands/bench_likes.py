@@ -0,0 +1,82 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from feed.auth import issue_token
+from feed.bench import scratch_database
+from feed.like_buffer import LikeBuffer
+from feed.models import Like, Post
+from feed.seeding import seed_dataset
+
+
+class Command(BaseCommand):
+    help = 'Compare likes/sec of the synchronous like path and the write-behind buffer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--likes', type=int, default=5000, help='Like requests per mode')
+        parser.add_argument(
+            '--flush-items', type=int, default=500,
+            help='Write-behind: flush after this many requests (LIKE_FLUSH_MAX_ITEMS)',
+        )
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # Socket emits are not what is being measured, and a single client
+        # would soon be rate limited by admission control
+        with scratch_database(), mock.patch('feed.socket_events.emit_sync'), \
+                override_settings(ADMISSION_CONTROL_ENABLED=False):
+            dataset = seed_dataset(
+                users=options['users'], posts=options['posts'], comments=0, likes=0, seed=options['seed'],
+            )
+            self.stdout.write(f'Seeded {dataset}')
+
+            users = list(User.objects.order_by('id'))
+            post_ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+            pairs = [(user, post_id) for post_id in post_ids for user in users][:options['likes']]
+            tokens = {user.id: f'Bearer {issue_token(user)}' for user in users}
+            client = Client()
+
+            def like_all():
+                for user, post_id in pairs:
+                    client.post(f'/api/like/post/{post_id}/', HTTP_AUTHORIZATION=tokens[user.id])
+
+            sync_seconds = self.timed(like_all)
+            self.stdout.write(self.report('synchronous', len(pairs), sync_seconds))
+            Like.objects.all().delete()
+
+            # The flush thread's work is done inline every --flush-items requests,
+            # so both modes are timed on one thread and one connection
+            buffer = LikeBuffer(flush_interval=3600, max_items=len(pairs) + 1)
+
+            def like_all_buffered():
+                for i, (user, post_id) in enumerate(pairs, 1):
+                    client.post(f'/api/like/post/{post_id}/', HTTP_AUTHORIZATION=tokens[user.id])
+                    if i % options['flush_items'] == 0:
+                        buffer.flush()
+                buffer.flush()
+
+            with override_settings(LIKE_WRITE_BEHIND=True), \
+                    mock.patch('feed.views.get_like_buffer', return_value=buffer):
+                buffered_seconds = self.timed(like_all_buffered)
+            self.stdout.write(self.report('write-behind', len(pairs), buffered_seconds))
+
+            written = Like.objects.count()
+            if written != len(pairs):
+                self.stderr.write(f'write-behind wrote {written} of {len(pairs)} likes')
+
+            self.stdout.write(self.style.SUCCESS(
+                f'write-behind is {sync_seconds / max(buffered_seconds, 1e-9):.1f}x faster'
+            ))
+
+    def timed(self, fn):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    def report(self, label, likes, seconds):
+        return f'{label:12} {likes} likes in {seconds:.2f}s = {likes / seconds:,.0f} likes/sec'
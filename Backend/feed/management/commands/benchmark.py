@@ -0,0 +1,125 @@
+import itertools
+import json
+import os
+import subprocess
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from feed.auth import issue_token
+from feed.bench import scratch_database, timeit
+from feed.seeding import seed_dataset
+from feed.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Time the hot endpoints on a seeded scratch database and write the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--posts', type=int, default=10_000)
+        parser.add_argument('--comments', type=int, default=200_000)
+        parser.add_argument('--likes', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--output',
+            help='JSON file to write (default: bench_results/benchmark-<timestamp>.json)',
+        )
+
+    def handle(self, *args, **options):
+        started_at = timezone.now()
+        output = options['output'] or os.path.join(
+            'bench_results', f'benchmark-{started_at:%Y%m%d-%H%M%S}.json'
+        )
+
+        # Socket emits are not what is being measured, and a single client
+        # would soon be rate limited by admission control
+        with scratch_database(), mock.patch('feed.socket_events.emit_sync'), \
+                override_settings(ADMISSION_CONTROL_ENABLED=False):
+            dataset = seed_dataset(
+                users=options['users'],
+                posts=options['posts'],
+                comments=options['comments'],
+                likes=options['likes'],
+                seed=options['seed'],
+            )
+            self.stdout.write(f'Seeded {dataset}')
+            results = self.run_benchmarks(options['repeat'])
+
+        report = {
+            'started_at': started_at.isoformat(),
+            'git_rev': self.git_rev(),
+            'dataset': dataset,
+            'repeat': options['repeat'],
+            'results': results,
+        }
+
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {output}'))
+
+    def run_benchmarks(self, repeat):
+        client = Client()
+        user = User.objects.create_user(username='bench-runner')
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {issue_token(user)}'}
+
+        # The runner has liked nothing yet, so each post can be liked then unliked
+        post_ids = itertools.cycle(Post.objects.order_by('-id').values_list('id', flat=True)[:repeat + 1])
+        like_targets = iter(list(itertools.islice(post_ids, repeat + 1)))
+        unlike_targets = iter(list(itertools.islice(post_ids, repeat + 1)))
+        next_cursor = json.loads(client.get('/api/feed/').getvalue())['next']
+
+        benchmarks = {
+            'feed_first_page': lambda: self.drain(client.get('/api/feed/')),
+            'feed_next_page': lambda: self.drain(client.get('/api/feed/', {'cursor': next_cursor})),
+            'leaderboard_buckets': self.uncached(client, 'buckets'),
+            'leaderboard_likes': self.uncached(client, 'likes'),
+            'add_comment': lambda: client.post(
+                f'/api/comment/{next(post_ids)}/', {'content': 'benchmark'},
+                content_type='application/json', **auth,
+            ),
+            'like_post': lambda: client.post(f'/api/like/post/{next(like_targets)}/', **auth),
+            'unlike_post': lambda: client.delete(f'/api/unlike/post/{next(unlike_targets)}/', **auth),
+        }
+
+        results = {}
+        for name, request in benchmarks.items():
+            # request_started clears the query log, so start from an empty one
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            if response.status_code != 200:
+                raise CommandError(f'{name} returned {response.status_code}: {response.content[:200]}')
+
+            results[name] = {**timeit(request, repeat=repeat), 'queries': len(queries)}
+            self.stdout.write(f'{name:>20}: {results[name]}')
+
+        return results
+
+    def drain(self, response):
+        # A streamed feed only does its encoding work while being consumed
+        response.getvalue()
+        return response
+
+    def uncached(self, client, engine):
+        def request():
+            with override_settings(LEADERBOARD_ENGINE=engine, LEADERBOARD_CACHE_TTL=0):
+                return client.get('/api/leaderboard/')
+        return request
+
+    def git_rev(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.test import override_settings
+
+from feed.auth import issue_token
+from feed.bench import scratch_database
+from feed.models import Post
+from feed.seeding import seed_dataset
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Flood a local server with like/unlike writes while timing feed reads, '
+        'with admission control off and on'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=24, help='Concurrent writing clients, one user each')
+        parser.add_argument('--readers', type=int, default=4, help='Concurrent feed readers')
+        parser.add_argument('--seconds', type=float, default=10, help='Duration of each run')
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # 500s (SQLite lock timeouts) are counted in the report instead
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                scratch_database(os.path.join(tmp, 'load.sqlite3')), \
+                mock.patch('feed.socket_events.emit_sync'):
+            seed_dataset(
+                users=options['writers'], posts=options['posts'], comments=options['posts'],
+                likes=0, seed=options['seed'],
+            )
+            tokens = [f'Bearer {issue_token(user)}' for user in User.objects.order_by('id')]
+            post_ids = list(Post.objects.values_list('id', flat=True))
+
+            results = {}
+            for enabled in (False, True):
+                with override_settings(ADMISSION_CONTROL_ENABLED=enabled):
+                    results[enabled] = self.run(tokens, post_ids, options)
+                label = 'admission on' if enabled else 'admission off'
+                self.stdout.write(self.report(label, results[enabled], options['seconds']))
+
+            off, on = results[False]['p99'], results[True]['p99']
+            self.stdout.write(self.style.SUCCESS(
+                f'read p99 {off:.0f}ms -> {on:.0f}ms ({off / max(on, 1e-9):.1f}x lower with admission control)'
+            ))
+
+    def run(self, tokens, post_ids, options):
+        # Built here, so the middleware sees the overridden settings
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+        server.set_app(WSGIHandler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.server_port}'
+
+        deadline = time.monotonic() + options['seconds']
+        read_ms = []
+        statuses = Counter()
+        lock = threading.Lock()
+
+        def request(path, method='GET', token=None):
+            req = urllib.request.Request(base + path, method=method, data=b'' if method != 'GET' else None)
+            if token:
+                req.add_header('Authorization', token)
+            try:
+                with urllib.request.urlopen(req, timeout=30) as response:
+                    response.read()
+                    return response.status, None
+            except urllib.error.HTTPError as error:
+                return error.code, error.headers.get('Retry-After')
+
+        def write(token, seed):
+            rng = random.Random(seed)
+            while time.monotonic() < deadline:
+                post_id = rng.choice(post_ids)
+                for action, method in (('like', 'POST'), ('unlike', 'DELETE')):
+                    status, retry_after = request(f'/api/{action}/post/{post_id}/', method, token)
+                    with lock:
+                        statuses[f'write {status}'] += 1
+                    if retry_after:
+                        # Well-behaved clients back off as told
+                        time.sleep(max(0, min(int(retry_after), deadline - time.monotonic())))
+                        break
+
+        def read():
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                status, _ = request('/api/feed/?page_size=20')
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    read_ms.append(elapsed)
+                    statuses[f'read {status}'] += 1
+
+        threads = [
+            threading.Thread(target=write, args=(tokens[i % len(tokens)], i))
+            for i in range(options['writers'])
+        ] + [threading.Thread(target=read) for _ in range(options['readers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        server.shutdown()
+        server.server_close()
+
+        read_ms.sort()
+        return {
+            'reads': len(read_ms),
+            'p50': statistics.median(read_ms) if read_ms else 0,
+            'p99': read_ms[int(len(read_ms) * 0.99)] if read_ms else 0,
+            'statuses': dict(statuses),
+        }
+
+    def report(self, label, result, seconds):
+        statuses = json.dumps(result['statuses'], sort_keys=True)
+        return (
+            f'{label:14} reads {result["reads"] / seconds:6.1f}/s  '
+            f'p50 {result["p50"]:7.1f}ms  p99 {result["p99"]:7.1f}ms  {statuses}'
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from feed.karma import prune_buckets, rebuild_buckets
+
+
+class Command(BaseCommand):
+    help = 'Drop karma buckets that have slid out of the 24h leaderboard window'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Also recompute the buckets inside the window from the Like table',
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_buckets()
+        self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} expired buckets'))
+
+        if options['rebuild']:
+            rebuilt = rebuild_buckets()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} buckets'))
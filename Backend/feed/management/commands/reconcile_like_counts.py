@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from feed.models import Post, Comment, Like
+
+
+class Command(BaseCommand):
+    help = 'Detect and repair drift between stored like_count columns and the Like table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted rows without fixing them',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per bulk_update',
+        )
+
+    def handle(self, *args, **options):
+        for model, fk in ((Post, 'post'), (Comment, 'comment')):
+            actual = (
+                Like.objects.filter(**{fk: OuterRef('pk')})
+                .values(fk)
+                .annotate(c=Count('id'))
+                .values('c')
+            )
+            drifted = (
+                model.objects.annotate(actual=Coalesce(Subquery(actual), 0))
+                .exclude(like_count=F('actual'))
+                .only('id', 'like_count')
+            )
+
+            fixed = []
+            for obj in drifted.iterator(chunk_size=options['batch_size']):
+                obj.like_count = obj.actual
+                fixed.append(obj)
+
+            name = model._meta.verbose_name_plural
+            if not fixed:
+                self.stdout.write(self.style.SUCCESS(f'{name}: no drift'))
+                continue
+
+            if options['dry_run']:
+                self.stdout.write(self.style.WARNING(f'{name}: {len(fixed)} drifted rows'))
+                continue
+
+            with transaction.atomic():
+                model.objects.bulk_update(fixed, ['like_count'], batch_size=options['batch_size'])
+
+            self.stdout.write(self.style.SUCCESS(f'{name}: repaired {len(fixed)} rows'))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from feed.outbox import OutboxRelay
+
+
+class Command(BaseCommand):
+    help = (
+        'Relay stored socket events to the Socket.IO server in batches. Run one '
+        'of these with SOCKET_OUTBOX_RELAY_THREAD off in the web processes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver what is pending and exit')
+        parser.add_argument('--batch-size', type=int, default=settings.SOCKET_OUTBOX_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        # Rows written by the web processes never wake this one, so poll
+        relay = OutboxRelay(
+            batch_size=options['batch_size'],
+            poll_interval=settings.SOCKET_OUTBOX_POLL_MS / 1000,
+        )
+        if options['once']:
+            delivered = relay.deliver_pending()
+            self.stdout.write(self.style.SUCCESS(f'Delivered {delivered} events'))
+            return
+
+        self.stdout.write(f'Relaying outbox events every {relay.poll_interval:g}s')
+        relay.run_forever()
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database onto a replica alias, optionally on a loop to simulate lag'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', default='replica', help='Database alias to overwrite')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            help='Keep copying every INTERVAL seconds instead of once',
+        )
+
+    def handle(self, *args, **options):
+        alias = options['alias']
+        if alias == 'default' or alias not in connections:
+            raise CommandError(f'unknown replica alias {alias!r}')
+
+        primary, replica = connections['default'], connections[alias]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('sync_replica only copies SQLite databases; use real replication elsewhere')
+
+        while True:
+            start = time.perf_counter()
+            primary.ensure_connection()
+            replica.ensure_connection()
+            # Online backup: a consistent snapshot even while the primary is being written
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f'Copied default to {alias} in {(time.perf_counter() - start) * 1000:.0f}ms')
+
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -1,10 +1,49 @@
+from contextlib import ExitStack
+import time
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.core import signing
+from django.db import connections
+from django.http import JsonResponse
 import logging
 
+from .admission import AdmissionController, Rejected
+from .auth import load_user, read_token
+from .routers import pin_to_primary
+from .metrics import REGISTRY, COUNT_BUCKETS, SIZE_BUCKETS
+
 logger = logging.getLogger(__name__)
 
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Django request latency", ("route", "method")
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "Django requests served", ("route", "method", "status")
+)
+DB_QUERIES = REGISTRY.histogram(
+    "db_queries_per_request", "SQL queries issued per request", ("route",), COUNT_BUCKETS
+)
+DB_TIME = REGISTRY.histogram(
+    "db_query_duration_seconds", "Total SQL time per request", ("route",)
+)
+RESPONSE_SIZE = REGISTRY.histogram(
+    "http_response_size_bytes", "Response body size", ("route",), SIZE_BUCKETS
+)
+REJECTED = REGISTRY.counter(
+    "admission_rejected_total", "Requests turned away by admission control", ("kind", "status")
+)
+
 class MockAuthMiddleware:
+    """
+    Dev mode: act as any user given by ``?user_id=`` or ``X-Mock-User-ID``.
+    Only installed when ``MOCK_AUTH_ENABLED`` is set.
+    """
+
     def __init__(self, get_response):
+        if not settings.MOCK_AUTH_ENABLED:
+            raise MiddlewareNotUsed()
         self.get_response = get_response
 
     def __call__(self, request):
@@ -12,21 +51,171 @@ class MockAuthMiddleware:
         user_id = (
             request.GET.get("user_id") or 
             request.POST.get("user_id") or
-            request.headers.get("X-Mock-User-ID") or 
-            request.headers.get("x-mock-user-id") or
-            request.META.get("HTTP_X_MOCK_USER_ID")
+            request.headers.get("X-Mock-User-ID")
         )
         
-        logger.info(f"MockAuthMiddleware: user_id = {user_id}")
+        logger.debug("MockAuthMiddleware: user_id = %s", user_id)
 
         if user_id:
             try:
-                user_obj = User.objects.get(id=int(user_id))
-                request.user = user_obj
-                logger.info(f"MockAuthMiddleware: ✓ Set user to {user_obj.username} (id={user_obj.id})")
+                request.user = load_user(int(user_id))
             except (User.DoesNotExist, ValueError) as e:
-                logger.error(f"MockAuthMiddleware: ✗ Failed to set user: {e}")
-        else:
-            logger.info("MockAuthMiddleware: ✗ No user_id found")
+                logger.warning("MockAuthMiddleware: failed to set user %s: %s", user_id, e)
 
         return self.get_response(request)
+
+
+class AdmissionControlMiddleware:
+    """
+    Turn API requests away with 429/503 and ``Retry-After`` before they pile
+    up behind the database (see feed/admission.py). Not installed unless
+    ``ADMISSION_CONTROL_ENABLED``.
+    """
+
+    SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        if not settings.ADMISSION_CONTROL_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.controller = AdmissionController(
+            user_rate=settings.ADMISSION_USER_WRITE_RATE,
+            user_burst=settings.ADMISSION_USER_WRITE_BURST,
+            global_rate=settings.ADMISSION_GLOBAL_WRITE_RATE,
+            global_burst=settings.ADMISSION_GLOBAL_WRITE_BURST,
+            max_reads=settings.ADMISSION_MAX_READS,
+            max_writes=settings.ADMISSION_MAX_WRITES,
+            write_latency_target=settings.ADMISSION_WRITE_LATENCY_MS / 1000,
+        )
+
+    def __call__(self, request):
+        if not request.path.startswith("/api/"):
+            return self.get_response(request)
+
+        write = request.method not in self.SAFE_METHODS
+        try:
+            with self.controller.admit(write, self.client_key(request)):
+                return self.get_response(request)
+        except Rejected as rejected:
+            kind = "write" if write else "read"
+            REJECTED.inc(kind=kind, status=rejected.status)
+            response = JsonResponse({"error": rejected.reason}, status=rejected.status)
+            response["Retry-After"] = str(rejected.retry_after)
+            return response
+
+    @staticmethod
+    def client_key(request):
+        """Whom a write counts against: the user if known, else the address."""
+        # Token auth only runs in the view; the signature check is cheap
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                return read_token(token)[0]
+            except signing.BadSignature:
+                pass
+
+        # A user set by MockAuthMiddleware. type(), not isinstance(), which
+        # would load the session user behind AuthenticationMiddleware's lazy object
+        user = getattr(request, "user", None)
+        if type(user) is User:
+            return user.id
+        return request.META.get("REMOTE_ADDR")
+
+
+class ReplicaPinMiddleware:
+    """
+    Keep a user's reads on the primary for ``REPLICA_STICKY_SECONDS`` after a
+    successful write, so they see their own changes despite replica lag. Not
+    installed unless ``DATABASE_REPLICAS`` is set.
+    """
+
+    SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        # DRF copies the user it authenticated back onto the Django request
+        user = getattr(request, "user", None)
+        if (request.method not in self.SAFE_METHODS and response.status_code < 400
+                and user is not None and user.is_authenticated):
+            pin_to_primary(user.id)
+
+        return response
+
+
+class _QueryTimer:
+    """``execute_wrapper`` that counts and times the queries it sees."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """
+    Per-route latency, SQL query count/time and response size, served in
+    Prometheus format at /metrics/. Not installed unless ``METRICS_ENABLED``.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = _QueryTimer()
+        start = time.perf_counter()
+
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(queries))
+            response = self.get_response(request)
+
+        elapsed = time.perf_counter() - start
+        match = request.resolver_match
+        route = match.route if match else "unmatched"
+
+        HTTP_LATENCY.observe(elapsed, route=route, method=request.method)
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        DB_QUERIES.observe(queries.count, route=route)
+        DB_TIME.observe(queries.seconds, route=route)
+        if response.streaming:
+            # Measured as the body is sent, since the streamed feed is the busiest route
+            response.streaming_content = _counted(response, route)
+        else:
+            RESPONSE_SIZE.observe(len(response.content), route=route)
+
+        return response
+
+
+def _counted(response, route):
+    """``response``'s streaming content, observing its size once it is sent."""
+    content = response.streaming_content
+    if response.is_async:
+        async def counted():
+            size = 0
+            async for chunk in content:
+                size += len(chunk)
+                yield chunk
+            RESPONSE_SIZE.observe(size, route=route)
+    else:
+        def counted():
+            size = 0
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+            RESPONSE_SIZE.observe(size, route=route)
+    return counted()
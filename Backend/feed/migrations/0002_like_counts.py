@@ -0,0 +1,40 @@
+# Generated by Django 4.2.27 on 2026-10-18 17:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_like_counts(apps, schema_editor):
+    Like = apps.get_model("feed", "Like")
+
+    for model_name, fk in (("Post", "post"), ("Comment", "comment")):
+        model = apps.get_model("feed", model_name)
+        counts = (
+            Like.objects.filter(**{fk: OuterRef("pk")})
+            .values(fk)
+            .annotate(c=Count("id"))
+            .values("c")
+        )
+        model.objects.update(like_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_like_counts, migrations.RunPython.noop),
+    ]
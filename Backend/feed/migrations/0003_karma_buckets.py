@@ -0,0 +1,65 @@
+# Generated by Django 4.2.27 on 2026-10-18 17:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+
+def backfill_karma_buckets(apps, schema_editor):
+    Like = apps.get_model("feed", "Like")
+    KarmaBucket = apps.get_model("feed", "KarmaBucket")
+    seconds = getattr(settings, "KARMA_BUCKET_SECONDS", 60)
+
+    def bucket_start(ts):
+        epoch = int(ts.timestamp())
+        return datetime.fromtimestamp(epoch - epoch % seconds, tz=dt_timezone.utc)
+
+    since = datetime.now(dt_timezone.utc) - timedelta(hours=24)
+    likes = Like.objects.filter(created_at__gte=since).values_list(
+        "created_at", "post__author_id", "comment__author_id"
+    )
+
+    totals = defaultdict(int)
+    for created_at, post_author_id, comment_author_id in likes.iterator():
+        if post_author_id is not None:
+            totals[(post_author_id, bucket_start(created_at))] += 5
+        elif comment_author_id is not None:
+            totals[(comment_author_id, bucket_start(created_at))] += 1
+
+    KarmaBucket.objects.bulk_create(
+        [
+            KarmaBucket(user_id=user_id, bucket_start=start, points=points)
+            for (user_id, start), points in totals.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('feed', '0002_like_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KarmaBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('points', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket_start'], name='karma_bucket_start_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='karmabucket',
+            constraint=models.UniqueConstraint(fields=('user', 'bucket_start'), name='unique_user_karma_bucket'),
+        ),
+        migrations.RunPython(backfill_karma_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.27 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+def create_singleton(apps, schema_editor):
+    ContentVersion = apps.get_model("feed", "ContentVersion")
+    ContentVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0003_karma_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_singleton, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.27 on 2026-10-18 18:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0004_content_version'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='like',
+            name='unique_user_post_like',
+        ),
+        migrations.RemoveConstraint(
+            model_name='like',
+            name='unique_user_comment_like',
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='post',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='feed.post'),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='comment',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='feed.comment'),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='post',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='feed.post'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_at'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(condition=models.Q(('post__isnull', False)), fields=['post'], name='like_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(condition=models.Q(('comment__isnull', False)), fields=['comment'], name='like_comment_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['created_at', 'post', 'comment'], name='like_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_feed_order_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(condition=models.Q(('post__isnull', False)), fields=('user', 'post'), name='unique_user_post_like'),
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(condition=models.Q(('comment__isnull', False)), fields=('user', 'comment'), name='unique_user_comment_like'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.27 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+def _segment(pk):
+    # feed.models.path_segment as of this migration
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    for _ in range(8):
+        pk, digit = divmod(pk, 36)
+        out = digits[digit] + out
+    return out
+
+
+def fill_paths(apps, schema_editor):
+    Comment = apps.get_model("feed", "Comment")
+    parents = dict(Comment.objects.values_list("id", "parent_id"))
+    paths = {}
+
+    for pk in parents:
+        chain = []
+        while pk not in paths:
+            if parents[pk] is None:
+                paths[pk] = ""
+                break
+            chain.append(pk)
+            pk = parents[pk]
+        for node in reversed(chain):
+            paths[node] = paths[parents[node]] + _segment(parents[node])
+
+    replies = [Comment(id=pk, path=path) for pk, path in paths.items() if path]
+    Comment.objects.bulk_update(replies, ["path"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,41 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+# Width of one ancestor id in Comment.path
+PATH_STEP = 8
+_PATH_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def path_segment(pk):
+    """``pk`` as fixed-width base 36, so paths sort like their id sequences."""
+    digits = []
+    for _ in range(PATH_STEP):
+        pk, digit = divmod(pk, 36)
+        digits.append(_PATH_DIGITS[digit])
+    if pk:
+        raise ValueError("id too large for a comment path")
+    return "".join(reversed(digits))
+
 
 class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    like_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Feed order, walked backwards from the cursor
+            models.Index(fields=["-created_at", "-id"], name="post_feed_order_idx"),
+        ]
 
     def __str__(self):
         return self.content[:30]
 
 
 class Comment(models.Model):
-    post = models.ForeignKey(Post, related_name="comments", on_delete=models.CASCADE)
+    # Indexed by comment_post_created_idx below
+    post = models.ForeignKey(Post, related_name="comments", on_delete=models.CASCADE, db_index=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
 
     parent = models.ForeignKey(
@@ -25,19 +48,94 @@ class Comment(models.Model):
 
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    like_count = models.PositiveIntegerField(default=0)
+
+    # Materialized path: the ids of all ancestors, root first, PATH_STEP
+    # characters each ("" for a top-level comment). Descendants of a comment
+    # are the rows whose path starts with its child_path().
+    path = models.TextField(default="", blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "created_at"], name="comment_post_created_idx"),
+            # Subtree range scans and child counts
+            models.Index(fields=["post", "path"], name="comment_post_path_idx"),
+        ]
 
     def __str__(self):
         return self.content[:30]
 
+    @property
+    def depth(self):
+        return len(self.path) // PATH_STEP
+
+    def child_path(self):
+        return self.path + path_segment(self.id)
+
+    def save(self, *args, **kwargs):
+        # bulk_create skips this; callers set ``path`` themselves there
+        if self._state.adding and self.parent_id and not self.path:
+            if Comment.parent.is_cached(self):
+                parent_path = self.parent.path
+            else:
+                parent_path = Comment.objects.values_list("path", flat=True).get(id=self.parent_id)
+            self.path = parent_path + path_segment(self.parent_id)
+        super().save(*args, **kwargs)
+
 
 class Like(models.Model):
+    """A like on either a post or a comment; the other foreign key is NULL."""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    post = models.ForeignKey(Post, null=True, blank=True, on_delete=models.CASCADE)
-    comment = models.ForeignKey(Comment, null=True, blank=True, on_delete=models.CASCADE)
+    # Indexed by the partial indexes below, which skip the NULL half
+    post = models.ForeignKey(Post, null=True, blank=True, on_delete=models.CASCADE, db_index=False)
+    comment = models.ForeignKey(Comment, null=True, blank=True, on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=["user", "post"], name="unique_user_post_like"),
-            models.UniqueConstraint(fields=["user", "comment"], name="unique_user_comment_like"),
+            models.UniqueConstraint(
+                fields=["user", "post"], condition=models.Q(post__isnull=False),
+                name="unique_user_post_like",
+            ),
+            models.UniqueConstraint(
+                fields=["user", "comment"], condition=models.Q(comment__isnull=False),
+                name="unique_user_comment_like",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["post"], condition=models.Q(post__isnull=False), name="like_post_idx"),
+            models.Index(
+                fields=["comment"], condition=models.Q(comment__isnull=False), name="like_comment_idx"
+            ),
+            # Covers the leaderboard's window scan without touching the table
+            models.Index(fields=["created_at", "post", "comment"], name="like_window_idx"),
+        ]
+
+
+class KarmaBucket(models.Model):
+    """Karma earned by ``user`` from likes created within one time bucket."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    bucket_start = models.DateTimeField()
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "bucket_start"], name="unique_user_karma_bucket"),
         ]
+        indexes = [
+            models.Index(fields=["bucket_start"], name="karma_bucket_start_idx"),
+        ]
+
+
+class ContentVersion(models.Model):
+    """Single row counting writes to feed content, used as the feed/leaderboard ETag."""
+    SINGLETON_ID = 1
+
+    version = models.PositiveBigIntegerField(default=0)
+
+
+class OutboxEvent(models.Model):
+    """A socket event written with the change it announces, deleted once relayed."""
+    event = models.CharField(max_length=50)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
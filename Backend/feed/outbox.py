@@ -0,0 +1,173 @@
+"""
+Transactional outbox for socket events (``SOCKET_OUTBOX_ENABLED``).
+
+The ``publish_*`` functions in socket_events.py store their events as
+``OutboxEvent`` rows, and views wrap the write and the publish in
+``event_transaction()``, so an event exists exactly when its change was
+committed. ``OutboxRelay`` reads the rows oldest first, POSTs each batch to
+the socket server's /ingest/ endpoint and deletes the rows once the server has
+broadcast them. Whatever was not acknowledged, because the server was
+down or this process restarted, is sent again later: delivery is at least
+once, so a client can see an event twice.
+
+``like_count`` rows only name their target. The relay reads the counts when it
+sends a batch, one query per model, and sends one event per target.
+
+The relay runs as a thread in each web process (``SOCKET_OUTBOX_RELAY_THREAD``),
+started with the process by ``start_outbox_relay()``, or on its own with
+``manage.py relay_outbox``.
+"""
+import logging
+import threading
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .metrics import REGISTRY
+from .models import Comment, OutboxEvent, Post
+
+logger = logging.getLogger(__name__)
+
+DELIVERED = REGISTRY.counter(
+    "outbox_events_delivered_total", "Outbox rows acknowledged by the Socket.IO server"
+)
+BATCHES = REGISTRY.counter(
+    "outbox_batches_total", "Outbox batches sent, by outcome", ("outcome",)
+)
+
+
+def event_transaction():
+    """Atomic block for a write and its events; a no-op without the outbox."""
+    return transaction.atomic() if settings.SOCKET_OUTBOX_ENABLED else nullcontext()
+
+
+def start_outbox_relay():
+    """
+    Start this process's relay thread, if it runs one, which first delivers
+    whatever earlier processes left in the outbox. Called by the server
+    entry points, so leftovers don't wait for the next write.
+    """
+    if settings.SOCKET_OUTBOX_ENABLED and settings.SOCKET_OUTBOX_RELAY_THREAD:
+        get_outbox_relay().wake()
+
+
+def record_events(events):
+    """Store ``(event_name, payload)`` pairs in the current transaction."""
+    OutboxEvent.objects.bulk_create([OutboxEvent(event=name, payload=payload) for name, payload in events])
+    if settings.SOCKET_OUTBOX_RELAY_THREAD:
+        transaction.on_commit(get_outbox_relay().wake)
+
+
+def resolve_like_counts(events):
+    """
+    Fill in ``like_count`` events with the stored counts. One event per
+    target is kept, in the place of its last one; deleted targets are dropped.
+    """
+    post_ids = {p["post_id"] for name, p in events if name == "like_count" and p["comment_id"] is None}
+    comment_ids = {p["comment_id"] for name, p in events if name == "like_count" and p["comment_id"] is not None}
+    counts = {}
+    if post_ids:
+        for pk, like_count in Post.objects.filter(id__in=post_ids).values_list("id", "like_count"):
+            counts[(pk, None)] = like_count
+    if comment_ids:
+        for pk, post_id, like_count in Comment.objects.filter(id__in=comment_ids).values_list(
+            "id", "post_id", "like_count"
+        ):
+            counts[(post_id, pk)] = like_count
+
+    last = {
+        (p["post_id"], p["comment_id"]): i for i, (name, p) in enumerate(events) if name == "like_count"
+    }
+    resolved = []
+    for i, (name, payload) in enumerate(events):
+        if name == "like_count":
+            target = (payload["post_id"], payload["comment_id"])
+            if last[target] != i or target not in counts:
+                continue
+            payload = {**payload, "like_count": counts[target]}
+        resolved.append([name, payload])
+    return resolved
+
+
+class OutboxRelay:
+
+    def __init__(self, batch_size=500, poll_interval=1.0, retry_delay=1.0):
+        self.batch_size = batch_size
+        # Rows from other processes don't wake us, so look every so often
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._woken = False
+
+    def deliver_pending(self):
+        """
+        Send batches until the outbox is empty. Returns the number of rows
+        delivered; raises if the server could not be reached.
+        """
+        delivered = 0
+        while True:
+            rows = list(OutboxEvent.objects.order_by("id").values_list("id", "event", "payload")[:self.batch_size])
+            if not rows:
+                return delivered
+
+            events = resolve_like_counts([(name, payload) for _, name, payload in rows])
+            # Looked up per batch: socket_events imports this module, and
+            # use_transport() may swap its transport
+            from . import socket_events
+            try:
+                if events:
+                    socket_events.emit_batch(events)
+            except Exception:
+                BATCHES.inc(outcome="failed")
+                raise
+            BATCHES.inc(outcome="delivered")
+
+            OutboxEvent.objects.filter(id__in=[pk for pk, _, _ in rows]).delete()
+            DELIVERED.inc(len(rows))
+            delivered += len(rows)
+
+    def wake(self):
+        with self._lock:
+            self._woken = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run_forever, name="outbox-relay", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def run_forever(self):
+        delay = 0
+        while True:
+            with self._lock:
+                self._wake.wait_for(lambda: self._woken, timeout=delay or self.poll_interval)
+                self._woken = False
+            try:
+                self.deliver_pending()
+                delay = 0
+            except Exception:
+                logger.warning("Outbox delivery failed, will retry", exc_info=True)
+                delay = self.retry_delay
+                with self._lock:
+                    # A wake-up shouldn't turn the retry delay into a busy loop
+                    self._woken = False
+            finally:
+                close_old_connections()
+
+
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def get_outbox_relay():
+    global _relay
+    if _relay is None:
+        with _relay_lock:
+            if _relay is None:
+                _relay = OutboxRelay(
+                    batch_size=settings.SOCKET_OUTBOX_BATCH_SIZE,
+                    poll_interval=settings.SOCKET_OUTBOX_POLL_MS / 1000,
+                )
+    return _relay
@@ -0,0 +1,82 @@
+"""
+Keyset (cursor) pagination for the feed.
+
+Posts are ordered newest first on ``(created_at, id)``. The cursor handed to
+clients is an opaque, URL-safe token encoding the last row of the page, so the
+next page is a simple range query instead of an ever-growing OFFSET scan.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    raw = json.dumps([created_at.isoformat(), pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursor("invalid cursor")
+
+
+def parse_page_size(value):
+    """Clamp the requested page size to ``1..FEED_MAX_PAGE_SIZE``."""
+    if value in (None, ""):
+        return settings.FEED_PAGE_SIZE
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return settings.FEED_PAGE_SIZE
+    return max(1, min(size, settings.FEED_MAX_PAGE_SIZE))
+
+
+def paginate_posts(queryset, cursor, page_size):
+    """
+    Return ``(posts, next_cursor)`` for one page of ``queryset``. Works on
+    model instances and on ``.values()`` dicts alike.
+
+    One extra row is fetched to know whether a next page exists; ``next_cursor``
+    is ``None`` on the last page.
+    """
+    return split_page(list(page_queryset(queryset, cursor, page_size)), page_size)
+
+
+def page_queryset(queryset, cursor, page_size):
+    """
+    The rows of the page after ``cursor`` plus one, for fetching the page
+    separately (e.g. with ``async for``) and passing it to ``split_page()``.
+    """
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+
+    return queryset.order_by("-created_at", "-id")[:page_size + 1]
+
+
+def split_page(posts, page_size):
+    """``(posts, next_cursor)`` from the fetched rows of ``page_queryset()``."""
+    next_cursor = None
+    if len(posts) > page_size:
+        posts = posts[:page_size]
+        last = posts[-1]
+        if isinstance(last, dict):
+            next_cursor = encode_cursor(last["created_at"], last["id"])
+        else:
+            next_cursor = encode_cursor(last.created_at, last.id)
+
+    return posts, next_cursor
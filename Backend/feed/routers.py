@@ -0,0 +1,82 @@
+"""
+Read replica routing.
+
+Only reads made inside ``replica_reads()`` go to one of the
+``DATABASE_REPLICAS``; the feed and leaderboard views wrap themselves in it
+with ``@read_from_replica``. Everything else, and every write, stays on
+``default``.
+
+For read-your-writes, ``ReplicaPinMiddleware`` pins a user to the primary
+for ``REPLICA_STICKY_SECONDS`` after any successful mutation. The pin lives
+in the cache, so it needs a cache shared by all processes in production.
+"""
+import random
+from asyncio import iscoroutinefunction
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Alias reads in the current context go to, or None for the default routing
+_read_alias = ContextVar("feed_read_alias", default=None)
+
+
+def _pin_key(user_id):
+    return f"replica:pinned:{user_id}"
+
+
+def pin_to_primary(user_id):
+    cache.set(_pin_key(user_id), True, timeout=settings.REPLICA_STICKY_SECONDS)
+
+
+def choose_replica(user=None):
+    """A replica alias for ``user``'s reads, or ``None`` to use the primary."""
+    if not settings.DATABASE_REPLICAS:
+        return None
+    if user is not None and user.is_authenticated and cache.get(_pin_key(user.id)):
+        return None
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+@contextmanager
+def replica_reads(user=None):
+    token = _read_alias.set(choose_replica(user))
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def read_from_replica(view):
+    """Run ``view`` inside ``replica_reads()`` for the requesting user."""
+    if iscoroutinefunction(view):
+        # The alias is a context variable, so it follows the view's ORM calls
+        # into sync_to_async threads
+        @wraps(view)
+        async def ainner(request, *args, **kwargs):
+            with replica_reads(request.user):
+                return await view(request, *args, **kwargs)
+
+        return ainner
+
+    @wraps(view)
+    def inner(request, *args, **kwargs):
+        with replica_reads(request.user):
+            return view(request, *args, **kwargs)
+
+    return inner
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
@@ -0,0 +1,252 @@
+"""
+Deterministic synthetic data for reproducing production-scale load locally.
+
+Rows are written with chunked ``bulk_create`` calls, each in its own
+transaction, after checking that none of the usernames are taken, and the denormalized ``like_count`` columns and karma buckets
+are filled in as the likes are generated, so the result looks like data the
+API itself would have written. The same ``seed``, ``until`` and sizes always
+produce the same rows.
+"""
+import math
+import random
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .karma import POST_LIKE_POINTS, COMMENT_LIKE_POINTS, bucket_start, prune_buckets, window_start
+from .models import Post, Comment, Like, KarmaBucket, path_segment
+
+DEFAULT_PASSWORD = "password"
+
+
+@contextmanager
+def preserve_timestamps(*models):
+    """Let ``bulk_create`` keep explicit ``created_at`` values."""
+    fields = [m._meta.get_field("created_at") for m in models]
+    for f in fields:
+        f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f in fields:
+            f.auto_now_add = True
+
+
+def comment_levels(total, depth, branching):
+    """
+    Split ``total`` comments into per-level counts for trees at most ``depth``
+    levels deep where each comment has ``branching`` replies on average.
+    """
+    if total <= 0:
+        return []
+
+    depth = max(depth, 1)
+    per_root = sum(branching ** level for level in range(depth))
+    size = max(1, math.ceil(total / per_root))
+
+    levels = []
+    remaining = total
+    for _ in range(depth):
+        size = min(size, remaining)
+        levels.append(size)
+        remaining -= size
+        if not remaining:
+            break
+        size *= branching
+    return levels
+
+
+def _insert(model, objs, chunk_size):
+    """``bulk_create`` ``objs`` in one transaction and return their primary keys."""
+    with transaction.atomic():
+        model.objects.bulk_create(objs, batch_size=chunk_size)
+        if objs and objs[-1].pk is None:
+            # Backends without INSERT ... RETURNING: the new rows are the newest ids.
+            ids = model.objects.order_by("-id").values_list("id", flat=True)[:len(objs)]
+            for obj, pk in zip(objs, reversed(list(ids))):
+                obj.pk = pk
+    return [obj.pk for obj in objs]
+
+
+def _taken_usernames(usernames, chunk_size):
+    """How many of ``usernames`` already exist."""
+    return sum(
+        User.objects.filter(username__in=usernames[i:i + chunk_size]).count()
+        for i in range(0, len(usernames), chunk_size)
+    )
+
+
+def _write_like_counts(model, ids, counts, chunk_size):
+    """Set ``like_count`` with one UPDATE per distinct count and id chunk."""
+    by_count = defaultdict(list)
+    for index, count in counts.items():
+        by_count[count].append(ids[index])
+
+    with transaction.atomic():
+        for count, pks in by_count.items():
+            for i in range(0, len(pks), chunk_size):
+                model.objects.filter(pk__in=pks[i:i + chunk_size]).update(like_count=count)
+
+
+def seed_dataset(users, posts, comments, likes, depth=1, branching=3, seed=42,
+                 span=timedelta(hours=48), until=None, chunk_size=5000, prefix="bench",
+                 log=None):
+    """
+    Generate ``users`` users, ``posts`` posts, ``comments`` comments arranged
+    in trees up to ``depth`` levels deep, and ``likes`` likes spread evenly
+    over users. Everything is created within ``span`` before ``until``
+    (default: now), and replies and likes never predate what they point at.
+
+    ``log`` is called with a progress message after each phase. Returns the
+    row counts. Raises ``ValueError`` without writing anything if users
+    named ``prefix`` plus a number up to ``users`` already exist.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    until = until or now
+    end = until.timestamp()
+    start = end - span.total_seconds()
+    log = log or (lambda message: None)
+
+    def after(ts):
+        return ts + rng.random() * (end - ts)
+
+    def as_datetime(ts):
+        return datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+
+    usernames = [f"{prefix}{n}" for n in range(users)]
+    taken = _taken_usernames(usernames, chunk_size)
+    if taken:
+        raise ValueError(
+            f"{taken} of the users {usernames[0]} to {usernames[-1]} already exist, "
+            f"use another prefix"
+        )
+
+    password = make_password(DEFAULT_PASSWORD)
+    user_ids = []
+    for i in range(0, users, chunk_size):
+        user_ids += _insert(
+            User,
+            [User(username=username, password=password) for username in usernames[i:i + chunk_size]],
+            chunk_size,
+        )
+    log(f"{len(user_ids)} users")
+
+    post_ids, post_authors, post_times = array("q"), array("q"), array("d")
+    with preserve_timestamps(Post, Comment, Like):
+        for i in range(0, posts, chunk_size):
+            batch = []
+            for n in range(i, min(i + chunk_size, posts)):
+                author_id = rng.choice(user_ids)
+                created_at = after(start)
+                post_authors.append(author_id)
+                post_times.append(created_at)
+                batch.append(Post(author_id=author_id, content=f"post {n}",
+                                  created_at=as_datetime(created_at)))
+            post_ids.extend(_insert(Post, batch, chunk_size))
+        log(f"{len(post_ids)} posts")
+
+        # Comments are written one tree level at a time so every reply can
+        # point at a parent whose primary key is already known.
+        comment_ids, comment_authors, comment_times = array("q"), array("q"), array("d")
+        comment_posts = array("q")
+        comment_paths = []
+        parents = None
+        for level, size in enumerate(comment_levels(comments if posts else 0, depth, branching)):
+            first = len(comment_ids)
+            for i in range(0, size, chunk_size):
+                batch = []
+                for _ in range(i, min(i + chunk_size, size)):
+                    if parents is None:
+                        parent, post = None, rng.randrange(len(post_ids))
+                        created_at = after(post_times[post])
+                        post_id = post_ids[post]
+                        path = ""
+                    else:
+                        parent = rng.choice(parents)
+                        created_at = after(comment_times[parent])
+                        post_id = comment_posts[parent]
+                        path = comment_paths[parent] + path_segment(comment_ids[parent])
+                        parent = comment_ids[parent]
+
+                    author_id = rng.choice(user_ids)
+                    comment_authors.append(author_id)
+                    comment_times.append(created_at)
+                    comment_posts.append(post_id)
+                    comment_paths.append(path)
+                    batch.append(Comment(
+                        post_id=post_id, parent_id=parent, path=path, author_id=author_id,
+                        content=f"comment {len(comment_ids) + len(batch)}",
+                        created_at=as_datetime(created_at),
+                    ))
+                comment_ids.extend(_insert(Comment, batch, chunk_size))
+            parents = range(first, len(comment_ids))
+            log(f"{size} comments at depth {level}")
+
+        # Every user likes a distinct sample of posts and comments.
+        targets = len(post_ids) + len(comment_ids)
+        per_user, extra = divmod(min(likes, len(user_ids) * targets), max(len(user_ids), 1))
+        since = window_start(now).timestamp()
+        counts = Counter()
+        karma = defaultdict(int)
+        batch = []
+        created = 0
+
+        for n, user_id in enumerate(user_ids):
+            for target in rng.sample(range(targets), per_user + (n < extra)):
+                counts[target] += 1
+                if target < len(post_ids):
+                    created_at = after(post_times[target])
+                    like = Like(user_id=user_id, post_id=post_ids[target])
+                    author_id, points = post_authors[target], POST_LIKE_POINTS
+                else:
+                    comment = target - len(post_ids)
+                    created_at = after(comment_times[comment])
+                    like = Like(user_id=user_id, comment_id=comment_ids[comment])
+                    author_id, points = comment_authors[comment], COMMENT_LIKE_POINTS
+
+                like.created_at = as_datetime(created_at)
+                batch.append(like)
+                if created_at >= since:
+                    karma[(author_id, bucket_start(like.created_at))] += points
+
+            if len(batch) >= chunk_size:
+                with transaction.atomic():
+                    Like.objects.bulk_create(batch, batch_size=chunk_size)
+                created += len(batch)
+                batch = []
+
+        with transaction.atomic():
+            Like.objects.bulk_create(batch, batch_size=chunk_size)
+        created += len(batch)
+        log(f"{created} likes")
+
+    _write_like_counts(Post, post_ids, {t: c for t, c in counts.items() if t < len(post_ids)}, chunk_size)
+    _write_like_counts(
+        Comment, comment_ids,
+        {t - len(post_ids): c for t, c in counts.items() if t >= len(post_ids)},
+        chunk_size,
+    )
+    log("like counts")
+
+    with transaction.atomic():
+        KarmaBucket.objects.bulk_create(
+            [KarmaBucket(user_id=u, bucket_start=b, points=p) for (u, b), p in karma.items()],
+            batch_size=chunk_size,
+        )
+        prune_buckets(now)
+    log(f"{len(karma)} karma buckets")
+
+    return {
+        "users": len(user_ids),
+        "posts": len(post_ids),
+        "comments": len(comment_ids),
+        "likes": created,
+        "karma_buckets": len(karma),
+    }
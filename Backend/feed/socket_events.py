@@ -1,61 +1,209 @@
 """
 Socket event emitter for real-time updates
+
+Events are small deltas built from the object a view just wrote, so emitting
+them never re-serializes a post, a comment tree or the feed:
+
+    post_created        {"post": {...}}                                   everyone
+    post_deleted        {"post_id": 1}                                    everyone
+    comment_added       {"post_id": 1, "parent_id": 2, "comment": {...}}  post room
+    comment_deleted     {"post_id": 1, "comment_id": 3}                   post room
+    like_count          {"post_id": 1, "comment_id": 3, "like_count": 7}  post room
+    leaderboard_update  {"leaderboard": [...]}                            everyone
+
+``comment_id`` is ``None`` in ``like_count`` events about the post itself.
 """
-import threading
-from .serializers import PostSerializer
-from .models import Post
+from django.conf import settings
+from django.db import transaction
+from rest_framework import serializers
+
+from .dispatch import get_dispatcher
+from .metrics import REGISTRY
+from .models import Post, Comment
+from .outbox import record_events, start_outbox_relay
 
 try:
-    from socketio_client import emit_event
+    from socketio_client import connect_callbacks, emit_event, emit_batch
 except ImportError:
+    connect_callbacks = []
+
     def emit_event(event_name, event_data):
         pass
 
-def broadcast_feed_update():
-    """Broadcast updated feed to all connected clients"""
-    try:
-        posts = Post.objects.all().order_by('-created_at')
-        serializer = PostSerializer(post, context={"request": None})
+    def emit_batch(events):
+        raise ConnectionError("socketio_client is not available")
 
-        emit_event('feed_update', {'posts': serializer.data})
-    except Exception as e:
-        print(f"Feed update error: {e}")
+# Send what piled up in the outbox while the socket server was away
+connect_callbacks.append(start_outbox_relay)
+
+_timestamp = serializers.DateTimeField().to_representation
+
+EVENTS_EMITTED = REGISTRY.counter(
+    "socket_events_emitted_total", "Events sent to the Socket.IO server", ("event",)
+)
 
-def broadcast_like_update(post_id):
-    """Broadcast like count update for a specific post"""
+def post_payload(post, author):
+    """A feed post as rendered by PostSerializer, with no comments yet"""
+    return {
+        'id': post.id,
+        'author': author,
+        'author_id': post.author_id,
+        'content': post.content,
+        'created_at': _timestamp(post.created_at),
+        'like_count': post.like_count,
+        'comments': [],
+    }
+
+def comment_payload(comment, author):
+    """A single comment tree node with no children yet"""
+    return {
+        'id': comment.id,
+        'author': author,
+        'author_id': comment.author_id,
+        'content': comment.content,
+        'created_at': _timestamp(comment.created_at),
+        'like_count': comment.like_count,
+        'children': [],
+    }
+
+def use_transport(func, batch_func=None):
+    """
+    Send every event through ``func(event_name, payload)`` instead of
+    socketio_client's requests, e.g. straight to a Socket.IO server running in
+    this process (myproject/asgi_combined.py). ``batch_func(events)`` sends
+    the outbox relay's batches and must raise unless they were delivered.
+    """
+    global emit_event, emit_batch
+    emit_event = func
+    if batch_func is not None:
+        emit_batch = batch_func
+
+def broadcast(event_name, payload):
     try:
-        post = Post.objects.get(id=post_id)
-        emit_event('like_update', {
-            'post_id': post_id,
-            'like_count': post.like_set.count()
-        })
-    except Post.DoesNotExist:
-        pass
+        emit_event(event_name, payload)
+        EVENTS_EMITTED.inc(event=event_name)
     except Exception as e:
-        print(f"Like update error: {e}")
+        print(f"{event_name} error: {e}")
+
+def publish(event_name, payload):
+    """Send an event once the current transaction commits, or store it in the outbox"""
+    if settings.SOCKET_OUTBOX_ENABLED:
+        record_events([(event_name, payload)])
+    else:
+        emit_sync(lambda: broadcast(event_name, payload))
+
+def publish_post_created(post, author):
+    publish('post_created', {'post': post_payload(post, author)})
+
+def publish_post_deleted(post_id):
+    publish('post_deleted', {'post_id': post_id})
+
+def publish_comment_added(comment, author):
+    publish('comment_added', {
+        'post_id': comment.post_id,
+        'parent_id': comment.parent_id,
+        'comment': comment_payload(comment, author),
+    })
 
-def broadcast_comment_update(post_id):
-    """Broadcast comment update for a specific post"""
+def publish_comment_deleted(comment_id, post_id):
+    publish('comment_deleted', {'post_id': post_id, 'comment_id': comment_id})
+
+def publish_like_count(post_id, comment_id=None):
+    """
+    The count is read when the event is sent rather than by the view: a burst
+    of likes on one target coalesces into a single read and emit.
+    """
+    if settings.SOCKET_OUTBOX_ENABLED:
+        record_events([('like_count', {'post_id': post_id, 'comment_id': comment_id})])
+        return
+    emit_sync(
+        lambda: broadcast_like_count(post_id, comment_id),
+        key=('like_count', post_id, comment_id),
+    )
+
+def broadcast_like_count(post_id, comment_id=None):
+    """Broadcast the stored like count of a post or comment"""
     try:
-        post = Post.objects.get(id=post_id)
-        serializer = PostSerializer(post)
-        emit_event('comment_update', {
-            'post_id': post_id,
-            'post': serializer.data
-        })
-    except Post.DoesNotExist:
-        pass
-    except Exception as e:
-        print(f"Comment update error: {e}")
-
-def emit_sync(func):
-    """Helper to emit socket events in a background thread"""
-    def wrapper():
-        try:
-            func()
-        except Exception as e:
-            print(f"Emit error: {e}")
-    
-    thread = threading.Thread(target=wrapper, daemon=True)
-    thread.start()
+        if comment_id is None:
+            like_count = Post.objects.values_list('like_count', flat=True).get(id=post_id)
+        else:
+            like_count = Comment.objects.values_list('like_count', flat=True).get(id=comment_id)
+    except (Post.DoesNotExist, Comment.DoesNotExist):
+        return
+
+    broadcast('like_count', {
+        'post_id': post_id,
+        'comment_id': comment_id,
+        'like_count': like_count,
+    })
+
+def publish_batch(like_targets=(), comments_added=(), comments_deleted=()):
+    """
+    Events for one batch of mutations, sent by a single dispatcher task.
+
+    ``like_targets`` holds ``(post_id, comment_id)`` pairs, ``comments_added``
+    new comments with their ``author`` loaded, ``comments_deleted``
+    ``(comment_id, post_id)`` pairs. Counts are read when the task runs, one
+    query per model.
+    """
+    added = [
+        {
+            'post_id': comment.post_id,
+            'parent_id': comment.parent_id,
+            'comment': comment_payload(comment, comment.author.username),
+        }
+        for comment in comments_added
+    ]
+    deleted = [{'post_id': post_id, 'comment_id': comment_id} for comment_id, post_id in comments_deleted]
+    like_targets = list(like_targets)
+
+    if settings.SOCKET_OUTBOX_ENABLED:
+        record_events(
+            [('comment_added', payload) for payload in added]
+            + [('comment_deleted', payload) for payload in deleted]
+            + [('like_count', {'post_id': post_id, 'comment_id': comment_id})
+               for post_id, comment_id in like_targets]
+        )
+        return
+
+    def send():
+        for payload in added:
+            broadcast('comment_added', payload)
+        for payload in deleted:
+            broadcast('comment_deleted', payload)
+        broadcast_like_counts(like_targets)
+
+    emit_sync(send)
+
+def broadcast_like_counts(targets):
+    """Broadcast the stored like counts of ``(post_id, comment_id)`` pairs"""
+    post_ids = [post_id for post_id, comment_id in targets if comment_id is None]
+    comment_ids = [comment_id for _, comment_id in targets if comment_id is not None]
+
+    posts = Post.objects.filter(id__in=post_ids).values_list('id', 'like_count') if post_ids else []
+    for post_id, like_count in posts:
+        broadcast('like_count', {'post_id': post_id, 'comment_id': None, 'like_count': like_count})
+
+    comments = (
+        Comment.objects.filter(id__in=comment_ids).values_list('id', 'post_id', 'like_count')
+        if comment_ids else []
+    )
+    for comment_id, post_id, like_count in comments:
+        broadcast('like_count', {'post_id': post_id, 'comment_id': comment_id, 'like_count': like_count})
+
+def broadcast_leaderboard_update(leaderboard):
+    """Broadcast a changed leaderboard so clients don't have to poll it"""
+    broadcast('leaderboard_update', {'leaderboard': leaderboard})
+
+def emit_sync(func, key=None, on_drop=None):
+    """
+    Run ``func`` on the background event dispatcher once the current
+    transaction commits (at once outside one).
+
+    Pending tasks with the same ``key`` are coalesced into one, so pass a key
+    for events that only need to reflect the latest state (e.g. a post's like
+    count). ``on_drop`` is called instead of ``func`` if the dispatcher drops
+    it on overflow.
+    """
+    transaction.on_commit(lambda: get_dispatcher().submit(func, key=key, on_drop=on_drop))
 
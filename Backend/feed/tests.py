@@ -1,11 +1,37 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import IntegrityError, close_old_connections, connection
+from django.db.models import Count, F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth.models import User
 
-from .models import Post, Comment, Like
+from .models import Post, Comment, Like, KarmaBucket, OutboxEvent
+from .admission import AdmissionController, Rejected, TokenBuckets
+from .auth import issue_token, load_user
+from .dispatch import EventDispatcher, BLOCK, DROP_OLDEST
+from .karma import bucket_start
+from .like_buffer import LikeBuffer
+from .outbox import OutboxRelay, start_outbox_relay
+from .metrics import Registry
+from .leaderboard import ENGINES, compute_leaderboard, get_leaderboard, REFRESH_LOCK_KEY, SNAPSHOT_KEY
+from .seeding import comment_levels, seed_dataset
 
 
+@override_settings(MOCK_AUTH_ENABLED=True)
 class LeaderboardTest(TestCase):
 
     def setUp(self):
@@ -52,3 +78,1719 @@ class LeaderboardTest(TestCase):
 
         # Bob should have 1 point
         self.assertEqual(scores["bob"], 1)
+
+    def test_leaderboard_engines_agree(self):
+        Like.objects.create(user=self.user2, post=self.post)
+        Like.objects.create(user=self.user1, comment=self.comment)
+        old_like = Like.objects.create(user=self.user2, comment=self.comment)
+        old_like.created_at = timezone.now() - timedelta(days=2)
+        old_like.save()
+
+        call_command("prune_karma_buckets", "--rebuild", stdout=StringIO())
+
+        expected = [{"username": "alice", "total": 5}, {"username": "bob", "total": 1}]
+        self.assertEqual(compute_leaderboard("likes"), expected)
+        self.assertEqual(compute_leaderboard("buckets"), expected)
+
+    @override_settings(LEADERBOARD_CACHE_TTL=0)
+    def test_like_endpoints_update_buckets(self):
+        self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.user2.id}")
+        self.client.post(f"/api/like/comment/{self.comment.id}/?user_id={self.user1.id}")
+
+        self.assertEqual(
+            self.client.get("/api/leaderboard/").json(),
+            [{"username": "alice", "total": 5}, {"username": "bob", "total": 1}],
+        )
+
+        self.client.delete(f"/api/unlike/post/{self.post.id}/?user_id={self.user2.id}")
+
+        self.assertEqual(
+            self.client.get("/api/leaderboard/").json(),
+            [{"username": "bob", "total": 1}],
+        )
+
+    def test_deleting_content_takes_its_likes_out_of_the_buckets(self):
+        reply = Comment.objects.create(post=self.post, author=self.user2, content="Reply", parent=self.comment)
+        other = Comment.objects.create(post=Post.objects.create(author=self.user1, content="Other"),
+                                       author=self.user2, content="Elsewhere")
+        for comment in (self.comment, reply, other):
+            self.client.post(f"/api/like/comment/{comment.id}/?user_id={self.user1.id}")
+        self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.user2.id}")
+
+        self.client.delete(f"/api/comment/delete/{self.comment.id}/?user_id={self.user2.id}")
+        expected = [{"username": "alice", "total": 5}, {"username": "bob", "total": 1}]
+        self.assertEqual(compute_leaderboard("buckets"), expected)
+
+        self.client.delete(f"/api/post/{self.post.id}/?user_id={self.user1.id}")
+        self.assertEqual(compute_leaderboard("buckets"), [{"username": "bob", "total": 1}])
+        self.assertEqual(compute_leaderboard("likes"), compute_leaderboard("buckets"))
+
+        batch = {"operations": [{"op": "delete_comment", "comment_id": other.id}]}
+        self.client.post(f"/api/batch/?user_id={self.user2.id}", batch, content_type="application/json")
+        self.assertEqual(compute_leaderboard("buckets"), [])
+
+
+class FeedPaginationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        self.posts = [
+            Post.objects.create(author=self.user, content=f"post {i}")
+            for i in range(5)
+        ]
+        Comment.objects.create(post=self.posts[0], author=self.user, content="old")
+        Comment.objects.create(post=self.posts[4], author=self.user, content="new")
+
+    def get_json(self, url):
+        # getvalue() also drains the streamed fast-path response
+        return json.loads(self.client.get(url).getvalue())
+
+    def test_cursor_walks_every_post_once(self):
+        seen = []
+        url = "/api/feed/?page_size=2"
+
+        while url:
+            data = self.get_json(url)
+            seen.extend(p["id"] for p in data["results"])
+            url = f"/api/feed/?page_size=2&cursor={data['next']}" if data["next"] else None
+
+        self.assertEqual(seen, [p.id for p in reversed(self.posts)])
+
+    def test_comments_only_for_current_page(self):
+        data = self.get_json("/api/feed/?page_size=1")
+
+        self.assertEqual(len(data["results"]), 1)
+        self.assertEqual(data["results"][0]["comments"][0]["content"], "new")
+
+    def test_legacy_flag_returns_everything(self):
+        data = self.get_json("/api/feed/?all=1")
+
+        self.assertEqual(len(data), 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/feed/?cursor=garbage")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class FastFeedTest(TestCase):
+
+    def setUp(self):
+        alice = User.objects.create_user(username="alice")
+        bob = User.objects.create_user(username="böb")
+        posts = [
+            Post.objects.create(author=alice, content="plain"),
+            Post.objects.create(author=bob, content='quotes " \\ \n\t\x01 ünïcode 😀 \u2028\u2029', like_count=3),
+            Post.objects.create(author=alice, content="no comments"),
+        ]
+        root = Comment.objects.create(post=posts[0], author=bob, content="root")
+        reply = Comment.objects.create(post=posts[0], author=alice, content="reply", parent=root)
+        Comment.objects.create(post=posts[0], author=bob, content="nested", parent=reply, like_count=2)
+        Comment.objects.create(post=posts[1], author=alice, content="\u2028")
+
+        # A reply created with an older id than its parent must still nest
+        late = Comment.objects.create(post=posts[1], author=bob, content="late root")
+        Comment.objects.filter(content="\u2028").update(parent=late)
+
+    def assertSameBytes(self, url):
+        with override_settings(FEED_FAST_PATH=False):
+            expected = self.client.get(url)
+        actual = self.client.get(url)
+
+        self.assertFalse(expected.streaming)
+        self.assertTrue(actual.streaming)
+        self.assertEqual(actual["Content-Type"], "application/json")
+        self.assertEqual(actual.getvalue(), expected.content)
+
+    def test_matches_serializer_output(self):
+        self.assertSameBytes("/api/feed/?page_size=2")
+        self.assertSameBytes("/api/feed/?all=1")
+
+    def test_matches_serializer_output_without_orjson(self):
+        with mock.patch("feed.fast_feed.orjson", None):
+            self.assertSameBytes("/api/feed/?page_size=2")
+            self.assertSameBytes("/api/feed/?all=1")
+
+    def test_next_page(self):
+        cursor = json.loads(self.client.get("/api/feed/?page_size=2").getvalue())["next"]
+
+        self.assertSameBytes(f"/api/feed/?page_size=2&cursor={cursor}")
+
+
+@mock.patch("feed.socket_events.emit_sync")
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username="alice")
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {issue_token(self.alice)}"}
+        self.post = Post.objects.create(author=self.alice, content="hello")
+
+    def revalidate(self, url):
+        etag = self.client.get(url)["ETag"]
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_feed_is_304_after_one_query(self, emit_sync):
+        etag = self.client.get("/api/feed/")["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/feed/", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+    def test_every_mutation_changes_the_etag(self, emit_sync):
+        other = Post.objects.create(author=self.alice, content="other")
+        comment = Comment.objects.create(post=self.post, author=self.alice, content="c")
+        mutations = [
+            lambda: self.client.post("/api/post/", {"content": "new"}, content_type="application/json", **self.auth),
+            lambda: self.client.post(f"/api/like/post/{self.post.id}/", **self.auth),
+            lambda: self.client.delete(f"/api/unlike/post/{self.post.id}/", **self.auth),
+            lambda: self.client.post(f"/api/like/comment/{comment.id}/", **self.auth),
+            lambda: self.client.delete(f"/api/unlike/comment/{comment.id}/", **self.auth),
+            lambda: self.client.post(f"/api/comment/{self.post.id}/", {"content": "hi"},
+                                     content_type="application/json", **self.auth),
+            lambda: self.client.delete(f"/api/comment/delete/{comment.id}/", **self.auth),
+            lambda: self.client.delete(f"/api/post/{other.id}/", **self.auth),
+        ]
+
+        for mutate in mutations:
+            etag = self.client.get("/api/feed/")["ETag"]
+            self.assertEqual(mutate().status_code, 200)
+            response = self.client.get("/api/feed/", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_failed_mutation_keeps_the_etag(self, emit_sync):
+        etag = self.client.get("/api/feed/")["ETag"]
+        self.client.post("/api/comment/%d/" % self.post.id, {}, content_type="application/json", **self.auth)
+
+        self.assertEqual(self.client.get("/api/feed/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    @override_settings(LEADERBOARD_CACHE_TTL=0)
+    def test_leaderboard_uncached(self, emit_sync):
+        self.assertEqual(self.revalidate("/api/leaderboard/").status_code, 304)
+
+    @override_settings(LEADERBOARD_CACHE_TTL=60)
+    def test_leaderboard_snapshot_behind_latest_write_has_no_etag(self, emit_sync):
+        # No snapshot yet: computed and cached without an ETag
+        self.assertNotIn("ETag", self.client.get("/api/leaderboard/"))
+        self.assertEqual(self.revalidate("/api/leaderboard/").status_code, 304)
+
+        self.client.post(f"/api/like/post/{self.post.id}/", **self.auth)
+
+        # The snapshot is not stale yet, so it still predates the like
+        self.assertNotIn("ETag", self.client.get("/api/leaderboard/"))
+
+
+@override_settings(MOCK_AUTH_ENABLED=True)
+class LikeCountTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.post = Post.objects.create(author=self.alice, content="Hello")
+        self.comment = Comment.objects.create(post=self.post, author=self.bob, content="Hi")
+
+    def test_like_endpoints_maintain_counts(self):
+        self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.bob.id}")
+        self.client.post(f"/api/like/comment/{self.comment.id}/?user_id={self.alice.id}")
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.comment.like_count), (1, 1))
+
+        self.client.delete(f"/api/unlike/post/{self.post.id}/?user_id={self.bob.id}")
+        self.client.delete(f"/api/unlike/comment/{self.comment.id}/?user_id={self.alice.id}")
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.comment.like_count), (0, 0))
+
+    def test_unknown_comment_or_missing_like_is_not_found(self):
+        response = self.client.post(f"/api/like/comment/{self.comment.id + 1}/?user_id={self.alice.id}")
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.delete(f"/api/unlike/comment/{self.comment.id}/?user_id={self.alice.id}")
+        self.assertEqual(response.status_code, 404)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.like_count, 0)
+
+    def test_duplicate_like_does_not_double_count(self):
+        self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.bob.id}")
+        response = self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.bob.id}")
+
+        self.assertEqual(response.status_code, 400)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+    def test_reconcile_repairs_drift(self):
+        Like.objects.create(user=self.bob, post=self.post)
+        Comment.objects.filter(id=self.comment.id).update(like_count=7)
+
+        call_command("reconcile_like_counts", stdout=StringIO())
+
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.comment.like_count), (1, 0))
+
+
+@override_settings(MOCK_AUTH_ENABLED=True)
+@override_settings(LEADERBOARD_CACHE_TTL=60)
+@mock.patch("feed.leaderboard.emit_sync", side_effect=lambda func, **kwargs: func())
+@mock.patch("feed.leaderboard.broadcast_leaderboard_update")
+class LeaderboardCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.post = Post.objects.create(author=self.alice, content="Hello")
+
+    def expire_snapshot(self):
+        snapshot = cache.get(SNAPSHOT_KEY)
+        snapshot["computed_at"] -= 120
+        cache.set(SNAPSHOT_KEY, snapshot, timeout=None)
+
+    def test_fresh_snapshot_is_reused(self, broadcast, emit_sync):
+        self.assertEqual(get_leaderboard(), [])
+        self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.bob.id}")
+
+        self.assertEqual(get_leaderboard(), [])
+        broadcast.assert_not_called()
+
+    def test_stale_snapshot_served_then_refreshed_and_pushed(self, broadcast, emit_sync):
+        get_leaderboard()
+        self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.bob.id}")
+        self.expire_snapshot()
+
+        # The stale data is returned while the refresh runs
+        self.assertEqual(get_leaderboard(), [])
+        self.assertEqual(get_leaderboard(), [{"username": "alice", "total": 5}])
+        broadcast.assert_called_once_with([{"username": "alice", "total": 5}])
+
+    def test_unchanged_ranking_is_not_pushed(self, broadcast, emit_sync):
+        get_leaderboard()
+        self.expire_snapshot()
+        get_leaderboard()
+
+        broadcast.assert_not_called()
+
+    def test_refresh_lock_is_released_when_dropped(self, broadcast, emit_sync):
+        get_leaderboard()
+        self.expire_snapshot()
+        emit_sync.side_effect = lambda func, key=None, on_drop=None: on_drop()
+
+        get_leaderboard()
+        self.assertIsNone(cache.get(REFRESH_LOCK_KEY))
+
+    def test_missing_snapshot_is_computed_once(self, broadcast, emit_sync):
+        cache.add(REFRESH_LOCK_KEY, True)
+        cache.set(SNAPSHOT_KEY, {"data": ["computed elsewhere"], "computed_at": time.time()})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_leaderboard(), ["computed elsewhere"])
+
+        cache.delete(SNAPSHOT_KEY)
+        with mock.patch("feed.leaderboard.COLD_WAIT_TIMEOUT", 0), self.assertNumQueries(0):
+            self.assertEqual(get_leaderboard(), [])
+
+        cache.delete(REFRESH_LOCK_KEY)
+        self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.bob.id}")
+        self.assertEqual(get_leaderboard(), [{"username": "alice", "total": 5}])
+        self.assertIsNone(cache.get(REFRESH_LOCK_KEY))
+
+
+class EventDispatcherTest(SimpleTestCase):
+
+    def test_same_key_coalesces_to_latest(self):
+        dispatcher = EventDispatcher(workers=1, coalesce_window=0.2)
+        ran = []
+
+        for i in range(10):
+            dispatcher.submit(lambda i=i: ran.append(i), key=("like_update", 1))
+        dispatcher.submit(lambda: ran.append("other"), key=("like_update", 2))
+
+        self.assertTrue(dispatcher.drain(timeout=5))
+        self.assertEqual(sorted(ran, key=str), [9, "other"])
+        stats = dispatcher.stats()
+        self.assertEqual((stats["submitted"], stats["coalesced"], stats["processed"]), (11, 9, 2))
+
+    def test_drop_oldest_when_full(self):
+        dispatcher = EventDispatcher(workers=1, maxsize=2, coalesce_window=0)
+        release = threading.Event()
+        ran = []
+
+        dispatcher.submit(release.wait)
+        while dispatcher.stats()["in_flight"] == 0:
+            time.sleep(0.001)
+        for i in range(3):
+            dispatcher.submit(lambda i=i: ran.append(i))
+        release.set()
+
+        self.assertTrue(dispatcher.drain(timeout=5))
+        self.assertEqual(ran, [1, 2])
+        self.assertEqual(dispatcher.stats()["dropped"], 1)
+
+    def test_block_drops_new_event_after_timeout(self):
+        dispatcher = EventDispatcher(workers=1, maxsize=1, overflow=BLOCK, block_timeout=0.05)
+        release = threading.Event()
+
+        dispatcher.submit(release.wait)
+        while dispatcher.stats()["in_flight"] == 0:
+            time.sleep(0.001)
+        self.assertTrue(dispatcher.submit(lambda: None))
+        self.assertFalse(dispatcher.submit(lambda: None))
+        release.set()
+
+        self.assertTrue(dispatcher.drain(timeout=5))
+        self.assertEqual(dispatcher.stats()["dropped"], 1)
+
+    def test_keyed_task_does_not_hold_up_the_others(self):
+        dispatcher = EventDispatcher(workers=1, coalesce_window=5)
+        ran = threading.Event()
+
+        dispatcher.submit(lambda: None, key="slow")
+        dispatcher.submit(ran.set)
+
+        self.assertTrue(ran.wait(timeout=1))
+        self.assertEqual(dispatcher.stats()["queue_depth"], 1)
+
+    def test_block_coalesces_a_key_queued_while_waiting(self):
+        dispatcher = EventDispatcher(workers=1, maxsize=2, overflow=BLOCK, coalesce_window=0.01, block_timeout=5)
+        release = threading.Event()
+        ran = []
+
+        dispatcher.submit(release.wait)
+        while dispatcher.stats()["in_flight"] == 0:
+            time.sleep(0.001)
+        dispatcher.submit(lambda: None)
+        dispatcher.submit(lambda: None)
+        submitters = [
+            threading.Thread(target=dispatcher.submit, args=(lambda: ran.append("update"),), kwargs={"key": "k"})
+            for _ in range(2)
+        ]
+        for thread in submitters:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in submitters:
+            thread.join()
+
+        self.assertTrue(dispatcher.drain(timeout=5))
+        self.assertEqual(ran, ["update"])
+
+    def test_dropped_tasks_call_on_drop(self):
+        for overflow in (DROP_OLDEST, BLOCK):
+            dispatcher = EventDispatcher(workers=1, maxsize=1, overflow=overflow, block_timeout=0.01)
+            release = threading.Event()
+            dropped = []
+
+            dispatcher.submit(release.wait)
+            while dispatcher.stats()["in_flight"] == 0:
+                time.sleep(0.001)
+            dispatcher.submit(lambda: None, on_drop=lambda: dropped.append("first"))
+            dispatcher.submit(lambda: None, on_drop=lambda: dropped.append("second"))
+            release.set()
+
+            self.assertTrue(dispatcher.drain(timeout=5))
+            self.assertEqual(dropped, ["first" if overflow == DROP_OLDEST else "second"])
+
+
+class AdmissionControlTest(TestCase):
+
+    def test_token_bucket_refills_at_rate(self):
+        buckets = TokenBuckets(rate=2, burst=2)
+
+        self.assertEqual(buckets.take("a", now=0), 0)
+        self.assertEqual(buckets.take("a", now=0), 0)
+        self.assertAlmostEqual(buckets.take("a", now=0), 0.5)
+        # Other keys have their own bucket
+        self.assertEqual(buckets.take("b", now=0), 0)
+        self.assertEqual(buckets.take("a", now=0.5), 0)
+
+    def test_write_latency_over_target_sheds_writes_not_reads(self):
+        controller = AdmissionController(write_latency_target=0.05)
+        release = threading.Event()
+
+        def slow_write():
+            with controller.admit(True, "alice"):
+                release.wait()
+
+        thread = threading.Thread(target=slow_write)
+        thread.start()
+        time.sleep(0.1)
+        try:
+            with self.assertRaises(Rejected) as ctx:
+                with controller.admit(True, "bob"):
+                    pass
+            self.assertEqual((ctx.exception.status, ctx.exception.retry_after), (503, 1))
+            with controller.admit(False):
+                pass
+        finally:
+            release.set()
+            thread.join()
+
+        # Once it finishes, one slow write only nudges the average
+        self.assertGreater(controller.write_latency(), 0)
+        with controller.admit(True, "bob"):
+            pass
+
+    def test_concurrency_limit(self):
+        controller = AdmissionController(max_reads=1)
+
+        with controller.admit(False):
+            with self.assertRaises(Rejected) as ctx:
+                with controller.admit(False):
+                    pass
+        self.assertEqual(ctx.exception.status, 503)
+        with controller.admit(False):
+            pass
+
+    @override_settings(ADMISSION_USER_WRITE_RATE=0.1, ADMISSION_USER_WRITE_BURST=2)
+    @mock.patch("feed.socket_events.emit_sync")
+    def test_user_rate_limit_returns_429(self, emit_sync):
+        alice = User.objects.create_user(username="alice")
+        bob = User.objects.create_user(username="bob")
+        post = Post.objects.create(author=alice, content="Hello")
+
+        statuses = [
+            self.client.post(f"/api/like/post/{post.id}/", HTTP_AUTHORIZATION=f"Bearer {issue_token(alice)}").status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [200, 400, 429])
+
+        response = self.client.post(f"/api/unlike/post/{post.id}/", HTTP_AUTHORIZATION=f"Bearer {issue_token(alice)}")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "10")
+
+        # Bob has his own bucket, and reads aren't rate limited
+        response = self.client.post(f"/api/like/post/{post.id}/", HTTP_AUTHORIZATION=f"Bearer {issue_token(bob)}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/api/feed/").status_code, 200)
+
+
+@override_settings(MOCK_AUTH_ENABLED=True)
+@mock.patch("feed.socket_events.emit_sync", side_effect=lambda func, key=None: func())
+@mock.patch("feed.socket_events.emit_event")
+class SocketEventTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice")
+        self.post = Post.objects.create(author=self.alice, content="Hello")
+        self.comment = Comment.objects.create(post=self.post, author=self.alice, content="Hi")
+
+    def test_comment_added_is_a_single_node(self, emit_event, emit_sync):
+        self.client.post(
+            f"/api/comment/{self.post.id}/?user_id={self.alice.id}",
+            {"content": "reply", "parent": self.comment.id},
+            content_type="application/json",
+        )
+
+        event_name, payload = emit_event.call_args.args
+        self.assertEqual(event_name, "comment_added")
+        self.assertEqual(payload["post_id"], self.post.id)
+        self.assertEqual(payload["parent_id"], self.comment.id)
+        self.assertEqual(payload["comment"]["content"], "reply")
+        self.assertEqual(payload["comment"]["children"], [])
+
+    def test_like_count_carries_id_and_count(self, emit_event, emit_sync):
+        self.client.post(f"/api/like/comment/{self.comment.id}/?user_id={self.alice.id}")
+
+        emit_event.assert_called_once_with("like_count", {
+            "post_id": self.post.id,
+            "comment_id": self.comment.id,
+            "like_count": 1,
+        })
+
+    def test_post_deleted_carries_only_the_id(self, emit_event, emit_sync):
+        self.client.delete(f"/api/post/{self.post.id}/?user_id={self.alice.id}")
+
+        emit_event.assert_called_once_with("post_deleted", {"post_id": self.post.id})
+
+
+@mock.patch("feed.socket_events.emit_sync", side_effect=lambda func, key=None: func())
+@mock.patch("feed.socket_events.emit_event")
+class BatchTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {issue_token(self.alice)}"}
+        self.post = Post.objects.create(author=self.bob, content="Hello")
+        self.comment = Comment.objects.create(post=self.post, author=self.bob, content="Hi")
+        self.mine = Comment.objects.create(post=self.post, author=self.alice, content="Mine")
+
+    def batch(self, *operations):
+        response = self.client.post(
+            "/api/batch/", {"operations": list(operations)}, content_type="application/json", **self.auth
+        )
+        self.assertEqual(response.status_code, 200)
+        return [(r["status"], r["data"]) for r in response.json()["results"]]
+
+    def test_results_match_single_endpoints(self, emit_event, emit_sync):
+        results = self.batch(
+            {"op": "like_post", "post_id": self.post.id},
+            {"op": "like_post", "post_id": self.post.id},
+            {"op": "like_comment", "comment_id": self.comment.id},
+            {"op": "unlike_comment", "comment_id": self.comment.id},
+            {"op": "unlike_comment", "comment_id": self.comment.id},
+            {"op": "add_comment", "post_id": self.post.id, "content": "reply", "parent": self.comment.id},
+            {"op": "delete_comment", "comment_id": self.comment.id},
+            {"op": "delete_comment", "comment_id": self.mine.id},
+            {"op": "like_post", "post_id": 999},
+            {"op": "add_comment", "post_id": self.post.id},
+            {"op": "unlike_post"},
+        )
+
+        reply = Comment.objects.get(content="reply")
+        self.assertEqual(results, [
+            (200, {"status": "liked"}),
+            (400, {"error": "already liked"}),
+            (200, {"ok": True}),
+            (200, {"ok": True}),
+            (404, {"error": "like not found"}),
+            (200, {"status": "comment added", "comment": {
+                "id": reply.id, "author": "alice", "content": "reply", "children": [],
+            }}),
+            (403, {"error": "not authorized"}),
+            (200, {"status": "deleted", "post_id": self.post.id}),
+            (404, {"error": "post not found"}),
+            (400, {"error": "content required"}),
+            (400, {"error": "post_id required"}),
+        ])
+
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(self.comment.like_count, 0)
+        self.assertEqual(Like.objects.count(), 1)
+        self.assertFalse(Comment.objects.filter(id=self.mine.id).exists())
+        self.assertEqual(compute_leaderboard(), [{"username": "bob", "total": 5}])
+
+    def test_relike_keeps_existing_row(self, emit_event, emit_sync):
+        like = Like.objects.create(user=self.alice, post=self.post)
+        Post.objects.filter(id=self.post.id).update(like_count=1)
+
+        self.batch(
+            {"op": "unlike_post", "post_id": self.post.id},
+            {"op": "like_post", "post_id": self.post.id},
+        )
+
+        self.assertEqual(list(Like.objects.values_list("id", flat=True)), [like.id])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+    def test_writes_are_bulk_and_events_coalesced(self, emit_event, emit_sync):
+        posts = [Post.objects.create(author=self.bob, content=f"p{i}") for i in range(10)]
+        operations = [{"op": "like_post", "post_id": p.id} for p in posts]
+        operations += [{"op": "add_comment", "post_id": p.id, "content": "c"} for p in posts]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.batch(*operations)
+
+        # Independent of the number of operations
+        self.assertLessEqual(len(queries), 15)
+        self.assertEqual(emit_sync.call_count, 1)
+        events = [call.args[0] for call in emit_event.call_args_list]
+        self.assertEqual(events.count("comment_added"), 10)
+        self.assertEqual(events.count("like_count"), 10)
+
+    def test_rejects_malformed_batches(self, emit_event, emit_sync):
+        for body in ({}, {"operations": []}, {"operations": [{"op": "drop_table"}]}):
+            response = self.client.post("/api/batch/", body, content_type="application/json", **self.auth)
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.post("/api/batch/", {"operations": [{"op": "like_post", "post_id": 1}]},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+
+        with override_settings(BATCH_MAX_OPERATIONS=1):
+            response = self.client.post(
+                "/api/batch/", {"operations": [{"op": "unlike_post", "post_id": 1}] * 2},
+                content_type="application/json", **self.auth,
+            )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SOCKET_OUTBOX_ENABLED=True, SOCKET_OUTBOX_RELAY_THREAD=False)
+@mock.patch("feed.socket_events.emit_sync")
+@mock.patch("feed.socket_events.emit_batch")
+class OutboxTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.post = Post.objects.create(author=self.alice, content="Hello")
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {issue_token(self.bob)}"}
+        self.relay = OutboxRelay(batch_size=3)
+
+    def test_events_are_stored_with_their_write(self, emit_batch, emit_sync):
+        self.client.post(f"/api/like/post/{self.post.id}/", **self.auth)
+        self.client.post(f"/api/comment/{self.post.id}/", {"content": "hi"}, content_type="application/json", **self.auth)
+        # Already liked: rolled back along with the like
+        self.client.post(f"/api/like/post/{self.post.id}/", **self.auth)
+
+        self.assertEqual(list(OutboxEvent.objects.order_by("id").values_list("event", flat=True)),
+                         ["like_count", "comment_added"])
+        emit_sync.assert_not_called()
+        emit_batch.assert_not_called()
+
+    def test_relay_sends_batches_with_current_counts(self, emit_batch, emit_sync):
+        for _ in range(2):
+            self.client.post(f"/api/like/post/{self.post.id}/", **self.auth)
+            self.client.delete(f"/api/unlike/post/{self.post.id}/", **self.auth)
+        self.client.post(f"/api/like/post/{self.post.id}/", **self.auth)
+        self.client.post(f"/api/comment/{self.post.id}/", {"content": "hi"}, content_type="application/json", **self.auth)
+
+        self.assertEqual(self.relay.deliver_pending(), 6)
+
+        # Five like_count rows in two batches of 3, one event per batch and target
+        self.assertEqual(emit_batch.call_count, 2)
+        first, second = (call.args[0] for call in emit_batch.call_args_list)
+        like_count = ["like_count", {"post_id": self.post.id, "comment_id": None, "like_count": 1}]
+        self.assertEqual(first, [like_count])
+        self.assertEqual([name for name, _ in second], ["like_count", "comment_added"])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_undelivered_events_are_sent_again(self, emit_batch, emit_sync):
+        self.client.delete(f"/api/post/{self.post.id}/", HTTP_AUTHORIZATION=f"Bearer {issue_token(self.alice)}")
+        emit_batch.side_effect = ConnectionError
+
+        with self.assertRaises(ConnectionError):
+            self.relay.deliver_pending()
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+        emit_batch.side_effect = None
+        self.assertEqual(self.relay.deliver_pending(), 1)
+        emit_batch.assert_called_with([["post_deleted", {"post_id": self.post.id}]])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_relay_thread_starts_with_the_process(self, emit_batch, emit_sync):
+        with mock.patch("feed.outbox.get_outbox_relay") as get_relay:
+            start_outbox_relay()
+            get_relay.assert_not_called()
+            with override_settings(SOCKET_OUTBOX_RELAY_THREAD=True):
+                start_outbox_relay()
+        get_relay.return_value.wake.assert_called_once_with()
+
+
+@mock.patch("feed.socket_events.emit_sync")
+class LikeBufferTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.post = Post.objects.create(author=self.alice, content="Hello")
+        self.comment = Comment.objects.create(post=self.post, author=self.alice, content="Hi")
+        # Never flushes on its own during a test
+        self.buffer = LikeBuffer(flush_interval=3600, max_items=10_000)
+
+    def assertCountsMatchLikes(self):
+        for model in (Post, Comment):
+            drifted = model.objects.annotate(n=Count("like")).exclude(like_count=F("n"))
+            self.assertFalse(drifted.exists())
+
+    def karma(self, user):
+        return sum(KarmaBucket.objects.filter(user=user).values_list("points", flat=True))
+
+    def test_toggles_collapse_into_the_net_change(self, emit_sync):
+        for liked in (True, False, True):
+            self.buffer.record(self.bob.id, "post", self.post.id, liked)
+
+        self.assertEqual(self.buffer.stats()["coalesced"], 2)
+        self.assertTrue(self.buffer.flush())
+        self.assertEqual(Like.objects.filter(user=self.bob, post=self.post).count(), 1)
+
+        # Ends where it started: nothing to write
+        self.buffer.record(self.bob.id, "post", self.post.id, False)
+        self.buffer.record(self.bob.id, "post", self.post.id, True)
+        # savepoint, post, existing like, release
+        with self.assertNumQueries(4):
+            self.buffer.flush()
+
+        self.assertCountsMatchLikes()
+        self.assertEqual(self.karma(self.alice), 5)
+
+    def test_flush_writes_likes_and_unlikes_together(self, emit_sync):
+        Like.objects.create(user=self.bob, comment=self.comment)
+        Comment.objects.filter(id=self.comment.id).update(like_count=1)
+        KarmaBucket.objects.create(user=self.alice, bucket_start=bucket_start(timezone.now()), points=1)
+
+        self.buffer.record(self.bob.id, "comment", self.comment.id, False)
+        self.buffer.record(self.bob.id, "post", self.post.id, True)
+        self.buffer.record(self.alice.id, "post", self.post.id, True)
+        self.buffer.record(self.alice.id, "comment", self.comment.id, True)
+        self.buffer.record(self.alice.id, "post", 999, True)
+        self.buffer.flush()
+
+        self.assertEqual(
+            set(Like.objects.values_list("user__username", "post_id", "comment_id")),
+            {("bob", self.post.id, None), ("alice", self.post.id, None), ("alice", None, self.comment.id)},
+        )
+        self.assertCountsMatchLikes()
+        # 1 - 1 for bob's comment like, then 5 + 5 + 1
+        self.assertEqual(self.karma(self.alice), 11)
+        self.assertEqual(emit_sync.call_count, 1)
+
+    def test_failed_flush_keeps_its_items(self, emit_sync):
+        self.buffer.record(self.bob.id, "post", self.post.id, True)
+
+        with mock.patch("feed.like_buffer.write_likes", side_effect=IntegrityError):
+            self.assertFalse(self.buffer.flush())
+        self.buffer.record(self.alice.id, "post", self.post.id, True)
+        self.assertTrue(self.buffer.flush())
+
+        self.assertEqual(Post.objects.get(id=self.post.id).like_count, 2)
+
+    def test_failing_like_does_not_hold_up_the_others(self, emit_sync):
+        from .like_buffer import write_likes
+
+        poison = (self.alice.id, "comment", self.comment.id)
+
+        def write(items):
+            if poison in items:
+                raise IntegrityError
+            return write_likes(items)
+
+        self.buffer.record(*poison, True)
+        self.buffer.record(self.bob.id, "post", self.post.id, True)
+        self.buffer.record(self.bob.id, "comment", self.comment.id, True)
+        with mock.patch("feed.like_buffer.write_likes", side_effect=write):
+            self.assertFalse(self.buffer.flush())
+            self.assertEqual(Like.objects.count(), 2)
+            self.assertEqual(self.buffer.stats()["pending"], 1)
+
+            for _ in range(self.buffer.max_retries):
+                self.buffer.flush()
+        stats = self.buffer.stats()
+        self.assertEqual((stats["pending"], stats["dropped"], stats["written"]), (0, 1, 2))
+        self.assertCountsMatchLikes()
+
+    @override_settings(LIKE_WRITE_BEHIND=True)
+    def test_views_acknowledge_before_writing(self, emit_sync):
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {issue_token(self.bob)}"}
+
+        with mock.patch("feed.views.get_like_buffer", return_value=self.buffer):
+            response = self.client.post(f"/api/like/post/{self.post.id}/", **auth)
+            self.client.post(f"/api/like/comment/{self.comment.id}/", **auth)
+            self.client.delete(f"/api/unlike/comment/{self.comment.id}/", **auth)
+            anonymous = self.client.post(f"/api/like/post/{self.post.id}/")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {"status": "liked"})
+        self.assertEqual(anonymous.status_code, 401)
+        self.assertFalse(Like.objects.exists())
+
+        self.buffer.flush()
+        self.assertEqual(list(Like.objects.values_list("user", "post")), [(self.bob.id, self.post.id)])
+
+
+@mock.patch("feed.socket_events.emit_sync")
+class CommentTreeTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice")
+        self.post = Post.objects.create(author=self.alice, content="Hello")
+
+        def reply(content, parent=None):
+            return Comment.objects.create(post=self.post, author=self.alice, content=content, parent=parent)
+
+        self.a = reply("a")
+        self.a1, self.a2, self.a3 = reply("a1", self.a), reply("a2", self.a), reply("a3", self.a)
+        self.a1x = reply("a1x", self.a1)
+        reply("a1xx", self.a1x)
+        reply("a2x", self.a2)
+        self.b = reply("b")
+
+    def get(self, query=""):
+        response = self.client.get(f"/api/comments/{self.post.id}/{query}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def shape(self, nodes):
+        return [
+            (n["content"], n["child_count"], n["has_more"], self.shape(n["children"]))
+            for n in nodes
+        ]
+
+    def assertPathsConsistent(self):
+        for comment in Comment.objects.select_related("parent"):
+            expected = comment.parent.child_path() if comment.parent else ""
+            self.assertEqual(comment.path, expected, comment.content)
+
+    def test_paths_are_maintained_on_insert(self, emit_sync):
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {issue_token(self.alice)}"}
+        self.client.post(f"/api/comment/{self.post.id}/", {"content": "v", "parent": self.a1x.id},
+                         content_type="application/json", **auth)
+        self.client.post("/api/batch/", {"operations": [
+            {"op": "add_comment", "post_id": self.post.id, "content": "w", "parent": self.a3.id},
+        ]}, content_type="application/json", **auth)
+
+        self.assertPathsConsistent()
+        self.assertEqual(Comment.objects.get(content="v").depth, 3)
+
+    def test_depth_limited_tree(self, emit_sync):
+        # version, nodes, child counts
+        with self.assertNumQueries(3):
+            tree = self.get("?depth=2")
+
+        self.assertFalse(tree["has_more"])
+        self.assertEqual(self.shape(tree["comments"]), [
+            ("a", 3, False, [
+                ("a1", 1, True, []),
+                ("a2", 1, True, []),
+                ("a3", 0, False, []),
+            ]),
+            ("b", 0, False, []),
+        ])
+
+    def test_limit_is_filled_breadth_first(self, emit_sync):
+        tree = self.get("?depth=5&limit=4")
+
+        self.assertFalse(tree["has_more"])
+        self.assertEqual(self.shape(tree["comments"]), [
+            ("a", 3, True, [("a1", 1, True, []), ("a2", 1, True, [])]),
+            ("b", 0, False, []),
+        ])
+
+    def test_expand_and_page_through_replies(self, emit_sync):
+        tree = self.get(f"?root={self.a.id}&depth=1&limit=2")
+        self.assertTrue(tree["has_more"])
+        self.assertEqual([n["content"] for n in tree["comments"]], ["a1", "a2"])
+
+        # Later pages leave out the replies already shown and their subtrees
+        tree = self.get(f"?root={self.a.id}&depth=5&after={self.a1.id}")
+        self.assertFalse(tree["has_more"])
+        self.assertEqual(self.shape(tree["comments"]), [
+            ("a2", 1, False, [("a2x", 0, False, [])]),
+            ("a3", 0, False, []),
+        ])
+
+        tree = self.get(f"?root={self.a1x.id}")
+        self.assertEqual(self.shape(tree["comments"]), [("a1xx", 0, False, [])])
+
+    def test_bad_params(self, emit_sync):
+        other = Post.objects.create(author=self.alice, content="Other")
+
+        self.assertEqual(self.client.get(f"/api/comments/{other.id}/?root={self.a.id}").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/comments/{self.post.id}/?root=x").status_code, 400)
+        self.assertEqual(self.client.get(f"/api/comments/{self.post.id}/?after=-1").status_code, 400)
+        self.assertEqual(self.get("?depth=0&limit=x")["comments"][0]["children"], [])
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite syntax")
+@override_settings(LEADERBOARD_CACHE_TTL=0)
+@mock.patch("feed.socket_events.emit_sync")
+class QueryPlanTest(TestCase):
+    """
+    Every query the hot endpoints issue must be answered from an index. Walking
+    an index in order ("SCAN t USING INDEX i") is fine; scanning a table is not.
+    """
+
+    def setUp(self):
+        alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {issue_token(self.bob)}"}
+        self.posts = [Post.objects.create(author=alice, content=f"post {i}") for i in range(3)]
+        self.comment = Comment.objects.create(post=self.posts[0], author=alice, content="c")
+        Like.objects.create(user=alice, post=self.posts[1])
+        Like.objects.create(user=alice, comment=self.comment)
+
+    def plans(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+            response.getvalue()
+        self.assertLess(response.status_code, 400)
+
+        plans = {}
+        for query in queries:
+            if not query["sql"].startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plans[query["sql"]] = [row[-1] for row in cursor.fetchall()]
+        return plans
+
+    def assertIndexed(self, request, sorted_in_memory_ok=True):
+        for sql, plan in self.plans(request).items():
+            for step in plan:
+                if step.startswith("SCAN ") and " USING " not in step:
+                    self.fail(f"full table scan ({step}) in {sql}")
+                if not sorted_in_memory_ok and step == "USE TEMP B-TREE FOR ORDER BY":
+                    self.fail(f"ORDER BY not served by an index in {sql}")
+
+    def test_feed(self, emit_sync):
+        self.assertIndexed(lambda: self.client.get("/api/feed/?page_size=1"), sorted_in_memory_ok=False)
+
+        cursor = json.loads(self.client.get("/api/feed/?page_size=1").getvalue())["next"]
+        self.assertIndexed(
+            lambda: self.client.get(f"/api/feed/?page_size=1&cursor={cursor}"), sorted_in_memory_ok=False
+        )
+
+    def test_leaderboard_engines(self, emit_sync):
+        for engine in ENGINES:
+            with override_settings(LEADERBOARD_ENGINE=engine):
+                self.assertIndexed(lambda: self.client.get("/api/leaderboard/"))
+
+    def test_comment_tree(self, emit_sync):
+        post, comment = self.posts[0], self.comment
+        self.assertIndexed(lambda: self.client.get(f"/api/comments/{post.id}/"))
+        self.assertIndexed(lambda: self.client.get(f"/api/comments/{post.id}/?root={comment.id}&after=1"))
+
+    def test_like_lookups(self, emit_sync):
+        post, comment = self.posts[0], self.comment
+        requests = [
+            lambda: self.client.post(f"/api/like/post/{post.id}/", **self.auth),
+            lambda: self.client.delete(f"/api/unlike/post/{post.id}/", **self.auth),
+            lambda: self.client.post(f"/api/like/comment/{comment.id}/", **self.auth),
+            lambda: self.client.delete(f"/api/unlike/comment/{comment.id}/", **self.auth),
+            lambda: self.client.post(
+                "/api/batch/",
+                {"operations": [{"op": "like_post", "post_id": post.id},
+                                {"op": "like_comment", "comment_id": comment.id}]},
+                content_type="application/json", **self.auth,
+            ),
+        ]
+        for request in requests:
+            self.assertIndexed(request)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_STICKY_SECONDS=60)
+@mock.patch("feed.socket_events.emit_sync")
+class ReplicaRoutingTest(TestCase):
+    """The "replica" alias is a separate test database standing in for a lagging copy."""
+
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username="alice")
+        self.post = Post.objects.create(author=self.alice, content="on primary")
+
+        stale_author = User.objects.using("replica").create(id=self.alice.id, username="alice")
+        Post.objects.using("replica").create(author=stale_author, content="on replica")
+
+    def feed_contents(self, **headers):
+        data = json.loads(self.client.get("/api/feed/", **headers).getvalue())
+        return [post["content"] for post in data["results"]]
+
+    def test_feed_and_leaderboard_read_from_replica(self, emit_sync):
+        Like.objects.create(user=self.alice, post=self.post)
+        with override_settings(LEADERBOARD_CACHE_TTL=0, LEADERBOARD_ENGINE="likes"):
+            self.assertEqual(self.client.get("/api/leaderboard/").json(), [])
+
+        self.assertEqual(self.feed_contents(), ["on replica"])
+
+    def test_writer_reads_own_writes_from_primary(self, emit_sync):
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {issue_token(self.alice)}"}
+
+        self.assertEqual(self.feed_contents(**auth), ["on replica"])
+
+        response = self.client.post(f"/api/like/post/{self.post.id}/", **auth)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(Like.objects.using("default").count(), 1)
+        self.assertEqual(Like.objects.using("replica").count(), 0)
+        self.assertEqual(self.feed_contents(**auth), ["on primary"])
+        # Everyone else still reads the replica
+        self.assertEqual(self.feed_contents(), ["on replica"])
+
+    def test_failed_write_does_not_pin(self, emit_sync):
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {issue_token(self.alice)}"}
+
+        self.client.post("/api/like/post/999/", **auth)
+
+        self.assertEqual(self.feed_contents(**auth), ["on replica"])
+
+    def test_no_replicas_reads_primary(self, emit_sync):
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.feed_contents(), ["on primary"])
+
+
+class CombinedAsgiTest(TestCase):
+    """myproject/asgi_combined.py: Django and Socket.IO in one ASGI app"""
+
+    def setUp(self):
+        from myproject import asgi_combined
+        from . import socket_events
+
+        self.app = asgi_combined
+        transport = socket_events.emit_event
+        self.addCleanup(setattr, socket_events, "emit_event", transport)
+        self.addCleanup(setattr, socket_events, "emit_batch", socket_events.emit_batch)
+        self.addCleanup(setattr, asgi_combined, "_loop", None)
+
+        # Like the test client: keep the test transaction's connection open
+        request_started.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+
+        alice = User.objects.create_user(username="alice")
+        Post.objects.create(author=alice, content="Hello")
+
+    async def get(self, path):
+        scope = {
+            "type": "http", "method": "GET", "path": path, "raw_path": path.encode(),
+            "query_string": b"", "headers": [], "root_path": "", "scheme": "http",
+            "server": ("testserver", 80), "client": ("127.0.0.1", 1234), "http_version": "1.1",
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.app.application(scope, receive, send)
+        body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+        return messages[0]["status"], body
+
+    async def test_serves_the_async_api_views(self):
+        status, body = await self.get("/api/feed/")
+        self.assertEqual(status, 200)
+        self.assertEqual([p["content"] for p in json.loads(body)["results"]], ["Hello"])
+
+        status, body = await self.get("/api/leaderboard/")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), [])
+
+    async def test_first_request_starts_the_outbox_relay(self):
+        with mock.patch.object(self.app, "start_outbox_relay") as start:
+            await self.get("/api/feed/")
+            await self.get("/api/feed/")
+        start.assert_called_once_with()
+
+    async def test_events_are_emitted_on_the_local_server(self):
+        from . import socket_events
+
+        await self.get("/api/feed/")
+
+        with mock.patch.object(self.app.socketio_server.sio, "emit") as emit:
+            socket_events.broadcast("post_deleted", {"post_id": 1})
+            await asyncio.sleep(0.01)
+
+        emit.assert_awaited_once_with("post_deleted", {"post_id": 1}, room="clients")
+
+
+class SocketRoomTest(SimpleTestCase):
+    """socketio_server.py: post rooms and the subscribe/unsubscribe events"""
+
+    def setUp(self):
+        import socketio
+        # Imported the way the combined app does, so sio is in ASGI mode
+        from myproject.asgi_combined import socketio_server
+
+        self.server = socketio_server
+        self.manager = socketio_server.ClientManager()
+        self.sio = socketio.AsyncServer(async_mode="asgi", client_manager=self.manager)
+        patcher = mock.patch.object(socketio_server, "sio", self.sio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.sent = {}
+
+        async def send_eio_packet(eio_sid, pkt):
+            event, data = json.loads(pkt.data[1:])
+            data.pop("seq", None)
+            self.sent[eio_sid].append([event, data])
+
+        self.sio._send_eio_packet = send_eio_packet
+
+    async def connect(self, eio_sid):
+        sid = await self.manager.connect(eio_sid, "/")
+        self.sio.eio.sockets[eio_sid] = mock.Mock(queue=asyncio.Queue())
+        await self.sio.enter_room(sid, self.server.CLIENTS_ROOM)
+        self.sent[eio_sid] = []
+        return sid
+
+    async def test_post_events_only_reach_subscribers(self):
+        a = await self.connect("a")
+        b = await self.connect("b")
+        self.assertEqual(await self.server.subscribe(a, {"post_ids": [1, "2", "x"]}), {"status": "ok"})
+        await self.server.subscribe(b, {"post_ids": [2]})
+        self.assertEqual(await self.server.unsubscribe(a, {"post_ids": [2]}), {"status": "ok"})
+
+        like_count = {"post_id": 2, "comment_id": None, "like_count": 3}
+        await self.server.broadcast_event("like_count", like_count)
+        await self.server.broadcast_event("comment_deleted", {"post_id": 1, "comment_id": 4})
+        await self.server.broadcast_event("post_deleted", {"post_id": 5})
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(self.sent["a"], [
+            ["comment_deleted", {"post_id": 1, "comment_id": 4}], ["post_deleted", {"post_id": 5}],
+        ])
+        self.assertEqual(self.sent["b"], [["like_count", like_count], ["post_deleted", {"post_id": 5}]])
+
+    async def test_subscriptions_are_capped(self):
+        sid = await self.connect("a")
+        limit = self.server.MAX_SUBSCRIPTIONS
+
+        self.assertEqual(await self.server.subscribe(sid, {"post_ids": list(range(limit))}), {"status": "ok"})
+        # Rooms it already holds don't count again
+        self.assertEqual(await self.server.subscribe(sid, {"post_ids": [0, 1]}), {"status": "ok"})
+        self.assertEqual(
+            await self.server.subscribe(sid, {"post_ids": [limit]}),
+            {"status": "error", "error": "too many subscriptions"},
+        )
+        rooms = [room for room in self.sio.rooms(sid) if room.startswith("post:")]
+        self.assertEqual(len(rooms), limit)
+        self.assertNotIn(self.server.post_room(limit), rooms)
+
+
+class SocketBusTest(SimpleTestCase):
+    """socketio_bus.py: the broker and UnixSocketManager between server processes"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "bus.sock")
+        self.sent = {}
+        self.tasks = []
+        self.managers = []
+
+    async def stop(self):
+        """Disconnect from the broker first, so its handlers end before it does"""
+        for manager in self.managers:
+            manager.thread.cancel()
+            if manager._writer is not None:
+                manager._writer.close()
+        await asyncio.sleep(0.01)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, *(m.thread for m in self.managers), return_exceptions=True)
+
+    async def start_broker(self):
+        from socketio_bus import serve_broker
+
+        self.tasks.append(asyncio.create_task(serve_broker(self.path)))
+        while not os.path.exists(self.path):
+            await asyncio.sleep(0.001)
+
+    async def server(self, logger=None):
+        """A server process's sio, listening on the bus"""
+        import socketio
+        from socketio_bus import UnixSocketManager
+
+        manager = UnixSocketManager(self.path, logger=logger)
+        sio = socketio.AsyncServer(async_mode="asgi", client_manager=manager)
+
+        async def send_eio_packet(eio_sid, pkt):
+            self.sent[eio_sid].append(json.loads(pkt.data[1:]))
+
+        sio._send_eio_packet = send_eio_packet
+        manager.initialize()
+        sio.manager_initialized = True
+        self.managers.append(manager)
+        return sio
+
+    async def connect(self, sio, eio_sid, room):
+        sid = await sio.manager.connect(eio_sid, "/")
+        sio.eio.sockets[eio_sid] = mock.Mock(queue=asyncio.Queue())
+        await sio.enter_room(sid, room)
+        self.sent[eio_sid] = []
+
+    async def wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            await asyncio.sleep(0.002)
+        self.fail("timed out")
+
+    async def test_broadcasts_reach_clients_of_every_process(self):
+        try:
+            await self.start_broker()
+            one, two = await self.server(), await self.server()
+            await self.connect(one, "one", "post:1")
+            await self.connect(two, "two", "post:1")
+            await self.connect(two, "elsewhere", "post:2")
+            await self.wait_for(lambda: two.manager._writer is not None)
+
+            await one.emit("like_count", {"post_id": 1, "like_count": 3}, room="post:1")
+            await self.wait_for(lambda: self.sent["two"])
+        finally:
+            await self.stop()
+
+        event = ["like_count", {"post_id": 1, "like_count": 3}]
+        self.assertEqual(self.sent, {"one": [event], "two": [event], "elsewhere": []})
+
+    async def test_unreachable_broker_still_serves_local_clients(self):
+        logger = mock.Mock()
+        try:
+            one = await self.server(logger=logger)
+            await self.connect(one, "one", "clients")
+            await one.emit("post_deleted", {"post_id": 1}, room="clients")
+
+            self.assertEqual(self.sent["one"], [["post_deleted", {"post_id": 1}]])
+            logger.error.assert_any_call("Cannot publish to bus at %s", self.path)
+
+            # Publishing reconnects once the broker is back
+            await self.start_broker()
+            two = await self.server()
+            await self.connect(two, "two", "clients")
+            await self.wait_for(lambda: two.manager._writer is not None)
+            await one.emit("post_deleted", {"post_id": 2}, room="clients")
+            await self.wait_for(lambda: self.sent["two"])
+        finally:
+            await self.stop()
+
+        self.assertEqual(self.sent["two"], [["post_deleted", {"post_id": 2}]])
+
+
+class SocketOutboxTest(SimpleTestCase):
+    """socketio_outbox.py: bounded, coalescing per-client queues"""
+
+    def setUp(self):
+        import socketio
+        from socketio_outbox import OutboxManager
+
+        class Manager(OutboxManager):
+            max_queue = 3
+            slow_client_grace = 0
+            poll_interval = 0.001
+
+            def coalesce_key(self, event, data):
+                return ("like_count", data["post_id"]) if event == "like_count" else None
+
+        self.manager = Manager()
+        self.sio = socketio.AsyncServer(async_mode="asgi", client_manager=self.manager)
+        self.sent = {}
+
+        async def send_eio_packet(eio_sid, pkt):
+            self.sent[eio_sid].append(json.loads(pkt.data[1:]))
+
+        self.sio._send_eio_packet = send_eio_packet
+
+    async def connect(self, eio_sid, backlog=0):
+        """A client whose Engine.IO queue already holds ``backlog`` packets"""
+        sid = await self.manager.connect(eio_sid, "/")
+        queue = asyncio.Queue()
+        for _ in range(backlog):
+            queue.put_nowait(None)
+        self.sio.eio.sockets[eio_sid] = mock.Mock(queue=queue)
+        self.sent[eio_sid] = []
+        return sid
+
+    async def test_slow_client_does_not_hold_up_others(self):
+        await self.connect("fast")
+        slow = await self.connect("slow", backlog=self.manager.transport_watermark)
+
+        for likes in range(5):
+            await self.sio.emit("like_count", {"post_id": 1, "like_count": likes})
+            await asyncio.sleep(0.005)
+        await self.sio.emit("post_deleted", {"post_id": 2})
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(len(self.sent["fast"]), 6)
+        self.assertEqual(self.sent["slow"], [])
+        stats = self.manager.stats()[slow]
+        self.assertEqual((stats["queued"], stats["coalesced"]), (2, 4))
+
+        # Once it catches up, it gets the latest count only
+        self.sio.eio.sockets["slow"].queue = asyncio.Queue()
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.sent["slow"], [
+            ["like_count", {"post_id": 1, "like_count": 4}], ["post_deleted", {"post_id": 2}],
+        ])
+
+    async def test_client_that_stays_behind_is_disconnected(self):
+        slow = await self.connect("slow", backlog=self.manager.transport_watermark)
+
+        with mock.patch.object(self.sio, "disconnect") as disconnect:
+            for post_id in range(5):
+                await self.sio.emit("post_deleted", {"post_id": post_id})
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(self.manager.stats()[slow]["dropped"], 2)
+        disconnect.assert_awaited_once_with(slow, namespace="/")
+
+
+class SocketReplayTest(SimpleTestCase):
+    """socketio_server.py: sequence numbers and the resume event"""
+
+    def setUp(self):
+        import socketio
+        # Imported the way the combined app does, so sio is in ASGI mode
+        from myproject.asgi_combined import socketio_server
+
+        class Manager(socketio_server.ClientManager):
+            replay_buffer_size = 3
+
+        self.server = socketio_server
+        self.manager = Manager()
+        self.sio = socketio.AsyncServer(async_mode="asgi", client_manager=self.manager)
+        patcher = mock.patch.object(socketio_server, "sio", self.sio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.sent = []
+
+        async def send_eio_packet(eio_sid, pkt):
+            self.sent.append(json.loads(pkt.data[1:]))
+
+        self.sio._send_eio_packet = send_eio_packet
+
+    async def connect(self, *post_ids, eio_sid="eio", backlog=0):
+        sid = await self.manager.connect(eio_sid, "/")
+        queue = asyncio.Queue()
+        for _ in range(backlog):
+            queue.put_nowait(None)
+        self.sio.eio.sockets[eio_sid] = mock.Mock(queue=queue)
+        await self.sio.enter_room(sid, self.server.CLIENTS_ROOM)
+        for post_id in post_ids:
+            await self.sio.enter_room(sid, self.server.post_room(post_id))
+        return sid
+
+    async def test_resume_replays_missed_events_of_the_clients_rooms(self):
+        await self.server.broadcast_event("post_deleted", {"post_id": 9})
+        await self.server.broadcast_event("like_count", {"post_id": 1, "comment_id": None, "like_count": 2})
+        await self.server.broadcast_event("like_count", {"post_id": 2, "comment_id": None, "like_count": 5})
+
+        sid = await self.connect(1)
+        ack = await self.server.resume(sid, {"epoch": self.manager.epoch, "seq": 0, "sid": "old"})
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(ack, {"status": "ok", "replayed": 2, "epoch": self.manager.epoch, "seq": 3})
+        self.assertEqual(self.sent, [
+            ["post_deleted", {"post_id": 9, "seq": 1}],
+            ["like_count", {"post_id": 1, "comment_id": None, "like_count": 2, "seq": 2}],
+        ])
+
+    async def test_resync_when_events_fell_out_of_the_buffer(self):
+        for post_id in range(5):
+            await self.server.broadcast_event("post_deleted", {"post_id": post_id})
+        sid = await self.connect()
+
+        # The buffer holds seq 3..5
+        resume = {"epoch": self.manager.epoch, "seq": 2, "sid": "old"}
+        self.assertEqual((await self.server.resume(sid, resume))["status"], "ok")
+        for data in ({**resume, "seq": 1}, {**resume, "epoch": "restarted"}, {**resume, "sid": None}, None):
+            self.assertEqual((await self.server.resume(sid, data))["status"], "resync")
+
+    async def test_resync_when_the_old_connection_lost_or_reordered_events(self):
+        self.manager.max_queue = 2
+        dropping = await self.connect(eio_sid="dropping", backlog=self.manager.transport_watermark)
+        for post_id in range(3):
+            await self.server.broadcast_event("post_deleted", {"post_id": post_id})
+        reordering = await self.connect(1, eio_sid="reordering", backlog=self.manager.transport_watermark)
+        for likes in range(2):
+            await self.server.broadcast_event("like_count", {"post_id": 1, "comment_id": None, "like_count": likes})
+            await self.server.broadcast_event("post_deleted", {"post_id": 9})
+
+        sid = await self.connect()
+        resume = {"epoch": self.manager.epoch, "seq": self.manager.seq - 1}
+        for old in (dropping, reordering):
+            self.assertEqual((await self.server.resume(sid, {**resume, "sid": old}))["status"], "resync")
+        self.assertEqual((await self.server.resume(sid, {**resume, "sid": "in-order"}))["status"], "ok")
+
+
+class SocketIngestTest(SimpleTestCase):
+    """socketio_server.py: the /ingest/ endpoint and its queue consumer"""
+
+    def setUp(self):
+        from myproject.asgi_combined import socketio_server
+
+        self.server = socketio_server
+        self.broadcasts = []
+
+        async def broadcast_event(event_name, event_data):
+            self.broadcasts.append([event_name, event_data])
+
+        for name, value in (
+            ("ingest_queue", asyncio.Queue(maxsize=3)),
+            ("broadcast_event", broadcast_event),
+            ("RELAY_TOKEN", "relay-token"),
+        ):
+            patcher = mock.patch.object(socketio_server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def serve(self):
+        """An HTTP server with just the ingest route, closed when the test ends"""
+        from aiohttp import web
+        from aiohttp.test_utils import TestClient, TestServer
+
+        app = web.Application()
+        app.router.add_post("/ingest/", self.server.ingest)
+        self.http = TestClient(TestServer(app))
+        await self.http.start_server()
+
+    async def post(self, events, token="relay-token"):
+        return await self.http.post(
+            "/ingest/", json={"events": events}, headers={"Authorization": f"Bearer {token}"}
+        )
+
+    async def test_batches_are_broadcast_with_superseded_like_counts_dropped(self):
+        import socketio_client
+
+        await self.serve()
+        self.assertEqual((await self.post([], token="wrong")).status, 401)
+
+        consumer = asyncio.create_task(self.server.consume_ingest())
+        events = [
+            ["like_count", {"post_id": 1, "comment_id": None, "like_count": 1}],
+            ["post_deleted", {"post_id": 2}],
+            ["like_count", {"post_id": 1, "comment_id": None, "like_count": 2}],
+        ]
+        reached = mock.Mock()
+        loop = asyncio.get_running_loop()
+        with mock.patch.multiple(socketio_client, server_url=f"http://127.0.0.1:{self.http.port}",
+                                 relay_token="relay-token", is_connected=False, connect_callbacks=[reached]):
+            ack = await loop.run_in_executor(None, socketio_client.emit_batch, events)
+            # Answered only once broadcast
+            self.assertEqual(self.broadcasts, events[1:])
+            await loop.run_in_executor(None, socketio_client.emit_event, "post_deleted", {"post_id": 3})
+        consumer.cancel()
+        await self.http.close()
+
+        self.assertEqual(ack, {"status": "ok", "broadcast": 3})
+        self.assertEqual(self.broadcasts[-1], ["post_deleted", {"post_id": 3}])
+        reached.assert_called_once_with()
+
+    async def test_nothing_is_relayed_without_a_token(self):
+        await self.serve()
+        with mock.patch.object(self.server, "RELAY_TOKEN", ""):
+            self.assertEqual((await self.post([], token="")).status, 401)
+            with mock.patch.object(self.server.sio, "enter_room"), mock.patch.object(self.server.sio, "emit"):
+                await self.server.connect("sid", {}, {"token": ""})
+        await self.http.close()
+        self.assertNotIn("sid", self.server.publishers)
+        self.server.connected_clients.pop("sid", None)
+
+    async def test_batch_that_does_not_fit_is_rejected_whole(self):
+        await self.serve()
+        response = await self.post([["post_deleted", {"post_id": i}] for i in range(4)])
+        self.assertEqual((response.status, response.headers["Retry-After"]), (503, "1"))
+        self.assertTrue(self.server.ingest_queue.empty())
+
+        fits = asyncio.create_task(self.post([["post_deleted", {"post_id": 1}]] * 3))
+        while not self.server.ingest_queue.full():
+            await asyncio.sleep(0.001)
+        self.assertEqual((await self.post([["post_deleted", {"post_id": 2}]])).status, 503)
+
+        consumer = asyncio.create_task(self.server.consume_ingest())
+        self.assertEqual((await fits).status, 200)
+        self.assertEqual(len(self.broadcasts), 3)
+        consumer.cancel()
+        await self.http.close()
+
+
+class TokenAuthTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="pw")
+        self.post = Post.objects.create(author=self.alice, content="Hello")
+
+    def user_queries(self, queries):
+        return [q for q in queries if "auth_user" in q["sql"]]
+
+    def test_login_issues_a_working_token(self):
+        token = self.client.post(
+            "/api/login/", {"username": "alice", "password": "pw"}, content_type="application/json"
+        ).json()["token"]
+        load_user.cache_clear()
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                f"/api/like/post/{self.post.id}/", HTTP_AUTHORIZATION=f"Bearer {token}"
+            )
+            self.client.delete(f"/api/unlike/post/{self.post.id}/", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Like.objects.exists())
+        # The user's row, then the cached copy
+        self.assertEqual(len(self.user_queries(ctx.captured_queries)), 1)
+
+    def test_token_of_deactivated_or_deleted_user_is_rejected(self):
+        token = issue_token(self.alice)
+        self.assertEqual(
+            self.client.post(f"/api/like/post/{self.post.id}/", HTTP_AUTHORIZATION=f"Bearer {token}").status_code, 200
+        )
+
+        self.alice.is_active = False
+        self.alice.save()
+        self.assertEqual(
+            self.client.delete(f"/api/unlike/post/{self.post.id}/", HTTP_AUTHORIZATION=f"Bearer {token}").status_code, 401
+        )
+
+        self.alice.delete()
+        self.assertEqual(
+            self.client.post(f"/api/like/post/{self.post.id}/", HTTP_AUTHORIZATION=f"Bearer {token}").status_code, 401
+        )
+
+    def test_tampered_token_is_rejected(self):
+        token = issue_token(self.alice)[:-1] + "x"
+
+        response = self.client.post(
+            f"/api/like/post/{self.post.id}/", HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(AUTH_TOKEN_MAX_AGE=-1)
+    def test_expired_token_is_rejected(self):
+        response = self.client.post(
+            f"/api/like/post/{self.post.id}/",
+            HTTP_AUTHORIZATION=f"Bearer {issue_token(self.alice)}",
+        )
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_user_id_is_ignored_unless_mock_auth_is_enabled(self):
+        response = self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.alice.id}")
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(Like.objects.exists())
+
+    @override_settings(MOCK_AUTH_ENABLED=True)
+    def test_mock_user_id_is_looked_up_once(self):
+        load_user.cache_clear()
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(f"/api/like/post/{self.post.id}/?user_id={self.alice.id}")
+
+        self.assertEqual(len(self.user_queries(ctx.captured_queries)), 1)
+
+
+class MetricsTest(TestCase):
+
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = Registry()
+        latency = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+        latency.observe(0.05, route="a")
+        latency.observe(0.5, route="a")
+
+        lines = registry.render().splitlines()
+
+        self.assertIn('latency_seconds_bucket{route="a",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{route="a",le="1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{route="a",le="+Inf"} 2', lines)
+        self.assertIn('latency_seconds_count{route="a"} 2', lines)
+
+    def test_requests_are_recorded_per_route(self):
+        self.client.get("/api/feed/")
+
+        body = self.client.get("/metrics/").content.decode()
+
+        self.assertIn('http_request_duration_seconds_count{route="api/feed/",method="GET"}', body)
+        self.assertIn('db_queries_per_request_count{route="api/feed/"}', body)
+        self.assertIn('http_requests_total{route="api/feed/",method="GET",status="200"}', body)
+
+    def test_streamed_response_size_is_recorded(self):
+        alice = User.objects.create_user(username="alice")
+        Post.objects.create(author=alice, content="Hello")
+
+        def sent_bytes():
+            prefix = 'http_response_size_bytes_sum{route="api/feed/"} '
+            lines = self.client.get("/metrics/").content.decode().splitlines()
+            return next((float(line[len(prefix):]) for line in lines if line.startswith(prefix)), 0)
+
+        before = sent_bytes()
+        response = self.client.get("/api/feed/")
+        self.assertTrue(response.streaming)
+        size = len(b"".join(response.streaming_content))
+
+        self.assertEqual(sent_bytes() - before, size)
+
+
+@override_settings(LEADERBOARD_CACHE_TTL=0)
+@mock.patch("feed.socket_events.emit_sync")
+class QueryBudgetTest(TestCase):
+    """
+    Query counts for the hot paths. Inside TestCase every atomic block adds a
+    SAVEPOINT/RELEASE pair, which is counted here.
+    """
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice")
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {issue_token(self.alice)}"}
+        self.post = self.make_posts(3)[0]
+        # Token auth's user lookup is cached per process, so not per request
+        load_user(self.alice.id)
+
+    def make_posts(self, count):
+        posts = []
+        for i in range(count):
+            post = Post.objects.create(author=self.alice, content=f"post {i}")
+            Comment.objects.create(post=post, author=self.alice, content="c")
+            posts.append(post)
+        return posts
+
+    def test_feed_queries_do_not_grow_with_posts(self, emit_sync):
+        # version, posts, comments
+        with self.assertNumQueries(3):
+            self.client.get("/api/feed/")
+
+        self.make_posts(10)
+
+        with self.assertNumQueries(3):
+            self.client.get("/api/feed/")
+
+    def test_leaderboard(self, emit_sync):
+        # version, aggregate
+        with self.assertNumQueries(2):
+            self.client.get("/api/leaderboard/")
+
+    def test_add_comment(self, emit_sync):
+        # insert, version
+        with self.assertNumQueries(2):
+            self.client.post(
+                f"/api/comment/{self.post.id}/", {"content": "hi"},
+                content_type="application/json", **self.auth,
+            )
+
+    def test_like_and_unlike_post(self, emit_sync):
+        # savepoint, author lookup, insert, counter, bucket update + create, version
+        with self.assertNumQueries(10):
+            self.client.post(f"/api/like/post/{self.post.id}/", **self.auth)
+
+        # savepoint, like lookup, delete, counter, bucket, version
+        with self.assertNumQueries(7):
+            self.client.delete(f"/api/unlike/post/{self.post.id}/", **self.auth)
+
+
+class SeedDatasetTest(TestCase):
+
+    def seed(self, **kwargs):
+        options = dict(users=10, posts=20, comments=130, likes=300, depth=3, branching=3,
+                       until=timezone.now())
+        options.update(kwargs)
+        return seed_dataset(**options)
+
+    def test_levels_fill_trees_breadth_first(self):
+        self.assertEqual(comment_levels(130, 3, 3), [10, 30, 90])
+        self.assertEqual(comment_levels(5, 1, 3), [5])
+        self.assertEqual(comment_levels(0, 3, 3), [])
+
+    def test_counters_and_trees_are_consistent(self):
+        counts = self.seed()
+
+        self.assertEqual(counts["likes"], Like.objects.count())
+        for model in (Post, Comment):
+            drifted = model.objects.annotate(n=Count("like")).exclude(like_count=F("n"))
+            self.assertFalse(drifted.exists())
+
+        self.assertEqual(Comment.objects.filter(parent__isnull=True).count(), 10)
+        self.assertFalse(Comment.objects.filter(parent__parent__parent__isnull=False).exists())
+        self.assertFalse(Comment.objects.filter(parent__isnull=False).exclude(post=F("parent__post")).exists())
+        self.assertFalse(Comment.objects.filter(created_at__lt=F("parent__created_at")).exists())
+        for comment in Comment.objects.select_related("parent"):
+            self.assertEqual(comment.path, comment.parent.child_path() if comment.parent else "")
+        self.assertFalse(Like.objects.filter(created_at__lt=F("post__created_at")).exists())
+
+    def test_same_seed_same_rows(self):
+        until = timezone.now()
+
+        def snapshot(prefix):
+            self.seed(until=until, prefix=prefix)
+            rows = [
+                list(model.objects.filter(author__username__startswith=prefix)
+                     .order_by("id").values_list("content", "created_at", "like_count"))
+                for model in (Post, Comment)
+            ]
+            return rows
+
+        self.assertEqual(snapshot("a"), snapshot("b"))
+
+    def test_rerun_with_same_prefix_writes_nothing(self):
+        call_command("seed_load", users=10, posts=5, comments=5, likes=10, prefix="s", stdout=StringIO())
+        rows = [model.objects.count() for model in (User, Post, Comment, Like)]
+
+        with self.assertRaisesMessage(CommandError, "10 of the users s0 to s19 already exist"):
+            call_command("seed_load", users=20, posts=5, comments=5, likes=10, prefix="s", stdout=StringIO())
+        self.assertEqual([model.objects.count() for model in (User, Post, Comment, Like)], rows)
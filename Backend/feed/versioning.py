@@ -0,0 +1,80 @@
+"""
+Global content version for conditional GETs.
+
+Every mutating view calls ``bump_version()`` once its write has gone
+through. The feed and leaderboard hand the current value out as their
+``ETag``, so a poll from a client that is already up to date is answered
+with ``304 Not Modified`` after a single primary-key lookup.
+"""
+from asyncio import iscoroutinefunction
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import F
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
+
+from .models import ContentVersion
+
+
+def current_version():
+    version = (
+        ContentVersion.objects.filter(pk=ContentVersion.SINGLETON_ID)
+        .values_list("version", flat=True)
+        .first()
+    )
+    return version or 0
+
+
+def bump_version():
+    updated = ContentVersion.objects.filter(pk=ContentVersion.SINGLETON_ID).update(
+        version=F("version") + 1
+    )
+    if not updated:
+        # Row missing, e.g. after a flush
+        ContentVersion.objects.get_or_create(pk=ContentVersion.SINGLETON_ID, defaults={"version": 1})
+
+
+def conditional(etag_func):
+    """
+    ``condition(etag_func=...)`` plus ``Cache-Control: no-cache``, which makes
+    browsers revalidate with ``If-None-Match`` on every fetch instead of
+    reusing or dropping their copy. ``etag_func`` stays synchronous for async
+    views too; it runs in a thread.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            return _async_conditional(etag_func, view)
+
+        view_with_etag = condition(etag_func=etag_func)(view)
+
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            response = view_with_etag(request, *args, **kwargs)
+            response.headers.setdefault("Cache-Control", "no-cache")
+            return response
+
+        return inner
+
+    return decorator
+
+
+def _async_conditional(etag_func, view):
+    # Django's condition() only wraps sync views
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        etag = await sync_to_async(etag_func)(request, *args, **kwargs)
+        etag = quote_etag(etag) if etag is not None else None
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+
+        if etag and request.method in ("GET", "HEAD"):
+            response.headers.setdefault("ETag", etag)
+
+        response.headers.setdefault("Cache-Control", "no-cache")
+        return response
+
+    return inner
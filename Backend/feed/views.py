@@ -1,40 +1,102 @@
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from asgiref.sync import sync_to_async
 from django.db import transaction
-from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Sum, Case, When, IntegerField, F
+from django.db.models import Q
 from django.db import transaction, IntegrityError
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Value
-from django.db.models import Count
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.core.handlers.asgi import ASGIRequest
 
 
 
 from .models import Post, Like, Comment
 from .serializers import PostSerializer
+from .fast_feed import COMMENT_FIELDS, POST_FIELDS, attach_comments, feed_response, post_rows
+from .pagination import InvalidCursor, page_queryset, parse_page_size, split_page
+from .async_api import async_api_view, json_response
+from .likes import add_post_like, remove_post_like, add_comment_like, remove_comment_like
+from .karma import forget_likes, subtree_likes
+from .leaderboard import get_leaderboard, leaderboard_etag
+from .versioning import bump_version, conditional, current_version
+from .batch import InvalidOperation, run_batch
+from .comment_tree import comment_subtree, parse_comment_id, parse_depth, parse_limit
+from .routers import read_from_replica
+from .dispatch import get_dispatcher
+from .like_buffer import get_like_buffer
+from .outbox import event_transaction
+from .auth import issue_token
+from .metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 # Import socket events
 try:
-    from .socket_events import broadcast_feed_update, broadcast_like_update, broadcast_comment_update, emit_sync
+    from .socket_events import (
+        publish_post_created, publish_post_deleted, publish_comment_added,
+        publish_comment_deleted, publish_like_count, publish_batch,
+    )
 except ImportError:
-    def broadcast_feed_update(): pass
-    def broadcast_like_update(post_id): pass
-    def broadcast_comment_update(post_id): pass
-    def emit_sync(func): pass
+    def publish_post_created(post, author): pass
+    def publish_post_deleted(post_id): pass
+    def publish_comment_added(comment, author): pass
+    def publish_comment_deleted(comment_id, post_id): pass
+    def publish_like_count(post_id, comment_id=None): pass
+    def publish_batch(like_targets=(), comments_added=(), comments_deleted=()): pass
 
-@api_view(["GET"])
-def feed(request):
-    posts = Post.objects.annotate(
-        like_count=Count("like")
-    ).order_by("-created_at")
-
-    comments = Comment.objects.annotate(
-        like_count=Count("like")
-    ).values(
+def feed_etag(request):
+    return f"feed-{current_version()}"
+
+
+@async_api_view(["GET"])
+@read_from_replica
+@conditional(feed_etag)
+async def feed(request):
+    """
+    Query params:
+        cursor     opaque cursor from a previous page's "next"
+        page_size  posts per page (default FEED_PAGE_SIZE)
+        all=1      legacy mode: every post in one unpaginated list
+    """
+    posts = Post.objects.select_related("author")
+    comments = Comment.objects.all()
+
+    fast = settings.FEED_FAST_PATH
+    if fast:
+        posts = posts.values(*POST_FIELDS)
+
+    legacy = request.GET.get("all") in ("1", "true")
+
+    if legacy:
+        posts = [post async for post in posts.order_by("-created_at", "-id")]
+        next_cursor = None
+    else:
+        page_size = parse_page_size(request.GET.get("page_size"))
+        try:
+            page = page_queryset(posts, request.GET.get("cursor"), page_size)
+        except InvalidCursor as e:
+            return json_response({"error": str(e)}, status=400)
+        posts, next_cursor = split_page([post async for post in page], page_size)
+
+    if not fast:
+        return await sync_to_async(serialized_feed)(posts, comments, legacy, next_cursor)
+
+    posts = post_rows(posts)
+    if not legacy:
+        comments = comments.filter(post_id__in=[p["id"] for p in posts])
+    attach_comments(posts, [row async for row in comments.values_list(*COMMENT_FIELDS)])
+    return feed_response(posts, next_cursor, legacy, asynchronous=isinstance(request, ASGIRequest))
+
+
+def serialized_feed(posts, comments, legacy, next_cursor):
+    """The feed rendered through ``PostSerializer``, when FEED_FAST_PATH is off"""
+    if not legacy:
+        comments = comments.filter(post_id__in=[p.id for p in posts])
+
+    comments = comments.values(
         "id",
         "author__username",
         "author_id",
@@ -56,28 +118,93 @@ def feed(request):
         context={"comments_by_post": comments_by_post},
     )
 
-    return Response(serializer.data)
+    data = serializer.data if legacy else {"results": serializer.data, "next": next_cursor}
+    return HttpResponse(JSONRenderer().render(data), content_type="application/json")
+
+
+
+def comments_etag(request, post_id):
+    return f"comments-{current_version()}"
+
+
+@api_view(["GET"])
+@read_from_replica
+@conditional(comments_etag)
+def comment_tree(request, post_id):
+    """
+    Query params:
+        root   comment whose replies to return (default: the post's top-level comments)
+        depth  levels of replies to nest (default COMMENT_TREE_DEPTH)
+        limit  most comments in the response (default COMMENT_TREE_LIMIT)
+        after  id of the last reply already shown, to fetch the next ones
+    """
+    try:
+        root_id = parse_comment_id(request.GET.get("root"))
+        after = parse_comment_id(request.GET.get("after"))
+    except ValueError:
+        return Response({"error": "root and after must be comment ids"}, status=400)
+
+    try:
+        tree = comment_subtree(
+            post_id,
+            root_id,
+            depth=parse_depth(request.GET.get("depth")),
+            limit=parse_limit(request.GET.get("limit")),
+            after=after,
+        )
+    except Comment.DoesNotExist:
+        return Response({"error": "comment not found"}, status=404)
+
+    return Response(tree)
+
 
+def buffer_like(request, kind, target_id, liked, body):
+    """
+    Write-behind mode: queue the like or unlike and acknowledge it at once.
+    Unknown targets and no-op toggles are dropped when the buffer flushes.
+    """
+    if not request.user or request.user.is_anonymous:
+        return Response({"error": "User not authenticated"}, status=401)
+    get_like_buffer().record(request.user.id, kind, target_id, liked)
+    return Response(body, status=202)
 
 
 @csrf_exempt
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def like_post(request, post_id):
+    if not request.user or request.user.is_anonymous:
+        return Response({"error": "User not authenticated"}, status=401)
+    if settings.LIKE_WRITE_BEHIND:
+        return buffer_like(request, "post", post_id, True, {"status": "liked"})
     try:
-        with transaction.atomic():
-            Like.objects.create(user=request.user, post_id=post_id)
-        emit_sync(lambda: broadcast_like_update(post_id))
+        with event_transaction():
+            add_post_like(request.user, post_id)
+            publish_like_count(post_id)
+        bump_version()
         return Response({"status": "liked"})
+    except Post.DoesNotExist:
+        return Response({"error": "post not found"}, status=404)
     except IntegrityError:
         return Response({"error": "already liked"}, status=400)
 
 @api_view(["POST"])
 def like_comment(request, comment_id):
-    comment = Comment.objects.get(id=comment_id)
-    Like.objects.create(user=request.user, comment=comment)
+    if not request.user or request.user.is_anonymous:
+        return Response({"error": "User not authenticated"}, status=401)
+    if settings.LIKE_WRITE_BEHIND:
+        return buffer_like(request, "comment", comment_id, True, {"ok": True})
+    try:
+        comment = Comment.objects.get(id=comment_id)
+        with event_transaction():
+            add_comment_like(request.user, comment)
+            publish_like_count(comment.post_id, comment.id)
+    except Comment.DoesNotExist:
+        return Response({"error": "comment not found"}, status=404)
+    except IntegrityError:
+        return Response({"error": "already liked"}, status=400)
 
-    emit_sync(lambda: broadcast_comment_update(comment.post_id))
+    bump_version()
 
     return Response({"ok": True})
 
@@ -96,21 +223,29 @@ def add_comment(request, post_id):
         "parent": optional_comment_id
     }
     """
+    if not request.user or request.user.is_anonymous:
+        return Response({"error": "User not authenticated"}, status=401)
     content = request.data.get("content")
     parent_id = request.data.get("parent")
 
     if not content:
         return Response({"error": "content required"}, status=400)
 
-    comment = Comment.objects.create(
-        post_id=post_id,
-        author=request.user,
-        content=content,
-        parent_id=parent_id
-    )
-    
-    emit_sync(lambda: broadcast_comment_update(post_id))
-    
+    try:
+        with event_transaction():
+            comment = Comment.objects.create(
+                post_id=post_id,
+                author=request.user,
+                content=content,
+                parent_id=parent_id
+            )
+            publish_comment_added(comment, request.user.username)
+    except Comment.DoesNotExist:
+        # Raised by the parent's path lookup
+        return Response({"error": "parent not found"}, status=404)
+
+    bump_version()
+
     return Response({
         "status": "comment added",
         "comment": {
@@ -120,32 +255,70 @@ def add_comment(request, post_id):
             "children": []
         }
     })
-@api_view(["GET"])
-def leaderboard(request):
-    last_24h = timezone.now() - timedelta(hours=24)
-
-    scores = (
-        Like.objects.filter(created_at__gte=last_24h)
-        .annotate(
-            owner=Case(
-                When(post__isnull=False, then=F("post__author__username")),
-                When(comment__isnull=False, then=F("comment__author__username")),
-            ),
-            points=Case(
-                When(post__isnull=False, then=Value(5)),
-                default=Value(1),
-                output_field=IntegerField(),
-            ),
-        )
-        .values("owner")
-        .annotate(total=Sum("points"))
-        .order_by("-total")[:5]
-    )
+@csrf_exempt
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def batch(request):
+    """
+    Body:
+    {
+        "operations": [
+            {"op": "like_post", "post_id": 1},
+            {"op": "unlike_post", "post_id": 1},
+            {"op": "like_comment", "comment_id": 2},
+            {"op": "unlike_comment", "comment_id": 2},
+            {"op": "add_comment", "post_id": 1, "content": "hi", "parent": null},
+            {"op": "delete_comment", "comment_id": 2}
+        ]
+    }
+
+    Operations run in order. "results" has one {"status", "data"} per
+    operation with what its single-op endpoint would have answered.
+    """
+    if not request.user or request.user.is_anonymous:
+        return Response({"error": "User not authenticated"}, status=401)
+
+    operations = request.data.get("operations")
+    if not isinstance(operations, list) or not operations:
+        return Response({"error": "operations required"}, status=400)
+    if len(operations) > settings.BATCH_MAX_OPERATIONS:
+        return Response({"error": f"at most {settings.BATCH_MAX_OPERATIONS} operations"}, status=400)
 
-    return Response([
-        {"username": s["owner"], "total": s["total"]}
-        for s in scores
-    ])
+    try:
+        with event_transaction():
+            results, changes = run_batch(request.user, operations)
+            if changes is not None:
+                publish_batch(*changes)
+    except InvalidOperation as e:
+        return Response({"error": str(e)}, status=400)
+    except IntegrityError:
+        # A concurrent request wrote one of the same likes; nothing was applied
+        return Response({"error": "conflict, retry"}, status=409)
+
+    if changes is not None:
+        bump_version()
+
+    return Response({"results": results})
+
+
+@async_api_view(["GET"])
+@read_from_replica
+@conditional(leaderboard_etag)
+async def leaderboard(request):
+    return json_response(await sync_to_async(get_leaderboard)())
+
+
+def metrics(request):
+    """Prometheus scrape endpoint"""
+    if not settings.METRICS_ENABLED:
+        raise Http404()
+    return HttpResponse(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@api_view(["GET"])
+def dispatch_stats(request):
+    """Queue depth and coalescing counters of the socket event dispatcher."""
+    return Response(get_dispatcher().stats())
 
 
 @csrf_exempt
@@ -162,7 +335,7 @@ def signup_view(request):
         return Response({"error": "user exists"}, status=400)
 
     user = User.objects.create_user(username=username, password=password)
-    return Response({"status": "created"})
+    return Response({"status": "created", "user_id": user.id, "token": issue_token(user)})
 
 @csrf_exempt
 @api_view(["POST"])
@@ -174,7 +347,7 @@ def login_view(request):
 
     if user:
         login(request, user)
-        return Response({"status": "logged"})
+        return Response({"status": "logged", "user_id": user.id, "token": issue_token(user)})
     return Response({"error": "invalid"}, status=400)
 @csrf_exempt
 @api_view(["POST"])
@@ -195,12 +368,14 @@ def create_post(request):
         return Response({"error": "User not authenticated"}, status=401)
     
     try:
-        post = Post.objects.create(
-            author=request.user,
-            content=content
-        )
+        with event_transaction():
+            post = Post.objects.create(
+                author=request.user,
+                content=content
+            )
+            publish_post_created(post, request.user.username)
         logger.info(f"✓ Post created successfully: {post.id}")
-        emit_sync(broadcast_feed_update)
+        bump_version()
         return Response({"ok": True, "post_id": post.id})
     except Exception as e:
         logger.error(f"✗ Error creating post: {e}")
@@ -214,8 +389,11 @@ def delete_post(request, post_id):
         post = Post.objects.get(id=post_id)
         if post.author != request.user:
             return Response({"error": "not authorized"}, status=403)
-        post.delete()
-        emit_sync(broadcast_feed_update)
+        with transaction.atomic():
+            forget_likes(Like.objects.filter(Q(post_id=post.id) | Q(comment__post_id=post.id)))
+            post.delete()
+            publish_post_deleted(post_id)
+        bump_version()
         return Response({"status": "post deleted"})
     except Post.DoesNotExist:
         return Response({"error": "post not found"}, status=404)
@@ -224,21 +402,32 @@ def delete_post(request, post_id):
 @api_view(["DELETE"])
 @permission_classes([AllowAny])
 def unlike_post(request, post_id):
+    if not request.user or request.user.is_anonymous:
+        return Response({"error": "User not authenticated"}, status=401)
+    if settings.LIKE_WRITE_BEHIND:
+        return buffer_like(request, "post", post_id, False, {"status": "unliked"})
     try:
-        like = Like.objects.get(user=request.user, post_id=post_id)
-        like.delete()
-        emit_sync(lambda: broadcast_like_update(post_id))
+        with event_transaction():
+            remove_post_like(request.user, post_id)
+            publish_like_count(post_id)
+        bump_version()
         return Response({"status": "unliked"})
     except Like.DoesNotExist:
         return Response({"error": "like not found"}, status=404)
 
 @api_view(["DELETE"])
 def unlike_comment(request, comment_id):
-    like = Like.objects.get(user=request.user, comment_id=comment_id)
-    post_id = like.comment.post_id
-    like.delete()
-
-    emit_sync(lambda: broadcast_comment_update(post_id))
+    if not request.user or request.user.is_anonymous:
+        return Response({"error": "User not authenticated"}, status=401)
+    if settings.LIKE_WRITE_BEHIND:
+        return buffer_like(request, "comment", comment_id, False, {"ok": True})
+    try:
+        with event_transaction():
+            post_id = remove_comment_like(request.user, comment_id)
+            publish_like_count(post_id, comment_id)
+    except Like.DoesNotExist:
+        return Response({"error": "like not found"}, status=404)
+    bump_version()
 
     return Response({"ok": True})
 
@@ -252,7 +441,11 @@ def delete_comment(request, comment_id):
             return Response({"error": "not authorized"}, status=403)
 
         post_id = comment.post_id
-        comment.delete()
+        with transaction.atomic():
+            forget_likes(subtree_likes([(comment.id, post_id, comment.path)]))
+            comment.delete()
+            publish_comment_deleted(comment_id, post_id)
+        bump_version()
 
         return Response({"status": "deleted", "post_id": post_id})
     except Comment.DoesNotExist:
@@ -0,0 +1,73 @@
+"""
+ASGI config serving the Django API and the Socket.IO server in one process.
+
+    uvicorn myproject.asgi_combined:application --port 8000
+
+Socket.IO traffic under /socket.io/ goes to the ``sio`` server from
+socketio_server.py and everything else to Django. Events published by views
+are emitted straight on this process's ``sio`` instead of being POSTed to a
+separate socketio_server.py by socketio_client, so none is needed. ``myproject/asgi.py`` (or WSGI) plus a
+standalone socketio_server.py keeps working as before.
+
+Point the frontend's socket URL at this server's port in this mode.
+"""
+
+import asyncio
+import logging
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+os.environ.setdefault('SOCKET_ASYNC_MODE', 'asgi')
+
+import socketio
+from django.core.asgi import get_asgi_application
+
+django_app = get_asgi_application()
+
+import socketio_server
+from feed.outbox import start_outbox_relay
+from feed.socket_events import use_transport
+
+logger = logging.getLogger(__name__)
+
+sio_app = socketio.ASGIApp(socketio_server.sio, other_asgi_app=django_app)
+
+_loop = None
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("In-process emit failed", exc_info=future.exception())
+
+
+def emit_in_process(event_name, event_data):
+    """
+    Transport for ``feed.socket_events``: broadcast on the local ``sio``.
+    Called from dispatcher threads, so the emit is handed to the event loop.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        socketio_server.broadcast_event(event_name, event_data), _loop
+    )
+    future.add_done_callback(_log_failure)
+
+
+def emit_batch_in_process(events, timeout=5):
+    """Batch transport for the outbox relay: returns once all were broadcast"""
+    async def send():
+        for event_name, event_data in events:
+            await socketio_server.broadcast_event(event_name, event_data)
+
+    if _loop is None:
+        raise ConnectionError("Event loop not started yet")
+    asyncio.run_coroutine_threadsafe(send(), _loop).result(timeout)
+
+
+async def application(scope, receive, send):
+    global _loop
+    if _loop is None:
+        # The first call, of any type, runs on the server's event loop
+        _loop = asyncio.get_running_loop()
+        use_transport(emit_in_process, emit_batch_in_process)
+        # Nothing connects in this mode, so deliver leftovers now
+        start_outbox_relay()
+    await sio_app(scope, receive, send)
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -28,6 +29,8 @@ INSTALLED_APPS = [
 # Middleware
 
 MIDDLEWARE = [
+    # first, so it times everything below it
+    "feed.middleware.MetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -37,6 +40,9 @@ MIDDLEWARE = [
 
     # mock AFTER auth
     "feed.middleware.MockAuthMiddleware",
+    # after mock auth, so writes are limited per mock user too
+    "feed.middleware.AdmissionControlMiddleware",
+    "feed.middleware.ReplicaPinMiddleware",
 
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
@@ -67,9 +73,23 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+    },
+    # Stand-in read replica for local testing: a copy of db.sqlite3 kept
+    # current by `manage.py sync_replica`. Unused unless in DATABASE_REPLICAS.
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "replica.sqlite3",
+    },
 }
 
+DATABASE_ROUTERS = ["feed.routers.ReplicaRouter"]
+
+# Aliases the feed and leaderboard read from; empty means "default" only
+DATABASE_REPLICAS = []
+
+# After a write, that user's reads stay on the primary for this long
+REPLICA_STICKY_SECONDS = 5
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -112,10 +132,113 @@ CORS_ALLOW_HEADERS = [
     "x-mock-user-id",
 ]
 
+# ======================
+# FEED
+# ======================
+
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+
+# Build the feed from .values() rows and stream it (feed/fast_feed.py)
+# instead of going through PostSerializer
+FEED_FAST_PATH = True
+
+# GET /api/comments/<post_id>/: default and maximum levels and nodes per subtree
+COMMENT_TREE_DEPTH = 3
+COMMENT_TREE_MAX_DEPTH = 10
+COMMENT_TREE_LIMIT = 50
+COMMENT_TREE_MAX_LIMIT = 500
+
+# Most operations accepted by one POST /api/batch/
+BATCH_MAX_OPERATIONS = 100
+
+# ======================
+# LIKES
+# ======================
+
+# Write-behind mode (feed/like_buffer.py): acknowledge likes and unlikes with
+# 202 straight away and write them in batches, at most this often or this many
+# pending pairs at a time
+LIKE_WRITE_BEHIND = False
+LIKE_FLUSH_INTERVAL_MS = 200
+LIKE_FLUSH_MAX_ITEMS = 500
+
+# ======================
+# LEADERBOARD
+# ======================
+
+# "buckets" sums KarmaBucket rollups, "likes" aggregates the raw Like table
+LEADERBOARD_ENGINE = "buckets"
+# Coarser buckets mean fewer rows to sum but a fuzzier window edge
+KARMA_BUCKET_SECONDS = 300
+# Seconds a leaderboard snapshot is fresh; 0 disables the cache
+LEADERBOARD_CACHE_TTL = 5
+
+# ======================
+# ADMISSION CONTROL
+# ======================
+
+# Shed /api/ requests with 429/503 + Retry-After (feed/admission.py) instead
+# of letting them queue; when off the middleware isn't installed
+ADMISSION_CONTROL_ENABLED = True
+# Per user (or address, for anonymous clients) and process-wide write rates,
+# in requests/sec, with the bursts allowed on top
+ADMISSION_USER_WRITE_RATE = 10
+ADMISSION_USER_WRITE_BURST = 20
+ADMISSION_GLOBAL_WRITE_RATE = 500
+ADMISSION_GLOBAL_WRITE_BURST = 1000
+# Requests in flight per process; SQLite has one writer, so more concurrent
+# writes only wait on its lock
+ADMISSION_MAX_READS = 64
+ADMISSION_MAX_WRITES = 4
+# Refuse writes while they take longer than this
+ADMISSION_WRITE_LATENCY_MS = 250
+
+# ======================
+# METRICS
+# ======================
+
+# Prometheus text format at /metrics/; when off the middleware isn't installed
+METRICS_ENABLED = True
+
+# ======================
+# SOCKET EVENT DISPATCH
+# ======================
+
+EVENT_DISPATCH_WORKERS = 2
+EVENT_DISPATCH_QUEUE_SIZE = 1000
+# "drop_oldest" or "block" (waits up to 1s, then drops the new event)
+EVENT_DISPATCH_OVERFLOW = "drop_oldest"
+# How long keyed events wait for newer duplicates to coalesce with
+EVENT_DISPATCH_COALESCE_MS = 50
+
+# Transactional outbox (feed/outbox.py): store events in the transaction of
+# the write they announce and relay them in acknowledged batches, so none are
+# lost while the socket server is down. Replaces the dispatcher when on
+SOCKET_OUTBOX_ENABLED = False
+# Relay from a thread in each web process; turn off when running
+# `manage.py relay_outbox` instead
+SOCKET_OUTBOX_RELAY_THREAD = True
+SOCKET_OUTBOX_BATCH_SIZE = 500
+# How often the relay looks for rows it wasn't woken up for
+SOCKET_OUTBOX_POLL_MS = 1000
+
+# ======================
+# AUTH
+# ======================
+
+# Signed tokens from /api/login/ and /api/signup/ stay valid this many seconds
+AUTH_TOKEN_MAX_AGE = 60 * 60 * 24 * 7
+
+# Dev mode: trust ?user_id= / X-Mock-User-ID (used by the frontend's user switcher).
+# Lets anyone act as any user, so opt in with MOCK_AUTH_ENABLED=1
+MOCK_AUTH_ENABLED = os.environ.get("MOCK_AUTH_ENABLED") == "1"
+
 # DRF
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
+        "feed.auth.SignedTokenAuthentication",
         "feed.auth.QueryParamAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
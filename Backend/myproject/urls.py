@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from feed.views import metrics
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics/", metrics),
     path("api/", include("feed.urls")),
 ]
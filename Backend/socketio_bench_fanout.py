@@ -0,0 +1,146 @@
+"""
+Fan-out throughput of socketio_server.py at 1, 2 and 4 worker processes.
+
+Starts the server, connects --clients real websocket clients spread over
+several client processes, has one publisher emit --events broadcasts and
+measures deliveries per second until every client has received every event:
+
+    python socketio_bench_fanout.py --clients 400 --events 200
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+
+import socketio
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RELAY_TOKEN = os.environ.get('SOCKET_RELAY_TOKEN') or secrets.token_urlsafe()
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+def run_clients(url, count, events, ready, done, timeout):
+    async def main():
+        remaining = count * events
+        finished = asyncio.Event()
+        clients = []
+
+        async def connect():
+            client = socketio.AsyncClient(reconnection=False)
+
+            @client.on('post_deleted')
+            async def on_event(data):
+                nonlocal remaining
+                remaining -= 1
+                if remaining == 0:
+                    finished.set()
+
+            await client.connect(url, transports=['websocket'])
+            clients.append(client)
+
+        for start in range(0, count, 50):
+            await asyncio.gather(*(connect() for _ in range(min(50, count - start))))
+        ready.put(count)
+
+        try:
+            await asyncio.wait_for(finished.wait(), timeout)
+            done.put((time.time(), 0))
+        except asyncio.TimeoutError:
+            done.put((time.time(), remaining))
+
+        await asyncio.gather(*(c.disconnect() for c in clients))
+
+    asyncio.run(main())
+
+
+async def publish(url, events):
+    publisher = socketio.AsyncClient(reconnection=False)
+    await publisher.connect(url, auth={'token': RELAY_TOKEN}, transports=['websocket'])
+    start = time.time()
+    for i in range(events):
+        await publisher.emit('post_deleted', {'post_id': i})
+    # Disconnecting right away can drop emits still in the send queue
+    await asyncio.sleep(1)
+    await publisher.disconnect()
+    return start
+
+
+def bench(workers, args):
+    port = args.port
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'socketio_server.py'),
+         '--port', str(port), '--workers', str(workers)],
+        env={**os.environ, 'SOCKET_RELAY_TOKEN': RELAY_TOKEN},
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        time.sleep(0.5 * workers)  # let every worker bind the shared port
+
+        url = f'http://127.0.0.1:{port}'
+        ready, done = multiprocessing.Queue(), multiprocessing.Queue()
+        per_proc = args.clients // args.client_procs
+        procs = [
+            multiprocessing.Process(
+                target=run_clients,
+                args=(url, per_proc, args.events, ready, done, args.timeout),
+            )
+            for _ in range(args.client_procs)
+        ]
+        for p in procs:
+            p.start()
+        for _ in procs:
+            ready.get(timeout=60)
+
+        start = asyncio.run(publish(url, args.events))
+        results = [done.get(timeout=args.timeout + 30) for _ in procs]
+        for p in procs:
+            p.join()
+
+        elapsed = max(t for t, _ in results) - start
+        missing = sum(m for _, m in results)
+        delivered = per_proc * len(procs) * args.events - missing
+        return {
+            'workers': workers,
+            'clients': per_proc * len(procs),
+            'delivered': delivered,
+            'missing': missing,
+            'seconds': round(elapsed, 3),
+            'deliveries_per_sec': round(delivered / elapsed),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=400)
+    parser.add_argument('--client-procs', type=int, default=4)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--port', type=int, default=8011)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    results = [bench(n, args) for n in args.workers]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Latency from publishing an event to its receipt by clients of socketio_server.py.
+
+Starts the server, connects --clients websocket clients and publishes
+--rate events per second for --seconds, every event stamped with its send
+time, in three ways:
+
+* relay: one Socket.IO publisher connection, an emit per event
+* http:  a POST to /ingest/ every --tick ms with what accumulated meanwhile
+* unix:  the same over the server's SOCKET_INGEST_PATH Unix socket
+
+and reports receipt latency percentiles over every client's copy:
+
+    python socketio_bench_ingest.py --clients 50 --rate 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import socketio
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RELAY_TOKEN = os.environ.get('SOCKET_RELAY_TOKEN') or secrets.token_urlsafe()
+MODES = ('relay', 'http', 'unix')
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+async def connect_clients(url, count, latencies):
+    clients = []
+
+    async def connect():
+        client = socketio.AsyncClient(reconnection=False)
+
+        @client.on('post_deleted')
+        async def on_event(data):
+            latencies.append(time.perf_counter() - data['sent_at'])
+
+        await client.connect(url, transports=['websocket'])
+        clients.append(client)
+
+    for start in range(0, count, 50):
+        await asyncio.gather(*(connect() for _ in range(min(50, count - start))))
+    return clients
+
+
+async def publish(mode, url, socket_path, args):
+    """Emit ``args.rate`` events per second; returns how many were sent"""
+    headers = {'Authorization': f'Bearer {RELAY_TOKEN}'}
+    if mode == 'relay':
+        publisher = socketio.AsyncClient(reconnection=False)
+        await publisher.connect(url, auth={'token': RELAY_TOKEN}, transports=['websocket'])
+    else:
+        connector = aiohttp.UnixConnector(path=socket_path) if mode == 'unix' else None
+        session = aiohttp.ClientSession(connector=connector)
+        ingest_url = 'http://localhost/ingest/' if mode == 'unix' else f'{url}/ingest/'
+
+    sent = 0
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    while (now := time.perf_counter()) < deadline:
+        due = int((now - start) * args.rate) - sent
+        events = [['post_deleted', {'post_id': sent + i, 'sent_at': time.perf_counter()}] for i in range(due)]
+        if mode == 'relay':
+            for event_name, event_data in events:
+                await publisher.emit(event_name, event_data)
+        elif events:
+            async with session.post(ingest_url, json={'events': events}, headers=headers) as response:
+                if response.status != 200:
+                    raise RuntimeError(f'ingest failed: {response.status} {await response.text()}')
+        sent += due
+        await asyncio.sleep(args.tick / 1000)
+
+    if mode == 'relay':
+        # Disconnecting right away can drop emits still in the send queue
+        await asyncio.sleep(1)
+        await publisher.disconnect()
+    else:
+        await session.close()
+    return sent
+
+
+async def bench(mode, url, socket_path, args):
+    latencies = []
+    clients = await connect_clients(url, args.clients, latencies)
+    sent = await publish(mode, url, socket_path, args)
+
+    expected = sent * args.clients
+    deadline = time.perf_counter() + args.timeout
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    await asyncio.gather(*(c.disconnect() for c in clients))
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'events': sent,
+        'received': len(latencies),
+        'missing': expected - len(latencies),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--rate', type=int, default=500, help='Events per second')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--tick', type=float, default=10, help='Milliseconds between publishes')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--port', type=int, default=8012)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, 'ingest.sock')
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, 'socketio_server.py'), '--port', str(args.port)],
+            env={**os.environ, 'SOCKET_INGEST_PATH': socket_path, 'SOCKET_RELAY_TOKEN': RELAY_TOKEN},
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(args.port)
+            url = f'http://127.0.0.1:{args.port}'
+            results = [asyncio.run(bench(mode, url, socket_path, args)) for mode in args.modes]
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
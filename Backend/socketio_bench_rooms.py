@@ -0,0 +1,96 @@
+"""
+Fan-out load script for per-post rooms.
+
+Simulates clients in-process (no real sockets) and counts the packets and bytes
+the server would write when per-post events are broadcast to everyone versus
+routed to per-post rooms:
+
+    python socketio_bench_rooms.py --clients 5000 --posts-per-client 20
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import socketio
+
+import socketio_server as server
+
+
+def pick_post(rng, posts):
+    # Newer posts (low indexes) are viewed and liked far more often
+    return min(int(rng.expovariate(1 / 50)), posts - 1)
+
+
+def make_events(rng, args):
+    comment = {'id': 1, 'author': 'alice', 'author_id': 1, 'content': 'x' * 120,
+               'created_at': '2026-01-01T00:00:00Z', 'like_count': 0, 'children': []}
+    events = []
+    for _ in range(args.events):
+        post_id = pick_post(rng, args.posts)
+        if rng.random() < 0.8:
+            events.append(('like_count', {'post_id': post_id, 'comment_id': None,
+                                          'like_count': rng.randint(0, 500)}))
+        else:
+            events.append(('comment_added', {'post_id': post_id, 'parent_id': None,
+                                             'comment': comment}))
+    return events
+
+
+async def run(routed, args):
+    rng = random.Random(args.seed)
+    sio = socketio.AsyncServer(async_mode='aiohttp')
+    totals = {'emits': 0, 'bytes': 0}
+
+    async def count_packet(eio_sid, pkt):
+        totals['emits'] += 1
+        totals['bytes'] += len(pkt.encode())
+
+    sio._send_eio_packet = count_packet
+    server.sio = sio
+    server.connected_clients.clear()
+    server.publishers.clear()
+
+    for i in range(args.clients):
+        sid = await sio.manager.connect(f'eio-{i}', '/')
+        server.connected_clients[sid] = {'user_id': i}
+        if routed:
+            start = min(pick_post(rng, args.posts), args.posts - args.posts_per_client)
+            for post_id in range(start, start + args.posts_per_client):
+                await sio.manager.enter_room(sid, '/', server.post_room(post_id))
+
+    for event_name, event_data in make_events(random.Random(args.seed + 1), args):
+        if routed:
+            await server.broadcast_event(event_name, event_data)
+        else:
+            await sio.emit(event_name, event_data)
+
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=5000)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--posts-per-client', type=int, default=20)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # Keep the per-broadcast log lines out of the report
+    server.print = lambda *a, **k: None
+
+    broadcast = asyncio.run(run(False, args))
+    routed = asyncio.run(run(True, args))
+
+    report = {
+        'broadcast': broadcast,
+        'rooms': routed,
+        'emit_reduction': round(broadcast['emits'] / max(routed['emits'], 1), 1),
+        'byte_reduction': round(broadcast['bytes'] / max(routed['bytes'], 1), 1),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Local pub/sub bus for running several Socket.IO server processes.
+
+A tiny broker listens on a Unix domain socket and forwards every
+newline-delimited JSON frame it receives to all other connected processes.
+``UnixSocketManager`` is a python-socketio client manager on top of it, the
+same way ``AsyncRedisManager`` sits on Redis, so broadcasts from any process
+reach clients on all of them without external services.
+
+Run the broker on its own (socketio_server.py --workers N starts one for you):
+    python socketio_bus.py /tmp/socketio-bus.sock
+"""
+import asyncio
+import json
+import os
+import sys
+
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+# Large enough for any single event payload
+MAX_FRAME = 16 * 1024 * 1024
+
+
+async def serve_broker(path):
+    subscribers = set()
+
+    async def handle(reader, writer):
+        subscribers.add(writer)
+        try:
+            while True:
+                frame = await reader.readline()
+                if not frame:
+                    break
+                for sub in list(subscribers):
+                    if sub is not writer:
+                        sub.write(frame)
+                await asyncio.gather(
+                    *(sub.drain() for sub in subscribers if sub is not writer),
+                    return_exceptions=True,
+                )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            subscribers.discard(writer)
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle, path=path, limit=MAX_FRAME)
+    async with server:
+        await server.serve_forever()
+
+
+def run_broker(path):
+    try:
+        asyncio.run(serve_broker(path))
+    except KeyboardInterrupt:
+        pass
+
+
+class UnixSocketManager(AsyncPubSubManager):
+    """Client manager that shares events over a ``socketio_bus`` broker.
+
+    :param path: Path of the broker's Unix domain socket.
+    :param channel: Only frames on this channel are delivered. Must be the
+                    same in all the servers.
+    """
+    name = 'unixsocket'
+
+    def __init__(self, path, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _connect(self):
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                self._reader, self._writer = await asyncio.open_unix_connection(
+                    self.path, limit=MAX_FRAME
+                )
+
+    async def _publish(self, data):
+        frame = json.dumps({'channel': self.channel, 'data': data}) + '\n'
+        for attempt in range(2):
+            try:
+                await self._connect()
+                self._writer.write(frame.encode())
+                await self._writer.drain()
+                return
+            except (ConnectionError, FileNotFoundError):
+                self._writer = None
+                if attempt:
+                    self._get_logger().error('Cannot publish to bus at %s', self.path)
+
+    async def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                await self._connect()
+                frame = await self._reader.readline()
+                if not frame:
+                    raise ConnectionError('bus closed the connection')
+                retry_sleep = 1
+            except (ConnectionError, FileNotFoundError):
+                self._writer = None
+                self._get_logger().error(
+                    'Bus connection lost, retrying in %s seconds', retry_sleep
+                )
+                await asyncio.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
+                continue
+
+            message = json.loads(frame)
+            if message.get('channel') == self.channel:
+                yield message['data']
+
+
+if __name__ == '__main__':
+    run_broker(sys.argv[1] if len(sys.argv) > 1 else '/tmp/socketio-bus.sock')
@@ -1,59 +1,99 @@
 """
-Socket.IO event emitter - Connect to standalone server and emit events
+Socket.IO event emitter - POST events to the standalone server's /ingest/
+endpoint, which broadcasts them before answering
+
+Each thread keeps its own keep-alive connection, over the server's Unix
+socket when SOCKET_INGEST_PATH is set and TCP otherwise.
 """
-import socketio
+import http.client
+import json
+import os
+import socket
 import threading
-
-# Connect to the Socket.IO server
-sio_client = socketio.Client(
-    reconnection=True,
-    reconnection_delay=1,
-    reconnection_delay_max=5,
-    reconnection_attempts=5,
-    logger=False,
-    engineio_logger=False
-)
+from urllib.parse import urlsplit
 
 server_url = "http://127.0.0.1:8001"
+# Identifies this process as a publisher whose events the server relays;
+# must match the server's
+relay_token = os.environ.get('SOCKET_RELAY_TOKEN', '')
+# The server's Unix socket for events (its SOCKET_INGEST_PATH), else TCP
+ingest_path = os.environ.get('SOCKET_INGEST_PATH')
+# Whether the last request reached the server
 is_connected = False
+# Called whenever the server is reached after it wasn't, e.g. to resend
+# what failed in the meantime
+connect_callbacks = []
 
-@sio_client.event
-def connect():
-    global is_connected
-    is_connected = True
-    print("✓ Connected to Socket.IO server")
+_local = threading.local()
+
+class UnixHTTPConnection(http.client.HTTPConnection):
 
-@sio_client.event
-def disconnect():
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+def _connection(timeout):
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        if ingest_path:
+            conn = UnixHTTPConnection(ingest_path, timeout)
+        else:
+            url = urlsplit(server_url)
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+        _local.conn = conn
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+    return conn
+
+def _set_connected(connected):
     global is_connected
-    is_connected = False
-    print("✗ Disconnected from Socket.IO server")
+    was_connected, is_connected = is_connected, connected
+    if connected and not was_connected:
+        print("✓ Reached Socket.IO server")
+        for callback in connect_callbacks:
+            callback()
 
-def init_socket_client():
-    """Initialize connection to Socket.IO server"""
-    try:
-        if not is_connected:
-            thread = threading.Thread(target=connect_to_server, daemon=True)
-            thread.start()
-    except Exception as e:
-        print(f"Socket client init error: {e}")
+def _post(events, timeout):
+    if not relay_token:
+        raise ConnectionError("SOCKET_RELAY_TOKEN is not set")
+    body = json.dumps({'events': events})
+    headers = {'Authorization': f'Bearer {relay_token}', 'Content-Type': 'application/json'}
+    # A kept-alive connection the server has since closed fails once
+    for attempt in range(2):
+        conn = _connection(timeout)
+        try:
+            conn.request('POST', '/ingest/', body=body, headers=headers)
+            response = conn.getresponse()
+            content = response.read()
+            break
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            _local.conn = None
+            if attempt:
+                _set_connected(False)
+                raise ConnectionError(f"Socket server unreachable: {e}") from e
 
-def connect_to_server():
-    """Connect to the standalone Socket.IO server"""
-    try:
-        sio_client.connect(server_url, wait_timeout=10)
-    except Exception as e:
-        print(f"Connection failed: {e}")
+    _set_connected(True)
+    if response.status != 200:
+        raise ConnectionError(f"Events rejected: {response.status} {content[:200]!r}")
+    return json.loads(content)
 
 def emit_event(event_name, event_data):
-    """Emit event to connected clients"""
+    """Emit event to connected clients; dropped if the server can't be reached"""
     try:
-        if is_connected:
-            sio_client.emit(event_name, event_data, namespace='/')
-        else:
-            print(f"Socket server not connected, queuing event: {event_name}")
+        _post([[event_name, event_data]], timeout=5)
     except Exception as e:
-        print(f"Emit error: {e}")
+        print(f"Dropping event {event_name}: {e}")
 
-# Auto-connect on import
-init_socket_client()
+def emit_batch(events, timeout=5):
+    """
+    Send ``[event_name, event_data]`` pairs in one request. Returns once the
+    server has broadcast them all; raises otherwise.
+    """
+    return _post(events, timeout)
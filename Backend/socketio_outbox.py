@@ -0,0 +1,152 @@
+"""
+Per-client outbound queues for the Socket.IO server.
+
+python-socketio hands every emit straight to each client's Engine.IO queue,
+which has no size limit: a client that reads slowly makes the server hold
+every event for it, forever. ``OutboxManager`` puts a bounded queue of its
+own in front of that one and only moves events across while the client keeps
+up, so its Engine.IO queue stays a few packets deep:
+
+* events with the same ``coalesce_key()`` replace each other while they wait,
+  so a lagging client gets the latest like count instead of every one
+* past ``max_queue`` the oldest waiting events are dropped
+* a client still dropping events ``slow_client_grace`` seconds later is
+  disconnected; the browser reconnects and refetches
+
+Emits with callbacks bypass the queue. Combine it with a pub/sub manager by
+listing that first, so events from other processes go through it too:
+
+    class BusManager(UnixSocketManager, OutboxManager): ...
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from itertools import count
+
+from socketio.async_manager import AsyncManager
+
+
+class ClientOutbox:
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        # key -> (event, data), oldest first
+        self.events = OrderedDict()
+        self.ready = asyncio.Event()
+        self.task = None
+        # When the client last went over max_queue, None while under it
+        self.full_since = None
+        self.sent = self.coalesced = self.dropped = 0
+
+
+class OutboxManager(AsyncManager):
+    # Events a client can have waiting before the oldest are dropped
+    max_queue = 256
+    # Engine.IO packets a client can have in flight before we hold back
+    transport_watermark = 8
+    # Seconds a client can stay over max_queue before it is disconnected
+    slow_client_grace = 10.0
+    # How often a held-back client's queue is checked again
+    poll_interval = 0.05
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outboxes = {}
+        self._ids = count()
+
+    def coalesce_key(self, event, data):
+        """Events with equal non-None keys supersede each other."""
+        return None
+
+    def events_lost(self, sid):
+        """Called when ``sid`` will miss an event or get one out of order."""
+
+    async def emit(self, event, data, namespace, room=None, skip_sid=None,
+                   callback=None, to=None, **kwargs):
+        if callback is not None:
+            return await super().emit(event, data, namespace, room=room, skip_sid=skip_sid,
+                                      callback=callback, to=to, **kwargs)
+        room = to or room
+        if namespace not in self.rooms:
+            return
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+
+        key = self.coalesce_key(event, data)
+        for sid, _ in list(self.get_participants(namespace, room)):
+            if sid not in skip_sid:
+                self._enqueue(sid, namespace, key, event, data)
+
+    def _enqueue(self, sid, namespace, key, event, data):
+        outbox = self.outboxes.get(sid)
+        if outbox is None:
+            outbox = self.outboxes[sid] = ClientOutbox(namespace)
+            outbox.task = asyncio.create_task(self._drain(sid, outbox))
+
+        if key is not None and key in outbox.events:
+            # Keeps its place in line, so a steady stream can't starve it,
+            # but then goes out ahead of the events queued after it
+            if next(reversed(outbox.events)) != key:
+                self.events_lost(sid)
+            outbox.events[key] = (event, data)
+            outbox.coalesced += 1
+            return
+        outbox.events[next(self._ids) if key is None else key] = (event, data)
+
+        if len(outbox.events) > self.max_queue:
+            outbox.events.popitem(last=False)
+            outbox.dropped += 1
+            self.events_lost(sid)
+            now = time.monotonic()
+            if outbox.full_since is None:
+                outbox.full_since = now
+            elif now - outbox.full_since > self.slow_client_grace:
+                outbox.events.clear()
+                asyncio.create_task(self.server.disconnect(sid, namespace=namespace))
+        outbox.ready.set()
+
+    def _transport_queue(self, sid, namespace):
+        """Packets waiting in the client's Engine.IO queue, None once it is gone."""
+        eio_sid = self.eio_sid_from_sid(sid, namespace)
+        socket = self.server.eio.sockets.get(eio_sid) if eio_sid else None
+        return None if socket is None else socket.queue.qsize()
+
+    async def _drain(self, sid, outbox):
+        while True:
+            await outbox.ready.wait()
+            while outbox.events:
+                waiting = self._transport_queue(sid, outbox.namespace)
+                if waiting is None:
+                    self.outboxes.pop(sid, None)
+                    return
+                if waiting >= self.transport_watermark:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+
+                _, (event, data) = outbox.events.popitem(last=False)
+                if len(outbox.events) < self.max_queue:
+                    outbox.full_since = None
+                await super().emit(event, data, outbox.namespace, to=sid)
+                outbox.sent += 1
+            outbox.ready.clear()
+
+    async def disconnect(self, sid, namespace, **kwargs):
+        outbox = self.outboxes.pop(sid, None)
+        if outbox is not None:
+            outbox.task.cancel()
+        return await super().disconnect(sid, namespace, **kwargs)
+
+    def stats(self):
+        """Queue depth and counters of every client with an outbox."""
+        now = time.monotonic()
+        return {
+            sid: {
+                'queued': len(outbox.events),
+                'transport_queued': self._transport_queue(sid, outbox.namespace) or 0,
+                'sent': outbox.sent,
+                'coalesced': outbox.coalesced,
+                'dropped': outbox.dropped,
+                'full_seconds': round(now - outbox.full_since, 3) if outbox.full_since else 0,
+            }
+            for sid, outbox in self.outboxes.items()
+        }
@@ -1,45 +1,249 @@
 """
 Standalone Socket.IO server for real-time updates
 Run this alongside Django: python manage.py runserver & python socketio_server.py
+
+Django POSTs its events to /ingest/ (socketio_client.py), with
+SOCKET_RELAY_TOKEN as a bearer token, over TCP or the Unix socket at
+SOCKET_INGEST_PATH, and they are relayed to browsers. The answer comes once
+they have been broadcast:
+
+    POST /ingest/  {"events": [["post_deleted", {"post_id": 1}], ...]}
+
+Socket.IO clients that connect with the token are relayed as well. Set the
+same secret SOCKET_RELAY_TOKEN for both processes; without one nothing is
+relayed.
+
+Per-post events only go to the clients that subscribed to that post's room:
+
+    socket.emit('subscribe', {post_ids: [1, 2, 3]})
+    socket.emit('unsubscribe', {post_ids: [3]})
+
+To use more than one core, run N processes sharing port 8001 and a local
+pub/sub bus (socketio_bus.py); a broadcast from any process reaches clients on
+all of them:
+
+    python socketio_server.py --workers 4
+
+Sessions are not sticky across processes, so clients must connect with the
+websocket transport only in that mode.
+
+myproject/asgi_combined.py instead mounts this server in the Django ASGI
+process (SOCKET_ASYNC_MODE=asgi), where events are emitted in-process.
+
+Each client gets a bounded outbound queue (socketio_outbox.py): waiting
+like_count and leaderboard_update events are replaced by newer ones, and
+clients that stay too far behind are disconnected. GET / reports the queues.
+
+Broadcasts carry a ``seq`` that increases by one per event, and the last
+SOCKET_REPLAY_BUFFER_SIZE are kept. A client that reconnects re-subscribes,
+then sends the ``epoch`` and last ``seq`` it saw, and the ``sid`` it had, to
+get what it missed instead of refetching the feed:
+
+    socket.emit('resume', {epoch, seq, sid: previousSocketId}, (ack) => ...)
+
+The ack is ``{status: 'ok', replayed: n}`` with the missed events following
+in order, or ``{status: 'resync'}`` when they are no longer all in the buffer,
+the epoch is another process's (each process numbers its own clients'
+events, and a restart starts a new epoch) or the old sid's outbound queue
+dropped events or sent them out of order. Both carry the current epoch and
+seq.
 """
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
 import socketio
 import threading
 import time
 import asyncio
+import hmac
+import json
+import uuid
+from collections import OrderedDict, deque
 from http import HTTPStatus
 from aiohttp import web
 
+from feed.metrics import REGISTRY, CONTENT_TYPE, COUNT_BUCKETS, FANOUT_BUCKETS
+from socketio_bus import UnixSocketManager, run_broker
+from socketio_outbox import OutboxManager
+
+# Set for worker processes started by --workers
+BUS_PATH = os.environ.get('SOCKET_BUS_PATH')
+
+# 'asgi' when mounted next to Django by myproject/asgi_combined.py
+ASYNC_MODE = os.environ.get('SOCKET_ASYNC_MODE', 'aiohttp')
+
+# Only the latest of these matters to a client that hasn't received it yet
+COALESCED_EVENTS = {'like_count', 'leaderboard_update'}
+
+# Every browser client, so broadcasts skip publishers on every process
+CLIENTS_ROOM = 'clients'
+
+def post_room(post_id):
+    return f'post:{post_id}'
+
+class ClientManager(OutboxManager):
+    max_queue = int(os.environ.get('SOCKET_CLIENT_QUEUE_SIZE', '256'))
+    slow_client_grace = float(os.environ.get('SOCKET_SLOW_CLIENT_GRACE', '10'))
+    replay_buffer_size = int(os.environ.get('SOCKET_REPLAY_BUFFER_SIZE', '1000'))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        # (seq, event, data, room) of the latest broadcasts
+        self.history = deque(maxlen=self.replay_buffer_size)
+        # Recent sids that missed or reordered events, which can't resume
+        self.lossy = OrderedDict()
+
+    async def emit(self, event, data, namespace, room=None, skip_sid=None,
+                   callback=None, to=None, **kwargs):
+        room = to or room
+        if callback is None and isinstance(data, dict) and (
+                room == CLIENTS_ROOM or str(room).startswith('post:')):
+            self.seq += 1
+            data = {**data, 'seq': self.seq}
+            self.history.append((self.seq, event, data, room))
+        return await super().emit(event, data, namespace, room=room, skip_sid=skip_sid,
+                                  callback=callback, **kwargs)
+
+    def missed(self, seq, rooms):
+        """
+        ``(event, data)`` of the broadcasts after ``seq`` to any of ``rooms``,
+        or None if some of them are no longer buffered
+        """
+        oldest = self.history[0][0] if self.history else self.seq + 1
+        if not 0 <= seq <= self.seq or seq + 1 < oldest:
+            return None
+        return [(event, data) for s, event, data, room in self.history if s > seq and room in rooms]
+
+    def events_lost(self, sid):
+        self.lossy[sid] = True
+        self.lossy.move_to_end(sid)
+        if len(self.lossy) > self.replay_buffer_size:
+            self.lossy.popitem(last=False)
+
+    def coalesce_key(self, event, data):
+        if event == 'like_count' and isinstance(data, dict):
+            return (event, data.get('post_id'), data.get('comment_id'))
+        if event in COALESCED_EVENTS:
+            return (event,)
+        return None
+
+class BusManager(UnixSocketManager, ClientManager):
+    """Events from the bus go through the outbound queues as well"""
+
 # Create Socket.IO server
 sio = socketio.AsyncServer(
-    async_mode='aiohttp',
+    async_mode=ASYNC_MODE,
     cors_allowed_origins='*',
+    client_manager=BusManager(BUS_PATH) if BUS_PATH else ClientManager(),
     engineio_logger=False,
     logger=False
 )
 
-app = web.Application()
-sio.attach(app)
+# Prometheus metrics at /metrics/
+METRICS_ENABLED = os.environ.get('SOCKET_METRICS_ENABLED', '1') == '1'
+
+HTTP_LATENCY = REGISTRY.histogram(
+    'socket_http_request_duration_seconds', 'Socket server HTTP latency', ('route', 'method')
+)
+BROADCASTS = REGISTRY.counter(
+    'socket_broadcasts_total', 'Events broadcast to clients', ('event',)
+)
+FANOUT = REGISTRY.histogram(
+    'socket_broadcast_fanout', 'Clients of this process reached per broadcast', ('event',), FANOUT_BUCKETS
+)
+RESUMES = REGISTRY.counter(
+    'socket_resumes_total', 'Reconnecting clients, by whether their missed events could be replayed', ('outcome',)
+)
+REPLAYED = REGISTRY.counter(
+    'socket_replayed_events_total', 'Missed events replayed to resuming clients'
+)
+INGESTED = REGISTRY.counter(
+    'socket_ingested_events_total', 'Events POSTed to /ingest/, by outcome', ('outcome',)
+)
+INGEST_BATCH = REGISTRY.histogram(
+    'socket_ingest_batch_size', 'Ingested events broadcast per consumer wake-up', (), COUNT_BUCKETS
+)
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """Time plain HTTP routes; Socket.IO connections are long-lived, so skip them"""
+    if request.path.startswith('/socket.io'):
+        return await handler(request)
+    start = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource else 'unmatched'
+        HTTP_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method)
 
 # Store connected clients
 connected_clients = {}
 
-# Event queue for pending broadcasts
-pending_events = []
+REGISTRY.gauge_func(
+    'socket_connected_clients', 'Browser clients connected to this process',
+    lambda: {(): len(connected_clients)},
+)
+
+def _outbox_totals():
+    totals = {}
+    for stats in sio.manager.stats().values():
+        for stat, value in stats.items():
+            totals[(stat,)] = totals.get((stat,), 0) + value
+    return totals
+
+REGISTRY.gauge_func(
+    'socket_client_outbox', 'Outbound queue depth and counters, summed over clients',
+    _outbox_totals, ('stat',),
+)
+
+# Django processes allowed to publish events through this server; unset
+# means none are
+RELAY_TOKEN = os.environ.get('SOCKET_RELAY_TOKEN', '')
+publishers = set()
+
+# Events about a single post, delivered only to that post's room
+PER_POST_EVENTS = {'comment_added', 'comment_deleted', 'like_count'}
+
+# Cap on rooms a single client can hold, roughly a few feed pages of posts
+MAX_SUBSCRIPTIONS = 200
+
+# Events POSTed to /ingest/ wait here for consume_ingest(), which takes up
+# to INGEST_MAX_BATCH at a time
+INGEST_QUEUE_SIZE = int(os.environ.get('SOCKET_INGEST_QUEUE_SIZE', '10000'))
+INGEST_MAX_BATCH = int(os.environ.get('SOCKET_INGEST_MAX_BATCH', '500'))
+# Also serve HTTP on this Unix socket (single process only, not with --workers)
+INGEST_PATH = os.environ.get('SOCKET_INGEST_PATH')
+ingest_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
 
 @sio.event
-async def connect(sid, environ):
+async def connect(sid, environ, auth=None):
     """Handle client connection"""
     try:
+        if isinstance(auth, dict) and _is_relay_token(auth.get('token')):
+            publishers.add(sid)
+            print(f"✓ Publisher connected: {sid}")
+            return
+
         user_id = environ.get('HTTP_X_USER_ID', 'anonymous')
         connected_clients[sid] = {'user_id': user_id}
+        await sio.enter_room(sid, CLIENTS_ROOM)
         print(f"✓ Socket connected - User {user_id}: {sid} (Total: {len(connected_clients)})")
-        await sio.emit('connect_response', {'status': 'connected'}, to=sid)
+        await sio.emit('connect_response', {
+            'status': 'connected', 'epoch': sio.manager.epoch, 'seq': sio.manager.seq,
+        }, to=sid)
     except Exception as e:
         print(f"Connection error: {e}")
 
 @sio.event
 async def disconnect(sid):
     """Handle client disconnection"""
+    publishers.discard(sid)
     if sid in connected_clients:
         user_id = connected_clients[sid].get('user_id', 'anonymous')
         del connected_clients[sid]
@@ -50,44 +254,241 @@ async def ping(data):
     """Handle ping/heartbeat"""
     return {'status': 'pong'}
 
+def _post_ids(data):
+    post_ids = data.get('post_ids', []) if isinstance(data, dict) else []
+    return [int(p) for p in post_ids if str(p).isdigit()]
+
+@sio.event
+async def subscribe(sid, data):
+    """Join the rooms of the posts the client currently renders"""
+    rooms = {r for r in sio.rooms(sid) if r.startswith('post:')}
+    for post_id in _post_ids(data):
+        room = post_room(post_id)
+        if room in rooms:
+            continue
+        if len(rooms) >= MAX_SUBSCRIPTIONS:
+            return {'status': 'error', 'error': 'too many subscriptions'}
+        await sio.enter_room(sid, room)
+        rooms.add(room)
+    return {'status': 'ok'}
+
+@sio.event
+async def unsubscribe(sid, data):
+    """Leave the rooms of posts the client no longer renders"""
+    for post_id in _post_ids(data):
+        await sio.leave_room(sid, post_room(post_id))
+    return {'status': 'ok'}
+
+@sio.event
+async def resume(sid, data):
+    """Replay the broadcasts a reconnecting client missed, or ask it to resync"""
+    manager = sio.manager
+    data = data if isinstance(data, dict) else {}
+    missed = None
+    if (data.get('epoch') == manager.epoch and isinstance(data.get('seq'), int)
+            and isinstance(data.get('sid'), str) and data['sid'] not in manager.lossy):
+        missed = manager.missed(data['seq'], set(sio.rooms(sid)))
+
+    position = {'epoch': manager.epoch, 'seq': manager.seq}
+    if missed is None:
+        RESUMES.inc(outcome='resync')
+        return {'status': 'resync', **position}
+    # Queued ahead of any newer broadcast
+    for event_name, event_data in missed:
+        await sio.emit(event_name, event_data, to=sid)
+    RESUMES.inc(outcome='replayed')
+    REPLAYED.inc(len(missed))
+    return {'status': 'ok', 'replayed': len(missed), **position}
+
+@sio.on('*')
+async def relay(event_name, sid, event_data):
+    """Relay events published by Django to browser clients"""
+    if sid in publishers:
+        await broadcast_event(event_name, event_data)
+
+@sio.event
+async def events_batch(sid, events):
+    """Broadcast a publisher's batch of [event_name, event_data] pairs, then acknowledge it"""
+    if sid not in publishers:
+        return {'status': 'error', 'error': 'not a publisher'}
+    for event_name, event_data in events:
+        await broadcast_event(event_name, event_data)
+    return {'status': 'ok', 'count': len(events)}
+
 async def broadcast_event(event_name, event_data):
-    """Broadcast event to all connected clients"""
-    if connected_clients:
-        await sio.emit(event_name, event_data, skip_sid=None)
-        print(f"📢 Broadcast: {event_name} to {len(connected_clients)} clients")
-
-async def process_pending_events():
-    """Process queued events (called periodically)"""
-    global pending_events
-    if pending_events and connected_clients:
-        for event_name, event_data in pending_events:
-            await broadcast_event(event_name, event_data)
-        pending_events = []
-
-async def start_background_tasks(app):
-    """Start background task to process events"""
-    async def event_processor():
-        while True:
-            await process_pending_events()
-            await asyncio.sleep(0.1)
-    
-    import asyncio
-    asyncio.create_task(event_processor())
+    """Broadcast event to interested clients: a post's room or everyone"""
+    room = CLIENTS_ROOM
+    if event_name in PER_POST_EVENTS and isinstance(event_data, dict):
+        room = post_room(event_data.get('post_id'))
+    # With a bus this also reaches the clients of every other process
+    await sio.emit(event_name, event_data, room=room)
+    BROADCASTS.inc(event=event_name)
+    FANOUT.observe(len(sio.manager.rooms.get('/', {}).get(room, ())), event=event_name)
+    print(f"📢 Broadcast: {event_name} to {room}")
+
+def _is_relay_token(token):
+    return bool(RELAY_TOKEN) and isinstance(token, str) and hmac.compare_digest(token.encode(), RELAY_TOKEN.encode())
+
+def _ingest_authorized(request):
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and _is_relay_token(token)
+
+async def ingest(request):
+    """
+    Broadcast a batch of events from Django: a JSON body of
+    ``{"events": [[event_name, event_data], ...]}`` with the relay token as a
+    bearer token. Answers 200 once every event has been broadcast, so a
+    caller can forget them then; 503 with Retry-After if they don't all fit
+    in the queue.
+    """
+    if not _ingest_authorized(request):
+        return web.json_response({'error': 'invalid relay token'}, status=HTTPStatus.UNAUTHORIZED)
+    try:
+        events = (await request.json())['events']
+        events = [(str(event_name), event_data) for event_name, event_data in events]
+    except (ValueError, KeyError, TypeError):
+        return web.json_response({'error': 'expected {"events": [[name, data], ...]}'},
+                                 status=HTTPStatus.BAD_REQUEST)
+
+    # All or nothing, so a retried batch isn't partly broadcast twice
+    if ingest_queue.maxsize - ingest_queue.qsize() < len(events):
+        INGESTED.inc(len(events), outcome='rejected')
+        return web.json_response({'error': 'ingest queue full'}, status=HTTPStatus.SERVICE_UNAVAILABLE,
+                                 headers={'Retry-After': '1'})
+    done = asyncio.get_running_loop().create_future()
+    for i, (event_name, event_data) in enumerate(events):
+        ingest_queue.put_nowait((event_name, event_data, done, i == len(events) - 1))
+    INGESTED.inc(len(events), outcome='queued')
+    if events:
+        try:
+            await done
+        except Exception as e:
+            return web.json_response({'error': f'broadcast failed: {e}'},
+                                     status=HTTPStatus.INTERNAL_SERVER_ERROR)
+    return web.json_response({'status': 'ok', 'broadcast': len(events)})
+
+def coalesce_like_counts(events):
+    """Keep the last ``like_count`` per target of ``(event_name, data, ...)`` tuples, in its place"""
+    def target(event):
+        if event[0] == 'like_count' and isinstance(event[1], dict):
+            return (event[1].get('post_id'), event[1].get('comment_id'))
+        return None
+
+    last = {target(event): i for i, event in enumerate(events) if target(event) is not None}
+    return [event for i, event in enumerate(events) if target(event) is None or last[target(event)] == i]
+
+async def consume_ingest():
+    """
+    Broadcast ingested events as soon as they arrive. While idle that is one
+    at a time; under load, whatever queued up during the previous broadcasts
+    goes out as one batch, with superseded like counts dropped. A request is
+    answered once its last event has been broadcast, which, the queue being
+    in order, is after all of its others.
+    """
+    while True:
+        batch = [await ingest_queue.get()]
+        while len(batch) < INGEST_MAX_BATCH and not ingest_queue.empty():
+            batch.append(ingest_queue.get_nowait())
+        INGEST_BATCH.observe(len(batch))
+        events = coalesce_like_counts(batch)
+        INGESTED.inc(len(batch) - len(events), outcome='coalesced')
+        for event_name, event_data, done, _ in events:
+            try:
+                await broadcast_event(event_name, event_data)
+            except Exception as e:
+                print(f"Broadcast error: {event_name}: {e}")
+                if not done.done():
+                    done.set_exception(e)
+        for _, _, done, last in batch:
+            if last and not done.done():
+                done.set_result(None)
+
+async def start_ingest(app):
+    app['ingest_consumer'] = asyncio.create_task(consume_ingest())
+
+async def stop_ingest(app):
+    app['ingest_consumer'].cancel()
 
 async def index(request):
-    """Health check endpoint"""
-    return web.Response(text='Socket.IO server running', status=HTTPStatus.OK)
+    """Health check endpoint, with every client's outbound queue"""
+    queues = sio.manager.stats()
+    body = {
+        'status': 'ok',
+        'pid': os.getpid(),
+        'clients': len(connected_clients),
+        'queued': sum(q['queued'] for q in queues.values()),
+        'queues': {
+            sid: {**q, 'user_id': connected_clients.get(sid, {}).get('user_id')}
+            for sid, q in queues.items()
+        },
+    }
+    return web.Response(text=json.dumps(body), content_type='application/json', status=HTTPStatus.OK)
 
-# Add routes
-app.router.add_get('/', index)
+async def metrics(request):
+    """Prometheus scrape endpoint"""
+    return web.Response(text=REGISTRY.render(), headers={'Content-Type': CONTENT_TYPE})
 
-def run_server():
+def create_app():
+    """The standalone aiohttp app serving ``sio`` and the plain HTTP routes"""
+    app = web.Application(middlewares=[metrics_middleware] if METRICS_ENABLED else [])
+    sio.attach(app)
+    app.router.add_get('/', index)
+    app.router.add_post('/ingest/', ingest)
+    app.on_startup.append(start_ingest)
+    app.on_cleanup.append(stop_ingest)
+    if METRICS_ENABLED:
+        app.router.add_get('/metrics/', metrics)
+    return app
+
+def run_server(host='127.0.0.1', port=8001):
     """Run the Socket.IO server"""
     try:
-        print("🚀 Starting Socket.IO server on http://127.0.0.1:8001")
-        web.run_app(app, host='127.0.0.1', port=8001, print=lambda x: None)
+        print(f"🚀 Starting Socket.IO server on http://{host}:{port} (pid {os.getpid()})")
+        if not RELAY_TOKEN:
+            print("⚠ SOCKET_RELAY_TOKEN is not set, no events will be relayed")
+        path = INGEST_PATH if INGEST_PATH and not BUS_PATH else None
+        web.run_app(create_app(), host=host, port=port, path=path, reuse_port=bool(BUS_PATH),
+                    print=lambda x: None)
     except Exception as e:
         print(f"Server error: {e}")
 
+def run_cluster(host, port, workers, bus_path=None):
+    """Run a bus broker plus ``workers`` server processes sharing one port"""
+    bus_path = bus_path or os.path.join(tempfile.gettempdir(), f'socketio-bus-{os.getpid()}.sock')
+    broker = threading.Thread(target=run_broker, args=(bus_path,), daemon=True)
+    broker.start()
+    while not os.path.exists(bus_path):
+        time.sleep(0.01)
+
+    # Turn SIGTERM into SystemExit so the workers are always cleaned up
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    env = {**os.environ, 'SOCKET_BUS_PATH': bus_path}
+    procs = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--host', host, '--port', str(port)],
+            env=env,
+        )
+        for _ in range(workers)
+    ]
+    try:
+        for proc in procs:
+            proc.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            proc.terminate()
+
 if __name__ == '__main__':
-    run_server()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--bus', help='Unix socket path for the worker bus')
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        run_cluster(args.host, args.port, args.workers, args.bus)
+    else:
+        run_server(args.host, args.port)
@@ -6,14 +6,17 @@ function getAuthParams() {
 }
 
 function headers() {
+  const token = localStorage.getItem("token");
   return {
     "Content-Type": "application/json",
+    ...(token ? { Authorization: `Bearer ${token}` } : {}),
   };
 }
 
 export async function getFeed() {
   const res = await fetch(`${BASE}/feed/${getAuthParams()}`, { headers: headers() });
-  return res.json();
+  const data = await res.json();
+  return data.results;
 }
 
 export function likePost(id) {
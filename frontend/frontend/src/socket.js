@@ -25,24 +25,24 @@ export function initSocket() {
     console.log("✗ Socket disconnected from real-time server");
   });
 
-  socket.on("feed_update", (data) => {
-    console.log("📢 Feed update received");
-    if (listeners.feedUpdate) {
-      listeners.feedUpdate(data);
-    }
+  [
+    ["post_created", "postCreated"],
+    ["post_deleted", "postDeleted"],
+    ["comment_added", "commentAdded"],
+    ["comment_deleted", "commentDeleted"],
+    ["like_count", "likeCount"],
+  ].forEach(([event, listener]) => {
+    socket.on(event, (data) => {
+      if (listeners[listener]) {
+        listeners[listener](data);
+      }
+    });
   });
 
-  socket.on("comment_update", (data) => {
-    console.log("💬 Comment update received");
-    if (listeners.commentUpdate) {
-      listeners.commentUpdate(data);
-    }
-  });
-
-  socket.on("like_update", (data) => {
-    console.log("❤️ Like update received");
-    if (listeners.likeUpdate) {
-      listeners.likeUpdate(data);
+  socket.on("leaderboard_update", (data) => {
+    console.log("🏆 Leaderboard update received");
+    if (listeners.leaderboardUpdate) {
+      listeners.leaderboardUpdate(data);
     }
   });
 
@@ -53,16 +53,28 @@ export function initSocket() {
   return socket;
 }
 
-export function onFeedUpdate(callback) {
-  listeners.feedUpdate = callback;
+export function onPostCreated(callback) {
+  listeners.postCreated = callback;
+}
+
+export function onPostDeleted(callback) {
+  listeners.postDeleted = callback;
+}
+
+export function onCommentAdded(callback) {
+  listeners.commentAdded = callback;
+}
+
+export function onCommentDeleted(callback) {
+  listeners.commentDeleted = callback;
 }
 
-export function onCommentUpdate(callback) {
-  listeners.commentUpdate = callback;
+export function onLikeCount(callback) {
+  listeners.likeCount = callback;
 }
 
-export function onLikeUpdate(callback) {
-  listeners.likeUpdate = callback;
+export function onLeaderboardUpdate(callback) {
+  listeners.leaderboardUpdate = callback;
 }
 
 export function getSocket() {
@@ -3,6 +3,7 @@ import Feed from "./components/Feed";
 import Leaderboard from "./components/Leaderboard";
 import UserSwitcher from "./components/Userswitcher";
 import { getLeaderboard } from "./api";
+import { getSocket, onLeaderboardUpdate } from "./socket";
 
 export default function App() {
   const [leaderboard, setLeaderboard] = useState([]);
@@ -15,6 +16,13 @@ export default function App() {
     refreshLeaderboard();
   }, []);
 
+  // The server pushes the leaderboard whenever it changes
+  useEffect(() => {
+    getSocket();
+    onLeaderboardUpdate(data => setLeaderboard(data.leaderboard));
+    return () => onLeaderboardUpdate(null);
+  }, []);
+
   return (
     <div className="min-h-screen bg-gradient-to-br from-slate-900 via-slate-800 to-slate-900 text-white">
       <nav className="bg-black/40 backdrop-blur p-4 flex justify-between">
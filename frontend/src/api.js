@@ -6,14 +6,21 @@ function getAuthParams() {
 }
 
 function headers() {
+  const token = localStorage.getItem("token");
   return {
     "Content-Type": "application/json",
+    ...(token ? { Authorization: `Bearer ${token}` } : {}),
   };
 }
 
-export async function getFeed() {
-  const res = await fetch(`${BASE}/feed/${getAuthParams()}`, { headers: headers() });
-  return res.json();
+// One page of the feed; pass the previous page's `next` to get the one after it
+export async function getFeed(cursor = null) {
+  const params = new URLSearchParams(getAuthParams());
+  if (cursor) params.set("cursor", cursor);
+  const query = params.toString();
+  const res = await fetch(`${BASE}/feed/${query ? `?${query}` : ""}`, { headers: headers() });
+  const data = await res.json();
+  return { posts: data.results, next: data.next };
 }
 
 export function likePost(id) {
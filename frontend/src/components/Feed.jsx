@@ -26,12 +26,25 @@ export default function Feed({ refreshLeaderboard }) {
   const [posts, setPosts] = useState([]);
   const [text, setText] = useState("");
   const [likedPosts, setLikedPosts] = useState(new Set());
+  const [next, setNext] = useState(null);
 
   const refresh = () => {
-    getFeed().then(setPosts);
+    getFeed().then(page => {
+      setPosts(page.posts);
+      setNext(page.next);
+    });
     refreshLeaderboard();
   };
 
+  const loadMore = async () => {
+    const page = await getFeed(next);
+    setPosts(current => {
+      const seen = new Set(current.map(p => p.id));
+      return [...current, ...page.posts.filter(p => !seen.has(p.id))];
+    });
+    setNext(page.next);
+  };
+
   useEffect(() => {
     refresh();
   }, []);
@@ -118,6 +131,12 @@ export default function Feed({ refreshLeaderboard }) {
           </div>
         </div>
       ))}
+
+      {next && (
+        <button onClick={loadMore} className="w-full bg-slate-800 py-3 rounded-xl text-slate-300">
+          Load more
+        </button>
+      )}
     </div>
   );
 }
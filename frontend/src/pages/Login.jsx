@@ -19,7 +19,9 @@ export default function Login() {
     });
 
     if (res.ok) {
+      const data = await res.json();
       localStorage.setItem("logged", "1");
+      localStorage.setItem("token", data.token);
       nav("/app");
     } else {
       alert("Login failed");